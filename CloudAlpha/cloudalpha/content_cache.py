@@ -0,0 +1,378 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+from collections import OrderedDict
+from threading import Lock, get_ident
+import hashlib
+import json
+import os
+
+from cloudalpha.exceptions import InvalidTargetFileSystemError
+
+class ContentCache(object):
+    """A cache of file contents stored in a local directory, which may be shared by
+    several FileSystemView instances.
+    
+    Files are identified by account, path and revision, so that an outdated copy of
+    a file is never served. The least recently used files and the oldest partial files
+    are evicted when the total size of the cached and partial files exceeds the given budget.
+    
+    A file is cached once all its bytes have been read through the cache, in any order.
+    Until then, the reads are redirected to the file system, and the data read is written
+    to a partial file, of which at most _MAX_PARTIAL_FILES are kept.
+    
+    The directory may be shared by several processes, each of them enforcing the
+    budget over the files it knows about.
+    """
+
+    _MAX_PARTIAL_FILES = 64
+    _PARTIAL_FILE_SUFFIX = ".part"
+
+    _dir = None
+    _max_size = 0
+    _size = 0
+    _files = None
+    _partial_files = None
+    _lock = None
+
+    def _get_key(self, unique_id, path, metadata):
+        """Return the name of the cache file corresponding to the given account, path and FileMetadata object."""
+        revision = metadata.revision
+        if revision is None:
+            revision = [metadata.size, metadata.modified_time]
+        return hashlib.sha1(json.dumps([unique_id, path, revision]).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _delete_files(file_paths):
+        """Delete the files corresponding to the given paths, ignoring those that are already gone."""
+        for file_path in file_paths:
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _is_orphan(filename):
+        """Return True if the partial file of the given name was left by a process that is no longer running."""
+        try:
+            pid = int(filename.rsplit("-", 2)[1])
+        except (IndexError, ValueError):
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except OSError:
+            pass
+        return False
+
+    @staticmethod
+    def _get_covered_size(ranges):
+        """Return the number of bytes covered by the given list of disjoint [start, end] ranges."""
+        return sum(end - start for start, end in ranges)
+
+    @staticmethod
+    def _discard_partial_files(partial_files):
+        """Close and delete the given partially cached files."""
+        for partial_file in partial_files:
+            try:
+                os.close(partial_file[0])
+                os.remove(partial_file[1])
+            except OSError:
+                pass
+
+    @staticmethod
+    def _add_range(ranges, start, end):
+        """Add the byte range from start to end to the given sorted list of disjoint [start, end] ranges,
+        merging it with the ranges it overlaps or touches.
+        """
+        index = 0
+        while index < len(ranges) and ranges[index][1] < start:
+            index += 1
+        while index < len(ranges) and ranges[index][0] <= end:
+            start = min(start, ranges[index][0])
+            end = max(end, ranges[index][1])
+            del ranges[index]
+        ranges.insert(index, [start, end])
+
+    def _remove_partial_file(self, key):
+        """Stop tracking the partially cached file corresponding to key, mark it as discarded, and return it.
+        Its bytes no longer count against the budget. Must be called with the lock held.
+        """
+        partial_file = self._partial_files.pop(key)
+        partial_file[4] = True
+        self._size -= partial_file[5]
+        partial_file[5] = 0
+        return partial_file
+
+    def _evict(self, discarded_files):
+        """Forget the least recently used files but the most recently used one, then the oldest partially
+        cached files, then the most recently used file, until the total size of the cached and partially
+        cached files fits the budget. Return the paths of the forgotten files, and add to the given list
+        the forgotten partially cached files that no thread is writing, which the caller deletes after
+        releasing the lock.
+        """
+        file_paths = []
+        while self._size > self._max_size and len(self._files) > 1:
+            key, size = self._files.popitem(last=False)
+            self._size -= size
+            file_paths.append(os.path.join(self._dir, key))
+        while self._size > self._max_size and self._partial_files:
+            partial_file = self._remove_partial_file(next(iter(self._partial_files)))
+            if partial_file[3] == 0:
+                discarded_files.append(partial_file)
+        while self._size > self._max_size and self._files:
+            key, size = self._files.popitem(last=False)
+            self._size -= size
+            file_paths.append(os.path.join(self._dir, key))
+        return file_paths
+
+    def _forget(self, key):
+        """Forget the cached file corresponding to key, whose copy is missing or unreadable."""
+        with self._lock:
+            size = self._files.pop(key, None)
+            if size is not None:
+                self._size -= size
+
+    def _lookup(self, key):
+        """Return True if the file corresponding to key is cached, and mark it as the most recently used."""
+        with self._lock:
+            if key in self._files:
+                self._files.move_to_end(key)
+                return True
+        # The file may have been cached by another process sharing the directory
+        try:
+            size = os.stat(os.path.join(self._dir, key)).st_size
+        except OSError:
+            return False
+        evicted_paths = []
+        discarded_files = []
+        with self._lock:
+            if key not in self._files:
+                self._files[key] = size
+                self._size += size
+                evicted_paths = self._evict(discarded_files)
+            found = key in self._files
+            if found:
+                self._files.move_to_end(key)
+        self._delete_files(evicted_paths)
+        self._discard_partial_files(discarded_files)
+        return found
+
+    def _read_cached(self, key, start_byte, num_bytes):
+        """Return the requested bytes of the cached file corresponding to key. If the file is not cached, return None."""
+        if not self._lookup(key):
+            return None
+        try:
+            with open(os.path.join(self._dir, key), "rb") as file:
+                file.seek(start_byte)
+                return bytearray(file.read(num_bytes))
+        except OSError:
+            self._forget(key)
+            return None
+
+    def _open_partial_file(self, key):
+        """Return the partially cached file corresponding to key, creating it if needed, and register
+        the calling thread as one of its writers. If it cannot be created, return None.
+        
+        A partially cached file is a list [fd, file_path, ranges, writers, discarded, size], where ranges
+        is the sorted list of the [start, end] byte ranges written to it, and size is the number of bytes
+        they cover, which count against the budget.
+        """
+        with self._lock:
+            partial_file = self._partial_files.get(key)
+            if partial_file is not None:
+                partial_file[3] += 1
+                self._partial_files.move_to_end(key)
+                return partial_file
+        file_path = os.path.join(self._dir, "%s-%d-%d%s" % (key, os.getpid(), get_ident(), self._PARTIAL_FILE_SUFFIX))
+        try:
+            fd = os.open(file_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        except OSError:
+            return None
+        new_partial_file = [fd, file_path, [], 1, False, 0]
+        discarded_files = []
+        with self._lock:
+            partial_file = self._partial_files.get(key)
+            if partial_file is not None:
+                # Another thread created it meanwhile
+                partial_file[3] += 1
+                self._partial_files.move_to_end(key)
+                discarded_files.append(new_partial_file)
+            else:
+                partial_file = self._partial_files[key] = new_partial_file
+                while len(self._partial_files) > self._MAX_PARTIAL_FILES:
+                    oldest_partial_file = self._remove_partial_file(next(iter(self._partial_files)))
+                    if oldest_partial_file[3] == 0:
+                        discarded_files.append(oldest_partial_file)
+        self._discard_partial_files(discarded_files)
+        return partial_file
+
+    def _append(self, key, file_size, start_byte, data):
+        """Write data read from the file system at its offset in the partially cached file corresponding
+        to key, so that the blocks of a file read concurrently may be cached in any order. When the whole
+        file is written, make it available.
+        
+        The data is written without holding the lock. A partially cached file is only closed once
+        all the threads writing to it are done.
+        """
+        if file_size > self._max_size or not data:
+            return
+        with self._lock:
+            if key in self._files:
+                return
+        partial_file = self._open_partial_file(key)
+        if partial_file is None:
+            return
+        fd, file_path, ranges = partial_file[:3]
+        try:
+            written = os.pwrite(fd, data, start_byte)
+        except OSError:
+            written = 0
+        evicted_paths = []
+        discarded_files = []
+        complete = False
+        with self._lock:
+            partial_file[3] -= 1
+            if written == len(data) and not partial_file[4]:
+                self._add_range(ranges, start_byte, start_byte + written)
+                if partial_file[3] == 0 and ranges == [[0, file_size]]:
+                    self._remove_partial_file(key)
+                    complete = True
+                else:
+                    size = self._get_covered_size(ranges)
+                    self._size += size - partial_file[5]
+                    partial_file[5] = size
+            elif not partial_file[4]:
+                self._remove_partial_file(key)
+            if not complete:
+                if partial_file[4] and partial_file[3] == 0:
+                    discarded_files.append(partial_file)
+                evicted_paths = self._evict(discarded_files)
+        self._delete_files(evicted_paths)
+        self._discard_partial_files(discarded_files)
+        if not complete:
+            return
+        try:
+            os.close(fd)
+            os.replace(file_path, os.path.join(self._dir, key))
+        except OSError:
+            self._delete_files([file_path])
+            return
+        evicted_paths = []
+        discarded_files = []
+        with self._lock:
+            if key not in self._files:
+                self._files[key] = file_size
+                self._size += file_size
+                evicted_paths = self._evict(discarded_files)
+        self._delete_files(evicted_paths)
+        self._discard_partial_files(discarded_files)
+
+    def read(self, file_system, unique_id, path, start_byte, num_bytes=None, metadata=None):
+        """Read the number of bytes corresponding to num_bytes from the file of the given FileSystem
+        corresponding to path, beginning at start_byte, from the cache if possible.
+        
+        unique_id is the unique ID of the account to which the file system belongs. If metadata
+        is not set to the FileMetadata object of the file, it is requested from the file system.
+        
+        The arguments, the return value and the exceptions raised are the same as those
+        of FileSystem.read.
+        """
+        if metadata is None:
+            metadata = file_system.get_metadata(path)
+        if metadata.is_dir:
+            raise InvalidTargetFileSystemError()
+        if num_bytes is None:
+            num_bytes = metadata.size - start_byte
+        if start_byte >= metadata.size or num_bytes <= 0:
+            return bytearray()
+        key = self._get_key(unique_id, path, metadata)
+        data = self._read_cached(key, start_byte, num_bytes)
+        if data is None:
+            data = file_system.read(path, start_byte, num_bytes)
+            self._append(key, metadata.size, start_byte, data)
+        return data
+
+    def open(self, file_system, unique_id, path):
+        """Return a file object open for reading in binary mode on the cached copy of the file of the
+        given FileSystem corresponding to path. If the file is not cached, return None.
+        
+        unique_id is the unique ID of the account to which the file system belongs.
+        
+        The contents of the returned file do not change while it is open, even if the copy is evicted.
+        The caller must close it.
+        
+        If the given path is invalid, raise InvalidPathFileSystemError.
+        If the given path corresponds to a directory, raise InvalidTargetFileSystemError.
+        If the real file system is inaccessible, raise AccessFailedFileSystemError.
+        """
+        metadata = file_system.get_metadata(path)
+        if metadata.is_dir:
+            raise InvalidTargetFileSystemError()
+        key = self._get_key(unique_id, path, metadata)
+        if not self._lookup(key):
+            return None
+        try:
+            return open(os.path.join(self._dir, key), "rb")
+        except OSError:
+            return None
+
+    def after_fork(self):
+        """Replace the lock inherited from the parent process, and close the copies of the descriptors
+        of its partially cached files, which the parent keeps writing.
+        Must be called in a child process created by os.fork, before using the cache.
+        """
+        self._lock = Lock()
+        for partial_file in self._partial_files.values():
+            self._size -= partial_file[5]
+            try:
+                os.close(partial_file[0])
+            except OSError:
+                pass
+        self._partial_files = OrderedDict()
+
+    def __init__(self, dir_path, max_size):
+        """Create a cache storing at most max_size bytes in the directory corresponding to dir_path.
+        
+        The directory is created if it does not exist. The files it already contains are
+        reused, the oldest ones being evicted first. The partial files left by processes that
+        are no longer running are deleted, while those of running processes are left to them.
+        """
+        self._dir = os.path.abspath(dir_path)
+        self._max_size = max_size
+        self._files = OrderedDict()
+        self._partial_files = OrderedDict()
+        self._lock = Lock()
+        os.makedirs(self._dir, exist_ok=True)
+        cached_files = []
+        for filename in os.listdir(self._dir):
+            file_path = os.path.join(self._dir, filename)
+            if filename.endswith(self._PARTIAL_FILE_SUFFIX):
+                if self._is_orphan(filename[:-len(self._PARTIAL_FILE_SUFFIX)]):
+                    self._delete_files([file_path])
+            elif os.path.isfile(file_path):
+                stat_result = os.stat(file_path)
+                cached_files.append((stat_result.st_mtime, filename, stat_result.st_size))
+        for mtime, filename, size in sorted(cached_files):
+            self._files[filename] = size
+            self._size += size
+        self._delete_files(self._evict([]))
@@ -0,0 +1,168 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+from array import array
+
+from cloudalpha.file_metadata import FileMetadata
+
+
+class ContentListing(object):
+    """An immutable sequence of FileMetadata objects representing the contents of a directory.
+    
+    The metadata is stored column by column, in parallel arrays of names, sizes, times
+    and flags, which takes a fraction of the memory used by one FileMetadata object per entry.
+    The FileMetadata objects are built when accessed, and are not kept.
+    
+    A listing is populated with add and append, before being shared.
+    """
+
+    _parent_paths = None
+    _names = None
+    _is_dir = None
+    _sizes = None
+    _created_times = None
+    _accessed_times = None
+    _modified_times = None
+    _revisions = None
+    _indexes = None
+    _lowercase_indexes = None
+
+    @staticmethod
+    def _to_time(value):
+        """Return the given number of seconds since the epoch, or None if value is the NaN standing for None."""
+        if value != value:
+            return None
+        return value
+
+    @staticmethod
+    def _from_time(time):
+        """Return the given number of seconds since the epoch as a float, or NaN if time is None."""
+        if time is None:
+            return float("nan")
+        return time
+
+    @classmethod
+    def from_metadata(cls, content_metadata):
+        """Return a ContentListing holding the given iterable of FileMetadata objects.
+        If content_metadata is already a ContentListing, return it as is.
+        """
+        if isinstance(content_metadata, ContentListing):
+            return content_metadata
+        listing = cls()
+        for metadata in content_metadata:
+            listing.append(metadata)
+        return listing
+
+    @classmethod
+    def from_columns(cls, columns):
+        """Return a ContentListing holding the entries of the given dictionary returned by to_columns."""
+        listing = cls()
+        for parent_path in columns["parent_paths"]:
+            if listing._parent_paths and listing._parent_paths[-1] == parent_path:
+                parent_path = listing._parent_paths[-1]
+            listing._parent_paths.append(parent_path)
+        listing._names = list(columns["names"])
+        listing._is_dir = bytearray(columns["is_dir"])
+        listing._sizes = array("q", columns["sizes"])
+        listing._created_times = array("d", columns["created_times"])
+        listing._accessed_times = array("d", columns["accessed_times"])
+        listing._modified_times = array("d", columns["modified_times"])
+        listing._revisions = list(columns["revisions"])
+        return listing
+
+    def to_columns(self):
+        """Return a dictionary of lists holding the entries column by column, which can be serialized to JSON."""
+        return {"parent_paths": self._parent_paths, "names": self._names, "is_dir": list(self._is_dir),
+                "sizes": self._sizes.tolist(), "created_times": self._created_times.tolist(),
+                "accessed_times": self._accessed_times.tolist(), "modified_times": self._modified_times.tolist(),
+                "revisions": self._revisions}
+
+    @property
+    def names(self):
+        """Return the list of the short names of the entries, in order."""
+        return list(self._names)
+
+    def add(self, path, is_dir=False, size=0, created_time=None, accessed_time=None, modified_time=None, revision=None):
+        """Add an entry to the listing without building a FileMetadata object. The arguments are those of the FileMetadata initializer."""
+        parent_path, name = path.rstrip("/").rsplit("/", 1)
+        # Entries usually share their parent path, which is then stored once
+        if self._parent_paths and self._parent_paths[-1] == parent_path:
+            parent_path = self._parent_paths[-1]
+        self._parent_paths.append(parent_path)
+        self._names.append(name)
+        self._is_dir.append(1 if is_dir else 0)
+        self._sizes.append(size)
+        self._created_times.append(self._from_time(created_time))
+        self._accessed_times.append(self._from_time(accessed_time))
+        self._modified_times.append(self._from_time(modified_time))
+        self._revisions.append(revision)
+        self._indexes = None
+        self._lowercase_indexes = None
+
+    def append(self, metadata):
+        """Add the entry represented by the given FileMetadata object to the listing."""
+        self.add(metadata.path, metadata.is_dir, metadata.size, metadata.created_time,
+                 metadata.accessed_time, metadata.modified_time, metadata.revision)
+
+    def get(self, name, ignore_case=False):
+        """Return a FileMetadata object representing the entry whose short name is the given name,
+        compared case-insensitively if ignore_case is True. If there is no such entry, return None.
+        """
+        if ignore_case:
+            indexes = self._lowercase_indexes
+            if indexes is None:
+                indexes = self._lowercase_indexes = dict((entry_name.lower(), index)
+                                                         for index, entry_name in enumerate(self._names))
+            name = name.lower()
+        else:
+            indexes = self._indexes
+            if indexes is None:
+                indexes = self._indexes = dict((entry_name, index) for index, entry_name in enumerate(self._names))
+        index = indexes.get(name)
+        if index is None:
+            return None
+        return self[index]
+
+    def __len__(self):
+        """Return the number of entries in the listing."""
+        return len(self._names)
+
+    def __getitem__(self, index):
+        """Return a FileMetadata object representing the entry at the given index."""
+        return FileMetadata(self._parent_paths[index] + "/" + self._names[index], bool(self._is_dir[index]), self._sizes[index],
+                            self._to_time(self._created_times[index]), self._to_time(self._accessed_times[index]),
+                            self._to_time(self._modified_times[index]), self._revisions[index])
+
+    def __iter__(self):
+        """Return an iterator over FileMetadata objects representing the entries, in order."""
+        for index in range(len(self._names)):
+            yield self[index]
+
+    def __init__(self):
+        """Create an empty listing."""
+        self._parent_paths = []
+        self._names = []
+        self._is_dir = bytearray()
+        self._sizes = array("q")
+        self._created_times = array("d")
+        self._accessed_times = array("d")
+        self._modified_times = array("d")
+        self._revisions = []
@@ -19,35 +19,61 @@
 # http://github.com/plbrault/cloudalpha
 # =============================================================================
 
+from datetime import datetime
+
+
 class FileMetadata(object):
-    """Class representing the metadata of a file."""
+    """Class representing the metadata of a file.
+    
+    The times are stored as numbers of seconds since the epoch. The corresponding
+    datetime objects, which are naive and express the time in UTC, are only built when first requested.
+    
+    The attributes are declared in __slots__, as a listing may hold a large number of instances.
+    The short name of the file, excluding its location, is computed once, in the name attribute.
+    """
 
-    path = ""
-    is_dir = False
-    size = 0
-    created_datetime = None
-    accessed_datetime = None
-    modified_datetime = None
+    __slots__ = ("path", "name", "is_dir", "size", "created_time", "accessed_time", "modified_time", "revision",
+                 "_created_datetime", "_accessed_datetime", "_modified_datetime")
 
     @property
-    def name(self):
-        """Return the short name of the file, excluding its location."""
-        path = self.path
-        if path[-1:] == "/":
-            path = path[:-1]
-        return path.rsplit("/", 1)[-1]
+    def created_datetime(self):
+        """Return the date and time of creation of the file as a datetime object, or None if not available."""
+        if self._created_datetime is None and self.created_time is not None:
+            self._created_datetime = datetime.utcfromtimestamp(self.created_time)
+        return self._created_datetime
+
+    @property
+    def accessed_datetime(self):
+        """Return the date and time of the last access to the file as a datetime object, or None if not available."""
+        if self._accessed_datetime is None and self.accessed_time is not None:
+            self._accessed_datetime = datetime.utcfromtimestamp(self.accessed_time)
+        return self._accessed_datetime
+
+    @property
+    def modified_datetime(self):
+        """Return the date and time of the last modification to the file as a datetime object, or None if not available."""
+        if self._modified_datetime is None and self.modified_time is not None:
+            self._modified_datetime = datetime.utcfromtimestamp(self.modified_time)
+        return self._modified_datetime
 
-    def __init__(self, path="", is_dir=False, size=0, created_datetime=None, accessed_datetime=None, modified_datetime=None):
-        """FileMetadata initializer"""
+    def __init__(self, path="", is_dir=False, size=0, created_time=None, accessed_time=None, modified_time=None, revision=None):
+        """FileMetadata initializer. The times are numbers of seconds since the epoch."""
         self.path = path
+        if path[-1:] == "/":
+            path = path[:-1]
+        self.name = path.rsplit("/", 1)[-1]
         self.is_dir = is_dir
         self.size = size
-        self.created_datetime = created_datetime
-        self.accessed_datetime = accessed_datetime
-        self.modified_datetime = modified_datetime
+        self.created_time = created_time
+        self.accessed_time = accessed_time
+        self.modified_time = modified_time
+        self.revision = revision
+        self._created_datetime = None
+        self._accessed_datetime = None
+        self._modified_datetime = None
 
     def __str__(self):
         """Return a string representing the object."""
         return ('FileMetadata(path="' + self.path + '", name="' + self.name + '", is_dir=' + str(self.is_dir) + ", size=" + str(self.size)
             + ", created_datetime=" + str(self.created_datetime) + ", accessed_datetime=" + str(self.accessed_datetime)
-            + ", modified_datetime=" + str(self.modified_datetime) + ")")
+            + ", modified_datetime=" + str(self.modified_datetime) + ", revision=" + str(self.revision) + ")")
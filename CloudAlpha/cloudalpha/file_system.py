@@ -20,6 +20,8 @@
 # =============================================================================
 
 from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from cloudalpha.exceptions import InvalidPathFileSystemError
 from cloudalpha.file_system_view import FileSystemView
 
 class FileSystem(object):
@@ -31,16 +33,41 @@ class FileSystem(object):
     instance of an Account subclass.
     
     FileSystem subclasses must be implemented in a thread-safe way.
+    
+    supports_recursive_listing is True if the subclass implements get_tree_metadata.
+    
+    supports_local_files is True if the subclass stores the files on the local disk, and implements
+    open_local_file, which allows sending them without copying their contents in Python.
+    
+    Subclasses that cache information about the real file system call _notify_modified after
+    each modification, and implement invalidate_cache, so that the instances copied in other
+    processes can be kept up to date. Subclasses whose state must only be kept up to date
+    by a single process, like an in-memory mirror of the account, implement get_replica_update
+    and apply_replica_update, so that the changes made to it are copied to the other processes.
     """
 
     __metaclass__ = ABCMeta
 
+    _BATCH_MAX_WORKERS = 8
+
     _account = None
+    _modification_listeners = None
+
+    supports_recursive_listing = False
+    supports_local_files = False
+
+    @property
+    def account(self):
+        """Return the Account instance to which the file system belongs."""
+        return self._account
 
     @property
     @abstractmethod
     def lock(self):
-        """Return the Lock object for the current instance."""
+        """Return the Lock object for the current instance.
+        
+        Holding it prevents any other thread from operating on the file system.
+        """
 
     @property
     @abstractmethod
@@ -122,17 +149,67 @@ class FileSystem(object):
         If the real file system is inaccessible, raise AccessFailedFileSystemError. 
         """
 
+    def _map_concurrently(self, function, items):
+        """Return the list of the results of function applied to each of the given items,
+        computed concurrently by a pool of at most _BATCH_MAX_WORKERS threads.
+        If a call raises an exception, raise it.
+        """
+        items = list(items)
+        if len(items) <= 1:
+            return [function(item) for item in items]
+        with ThreadPoolExecutor(min(len(items), self._BATCH_MAX_WORKERS)) as executor:
+            return list(executor.map(function, items))
+
+    def _get_metadata_or_none(self, path):
+        """Return the FileMetadata object corresponding to the given path, or None if the path is invalid."""
+        try:
+            return self.get_metadata(path)
+        except InvalidPathFileSystemError:
+            return None
+
+    def get_metadata_many(self, paths):
+        """Return a list of FileMetadata objects representing the files or directories corresponding
+        to the given iterable of paths, in the same order. For each invalid path, the list contains None.
+        
+        The given paths must be absolute POSIX pathnames, with "/" representing the root of the file system.
+        
+        Unless overridden, the metadata is requested concurrently by a pool of threads. The calling thread
+        must therefore not hold a lock on any of the given paths.
+        
+        If the real file system is inaccessible, raise AccessFailedFileSystemError.
+        """
+        return self._map_concurrently(self._get_metadata_or_none, paths)
+
     @abstractmethod
     def get_content_metadata(self, path):
         """Return an iterable of FileMetadata objects representing the contents of the directory corresponding to the given path.
         
         The given path must be an absolute POSIX pathname, with "/" representing the root of the file system.
         
+        The return value must not be modified. It may be a ContentListing, which stores the contents of large
+        directories compactly.
+        
         If the given path is invalid, raise InvalidPathFileSystemError.
         If the given path does not point to a directory, raise InvalidTargetFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.         
         """
 
+    def get_tree_metadata(self, path):
+        """Return a dictionary mapping the path of the directory corresponding to the given path, and the path
+        of each of its subdirectories, to an iterable of FileMetadata objects representing its contents.
+        The paths of the subdirectories are those of their FileMetadata objects.
+        
+        The given path must be an absolute POSIX pathname, with "/" representing the root of the file system.
+        
+        Only subclasses whose supports_recursive_listing attribute is True implement this method.
+        Otherwise, raise NotImplementedError.
+        
+        If the given path is invalid, raise InvalidPathFileSystemError.
+        If the given path does not point to a directory, raise InvalidTargetFileSystemError.
+        If the real file system is inaccessible, raise AccessFailedFileSystemError.
+        """
+        raise NotImplementedError()
+
     @abstractmethod
     def get_created_datetime(self, path):
         """Return the date and time of creation of the file or directory corresponding to the given path.
@@ -240,6 +317,22 @@ class FileSystem(object):
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
 
+    def open_local_file(self, path):
+        """Return a file object open for reading in binary mode on the local file holding the contents
+        of the file corresponding to the given path. The contents of the returned file do not change
+        while it is open, even if the file is replaced or deleted. The caller must close it.
+        
+        The given path must be an absolute POSIX pathname, with "/" representing the root of the file system.
+        
+        Only subclasses whose supports_local_files attribute is True implement this method.
+        Otherwise, raise NotImplementedError.
+        
+        If the given path is invalid, raise InvalidPathFileSystemError.
+        If the given path corresponds to a directory, raise InvalidTargetFileSystemError.
+        If the real file system is inaccessible, raise AccessFailedFileSystemError.
+        """
+        raise NotImplementedError()
+
     @abstractmethod
     def create_new_file(self):
         """Create an empty file that will be populated by successive calls to write_to_new_file. Return a unique
@@ -281,11 +374,76 @@ class FileSystem(object):
         If the real file system is inaccessible, raise AccessFailedFileSystemError.                
         """
 
+    def get_path_lock(self, *paths):
+        """Return a Lock object preventing other threads from operating on the given paths,
+        on their subpaths and from modifying their ancestors, for operations that span several calls.
+        
+        The given paths must be absolute POSIX pathnames, with "/" representing the root of the file system.
+        
+        Unless overridden, return the lock of the whole file system.
+        """
+        return self.lock
+
     def get_new_view(self):
         """Return a new FileSystemView linked to the current FileSystem subclass instance."""
         return FileSystemView(self)
 
+    def add_modification_listener(self, listener):
+        """Register a function to be called with the absolute path of each file or directory
+        modified through the current instance, after the modification.
+        
+        The function is called by the thread that made the modification.
+        """
+        self._modification_listeners.append(listener)
+
+    def _notify_modified(self, path):
+        """Call the registered modification listeners with the given path."""
+        for listener in self._modification_listeners:
+            listener(path)
+
+    def invalidate_cache(self, path):
+        """Forget any information cached about the given path, its subpaths and its parent directory,
+        as they were modified by another process.
+        
+        The given path must be an absolute POSIX pathname, with "/" representing the root of the file system.
+        
+        Unless overridden, do nothing.
+        """
+
+    def set_shared_metadata_store(self, shared_metadata_store):
+        """Make the metadata caches of the current instance also store their entries in the given
+        SharedMetadataStore, so that they are shared with the instances copied in other processes.
+        
+        Unless overridden, do nothing.
+        """
+
+    def get_replica_update(self):
+        """Return the changes made since the previous call to the state of the current instance that is kept
+        up to date by a single process, like an in-memory mirror of the account, as a JSON-serializable object
+        to be given to apply_replica_update by the instances copied in other processes. If there are none, return None.
+        
+        Unless overridden, return None.
+        """
+        return None
+
+    def apply_replica_update(self, update, stale_paths):
+        """Apply to the current instance, copied in a child process, an update returned by get_replica_update
+        in the parent process. stale_paths are the paths modified through the current instance that the parent
+        process may not have been notified of when the update was made.
+        
+        Unless overridden, do nothing.
+        """
+
+    def after_fork(self):
+        """Discard the resources inherited from the parent process that cannot be shared with it,
+        like locks, network connections and threads. Must be called in a child process created by
+        os.fork, before using the current instance.
+        
+        Unless overridden, do nothing.
+        """
+
     def __init__(self, account):
         """The super initializer for FileSystem subclasses."""
         self._account = account
+        self._modification_listeners = []
 
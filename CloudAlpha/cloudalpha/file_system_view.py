@@ -19,20 +19,42 @@
 # http://github.com/plbrault/cloudalpha
 # =============================================================================
 
+from concurrent.futures import ThreadPoolExecutor
 from cloudalpha.exceptions import InvalidPathFileSystemError, InvalidTargetFileSystemError
 
 class FileSystemView(object):
     """This class is mapped to a FileSystem subclass instance and redirects
     all method calls to it. It implements the support of a working directory.
+    
+    If content_cache is set to a ContentCache instance, reads are served from it when possible.
     """
 
+    _WALK_MAX_WORKERS = 8
+    _WALK_MAX_PENDING = 32
+
     _file_system = None
     _working_dir = "/"
 
+    content_cache = None
+
     @property
     def lock(self):
         return self._file_system.lock
 
+    @property
+    def file_system(self):
+        """Return the FileSystem instance to which the view is mapped."""
+        return self._file_system
+
+    def get_path_lock(self, *paths):
+        """Return a Lock object preventing other threads from operating on the given paths,
+        on their subpaths and from modifying their ancestors, for operations that span several calls.
+        
+        The given paths must be POSIX pathnames, with "/" representing the root of the file system.
+        They may be absolute, or relative to the current working directory.
+        """
+        return self._file_system.get_path_lock(*[self.get_abs_path(path) for path in paths])
+
     def get_abs_path(self, path):
         """Return the absolute path corresponding to the given relative path."""
         abs_levels = []
@@ -73,8 +95,8 @@ class FileSystemView(object):
         If the given path does not correspond to a directory, raise InvalidTargetFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._file_system.lock:
-            abs_path = self.get_abs_path(path)
+        abs_path = self.get_abs_path(path)
+        with self._file_system.get_path_lock(abs_path):
             if not self._file_system.exists(abs_path):
                 raise InvalidPathFileSystemError()
             if not self._file_system.is_dir(abs_path):
@@ -180,6 +202,17 @@ class FileSystemView(object):
             abs_path = self.get_abs_path(path)
         return self._file_system.get_metadata(abs_path)
 
+    def get_metadata_many(self, paths):
+        """Return a list of FileMetadata objects representing the files or directories corresponding
+        to the given iterable of paths, in the same order. For each invalid path, the list contains None.
+        
+        The given paths must be POSIX pathnames, with "/" representing the root of the file system.
+        They may be absolute, or relative to the current working directory.
+        
+        If the real file system is inaccessible, raise AccessFailedFileSystemError.
+        """
+        return self._file_system.get_metadata_many([self.get_abs_path(path) for path in paths])
+
     def get_content_metadata(self, path=None):
         """Return an iterable of FileMetadata objects representing the contents of the directory corresponding to the given path.
         
@@ -196,6 +229,83 @@ class FileSystemView(object):
             abs_path = self.get_abs_path(path)
         return self._file_system.get_content_metadata(abs_path)
 
+    def _walk_tree(self, abs_path):
+        """Generate the contents of the given directory and of its subdirectories, top-down,
+        from the recursive listing of the file system.
+        """
+        tree = self._file_system.get_tree_metadata(abs_path)
+        dir_paths = [abs_path]
+        while dir_paths:
+            dir_path = dir_paths.pop()
+            content_metadata = tree.pop(dir_path, ())
+            dirs = [metadata for metadata in content_metadata if metadata.is_dir]
+            files = [metadata for metadata in content_metadata if not metadata.is_dir]
+            yield dir_path, dirs, files
+            dir_paths.extend(reversed([metadata.path for metadata in dirs]))
+
+    def _walk_listings(self, abs_path):
+        """Generate the contents of the given directory and of its subdirectories, top-down,
+        listing the directories about to be visited ahead on a pool of threads.
+        """
+        executor = ThreadPoolExecutor(self._WALK_MAX_WORKERS)
+        pending = {}
+        dir_paths = [abs_path]
+        try:
+            while dir_paths:
+                dir_path = dir_paths.pop()
+                future = pending.pop(dir_path, None)
+                try:
+                    if future is None:
+                        content_metadata = self._file_system.get_content_metadata(dir_path)
+                    else:
+                        content_metadata = future.result()
+                except (InvalidPathFileSystemError, InvalidTargetFileSystemError):
+                    # The directory was removed since it was listed
+                    if dir_path == abs_path:
+                        raise
+                    continue
+                dirs = [metadata for metadata in content_metadata if metadata.is_dir]
+                files = [metadata for metadata in content_metadata if not metadata.is_dir]
+                yield dir_path, dirs, files
+                dir_paths.extend(reversed([metadata.path for metadata in dirs]))
+                for next_dir_path in reversed(dir_paths[-self._WALK_MAX_PENDING:]):
+                    if len(pending) >= self._WALK_MAX_PENDING:
+                        break
+                    if next_dir_path not in pending:
+                        pending[next_dir_path] = executor.submit(self._file_system.get_content_metadata, next_dir_path)
+        finally:
+            for future in pending.values():
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def walk(self, path=None):
+        """Generate the contents of the directory corresponding to the given path and of all its
+        subdirectories, top-down, like os.walk.
+        
+        For each directory, yield a tuple (dirpath, dirs, files), where dirpath is the absolute path of
+        the directory, and dirs and files are lists of FileMetadata objects representing its subdirectories
+        and files. Removing items from dirs prevents the walk from entering the corresponding subdirectories.
+        
+        If the file system supports recursive listing, the whole tree is listed at once. Otherwise, the
+        directories about to be visited are listed ahead by a pool of threads, at most _WALK_MAX_PENDING
+        at a time. The calling thread must therefore not hold a lock on the given path.
+        
+        The given path must be a POSIX pathname, with "/" representing the root of the file system.
+        It may be absolute, or relative to the current working directory.
+        If path is None, use the current working directory.
+        
+        If the given path is invalid, raise InvalidPathFileSystemError.
+        If the given path does not point to a directory, raise InvalidTargetFileSystemError.
+        If the real file system is inaccessible, raise AccessFailedFileSystemError.
+        """
+        if path == None:
+            abs_path = self._working_dir
+        else:
+            abs_path = self.get_abs_path(path)
+        if self._file_system.supports_recursive_listing:
+            return self._walk_tree(abs_path)
+        return self._walk_listings(abs_path)
+
     def get_created_datetime(self, path):
         """Return the date and time of creation of the file or directory corresponding to the given path.
         If not available, return the date and time of the last modification.
@@ -301,7 +411,7 @@ class FileSystemView(object):
         abs_path = self.get_abs_path(path)
         self._file_system.delete(abs_path)
 
-    def read(self, path, start_byte, num_bytes=None):
+    def read(self, path, start_byte, num_bytes=None, metadata=None):
         """Read the number of bytes corresponding to num_bytes from the file corresponding to the given path,
         beginning at start_byte.
         
@@ -309,6 +419,9 @@ class FileSystemView(object):
         
         If num_bytes is not specified, read all remaining bytes of the file.
         
+        When a file is read in several calls, metadata may be set to the FileMetadata object of the file,
+        obtained before the first one, so that the content cache does not request it on every call.
+        
         The given path must be a POSIX pathname, with "/" representing the root of the file system.
         It may be absolute, or relative to the current working directory.
         
@@ -319,8 +432,31 @@ class FileSystemView(object):
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
         abs_path = self.get_abs_path(path)
+        if self.content_cache is not None:
+            return self.content_cache.read(self._file_system, self._file_system.account.unique_id, abs_path, start_byte, num_bytes, metadata)
         return self._file_system.read(abs_path, start_byte, num_bytes)
 
+    def open_local_file(self, path):
+        """Return a file object open for reading in binary mode on a local file holding the contents of the
+        file corresponding to the given path, either because the file system stores its files on the local disk,
+        or because the file is in the content cache. If there is no such local file, return None.
+        
+        The contents of the returned file do not change while it is open. The caller must close it.
+        
+        The given path must be a POSIX pathname, with "/" representing the root of the file system.
+        It may be absolute, or relative to the current working directory.
+        
+        If the given path is invalid, raise InvalidPathFileSystemError.
+        If the given path corresponds to a directory, raise InvalidTargetFileSystemError.
+        If the real file system is inaccessible, raise AccessFailedFileSystemError.
+        """
+        abs_path = self.get_abs_path(path)
+        if self._file_system.supports_local_files:
+            return self._file_system.open_local_file(abs_path)
+        if self.content_cache is not None:
+            return self.content_cache.open(self._file_system, self._file_system.account.unique_id, abs_path)
+        return None
+
     def create_new_file(self):
         """Create an empty file that will be populated by successive calls to write_to_new_file. Return a unique
         ID that will be needed to perform write_to_new_file, commit_new_file and flush_new_file calls.
@@ -27,7 +27,16 @@
 # ==============================================================================
 
 from pyftpdlib.handlers import DTPHandler
+from pyftpdlib.ioloop import AsyncChat
+from pyftpdlib.log import logger
 from cloudalpha.managers.ftp.ftp_server.file_uploader import FileUploader
+from cloudalpha.managers.ftp.ftp_server.local_file_producer import LocalFileProducer
+
+try:
+    from pyftpdlib.handlers import _GiveUpOnSendfile
+except ImportError:
+    # pyftpdlib 1.4 lets the error of the first sendfile call through
+    _GiveUpOnSendfile = OSError
 
 class AdaptedDTPHandler(DTPHandler):
     """DTPHandler is the class handling data transfer between the server and the clients.
@@ -38,6 +47,7 @@ class AdaptedDTPHandler(DTPHandler):
     file_path = None
     _new_file_id = None
     _file_uploader = None
+    _producer = None
 
     @property
     def file_obj(self):
@@ -77,16 +87,78 @@ class AdaptedDTPHandler(DTPHandler):
         self._new_file_id = file_system_view.create_new_file()
         super(AdaptedDTPHandler, self).enable_receiving(type, cmd)
 
+    def _use_sendfile(self, producer):
+        """Override the corresponding method of the baseclass.
+        Return True if the given producer sends a local file and sendfile is enabled.
+        """
+        return self.cmd_channel.use_sendfile and isinstance(producer, LocalFileProducer)
+
+    def push_with_producer(self, producer):
+        """Remember the producer pushed to the data channel, so that it can be
+        closed along with it, then push it.
+        
+        If the producer sends a local file, send it with sendfile when possible.
+        If the first call to sendfile fails, send it with plain send calls instead.
+        """
+        self._producer = producer
+        if self._use_sendfile(producer):
+            self._initialized = True
+            self.ioloop.modify(self._fileno, self.ioloop.WRITE)
+            self._offset = producer.file.tell()
+            self._filefd = producer.file.fileno()
+            try:
+                self.initiate_sendfile()
+            except _GiveUpOnSendfile:
+                logger.warning("sendfile() failed; falling back on using plain send")
+            else:
+                self.initiate_send = self.initiate_sendfile
+                return
+            AsyncChat.push_with_producer(self, producer)
+        else:
+            super(AdaptedDTPHandler, self).push_with_producer(producer)
+
+    def _finish_upload(self):
+        """Commit the uploaded file if the transfer is finished, or else delete it.
+        
+        If writing the remaining data fails, delete the file and raise the exception.
+        The upload is considered finished even if this fails, so that it is never committed
+        after its file was deleted.
+        """
+        file_system_view = self.cmd_channel.fs.file_system_view
+        file_uploader = self.file_obj
+        new_file_id = self._new_file_id
+        self._new_file_id = None
+        if not self.transfer_finished:
+            file_uploader.discard()
+            file_system_view.flush_new_file(new_file_id)
+            return
+        try:
+            file_uploader.close()
+        except:
+            file_uploader.discard()
+            file_system_view.flush_new_file(new_file_id)
+            raise
+        self.cmd_channel.fs.invalidate(self.file_path)
+        file_system_view.commit_new_file(new_file_id, self.file_path)
+
     def close(self):
         """This method is called by the FTP handler when data
         transmission is finished.
+        
+        The data channel is closed even if finishing the upload fails,
+        in which case the client is told that the transfer was aborted.
         """
-        if not self._closed and self.file_obj != None:
-            file_system_view = self.cmd_channel.fs.file_system_view
-            if self.transfer_finished:
-                file_system_view.commit_new_file(self._new_file_id, self.file_path)
-            else:
-                file_system_view.flush_new_file(self._new_file_id)
-            self._file_uploader = None
-        self.cmd_channel._on_dtp_close()
-        super(AdaptedDTPHandler, self).close()
+        try:
+            if self._producer is not None and hasattr(self._producer, "close"):
+                self._producer.close()
+                self._producer = None
+            if not self._closed and self._new_file_id is not None:
+                try:
+                    self._finish_upload()
+                except Exception:
+                    self.transfer_finished = False
+                    self._resp = ("426 Internal error; transfer aborted.", logger.warning)
+                    raise
+        finally:
+            self.cmd_channel._on_dtp_close()
+            super(AdaptedDTPHandler, self).close()
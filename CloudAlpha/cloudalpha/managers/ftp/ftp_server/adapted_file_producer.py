@@ -28,6 +28,8 @@
 
 from pyftpdlib.handlers import FileProducer, _FileReadWriteError
 from cloudalpha.exceptions import InvalidPathFileSystemError, AccessFailedFileSystemError
+from cloudalpha.managers.ftp.ftp_server.read_ahead_reader import ReadAheadReader
+from cloudalpha.managers.ftp.settings import FTPSettings
 
 class AdaptedFileProducer(FileProducer):
     """This class handles the reading of data from a file on the file system."""
@@ -35,20 +37,40 @@ class AdaptedFileProducer(FileProducer):
     _offset = 0
     file_system_view = None
     _file_path = None
+    _metadata = None
+    _reader = None
 
-    def __init__(self, file_system_view, file_path):
-        """AdaptedFileProducer instance initializer"""
+    def __init__(self, file_system_view, file_path, offset=0):
+        """AdaptedFileProducer instance initializer. The file is read from the given offset."""
         self.file_system_view = file_system_view
         self._file_path = file_path
+        self._offset = offset
 
     def more(self):
-        """Attempt to read a chunk of data of size self.buffer_size."""
+        """Attempt to read a chunk of data of size self.buffer_size.
+        
+        If FTPSettings.read_ahead_block_size is not zero, the data is read ahead by a ReadAheadReader.
+        """
         try:
-            data = self.file_system_view.read(self._file_path, self._offset, self.buffer_size)
-            self._offset += self.buffer_size
+            if FTPSettings.read_ahead_block_size <= 0:
+                if self._metadata is None:
+                    self._metadata = self.file_system_view.get_metadata(self._file_path)
+                data = self.file_system_view.read(self._file_path, self._offset, self.buffer_size, self._metadata)
+                self._offset += self.buffer_size
+                return data
+            if self._reader is None:
+                self._reader = ReadAheadReader(self.file_system_view, self._file_path, self._offset)
+                self._reader.start()
+            data = self._reader.read(self.buffer_size)
+            self._offset += len(data)
             return data
         except InvalidPathFileSystemError:
             raise _FileReadWriteError("No such file or directory")
         except AccessFailedFileSystemError:
             raise _FileReadWriteError("File system currently inaccessible")
 
+    def close(self):
+        """Stop reading ahead, if needed."""
+        if self._reader is not None:
+            self._reader.close()
+
@@ -27,7 +27,10 @@
 # ==============================================================================
 
 from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.filesystems import FilesystemError as FTPError
+from cloudalpha.exceptions import FileSystemError, InvalidPathFileSystemError, InvalidTargetFileSystemError
 from cloudalpha.managers.ftp.ftp_server.adapted_file_producer import AdaptedFileProducer
+from cloudalpha.managers.ftp.ftp_server.local_file_producer import LocalFileProducer
 from cloudalpha.managers.ftp.ftp_server.adapted_dtp_handler import AdaptedDTPHandler
 from cloudalpha.managers.ftp.ftp_server.ftp_server import FTPServer
 
@@ -54,21 +57,41 @@ class AdaptedFTPHandler(FTPHandler):
     def ftp_RETR(self, file):
         """Retrieve the specified file (transfer from the server to the
         client).  On success, return the file path or else, return None.
+        
+        If the file is available on the local disk, it is sent by a LocalFileProducer.
+        Otherwise, it is read from the file system by an AdaptedFileProducer.
         """
         rest_pos = self._restart_position
         self._restart_position = 0
 
         if rest_pos:
+            ok = 0
             try:
                 if rest_pos > self.fs.getsize(file):
                     raise ValueError
                 ok = 1
             except ValueError:
                 why = "Invalid REST parameter"
+            except FTPError as err:
+                why = str(err)
             if not ok:
                 self.respond('554 %s' % why)
                 return
-        producer = AdaptedFileProducer(self.fs.file_system_view, file)
+        try:
+            local_file = self.fs.file_system_view.open_local_file(file)
+        except InvalidPathFileSystemError:
+            self.respond('550 No such file or directory.')
+            return
+        except InvalidTargetFileSystemError:
+            self.respond('550 Is a directory.')
+            return
+        except FileSystemError:
+            # Let the AdaptedFileProducer report the error
+            local_file = None
+        if local_file is not None:
+            producer = LocalFileProducer(local_file, rest_pos)
+        else:
+            producer = AdaptedFileProducer(self.fs.file_system_view, file, rest_pos)
         self.push_dtp_data(producer, isproducer=True, cmd="RETR")
         return file
 
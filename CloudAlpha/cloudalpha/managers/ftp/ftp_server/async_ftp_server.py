@@ -0,0 +1,91 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from cloudalpha.managers.ftp.ftp_server.async_ftp_session import AsyncFTPSession
+from cloudalpha.managers.ftp.settings import FTPSettings
+
+
+class AsyncFTPServer(object):
+    """An FTP server handling all its connections as coroutines of a single asyncio event loop,
+    as an alternative to the one thread per connection of pyftpdlib.servers.ThreadedFTPServer.
+    
+    Each control connection is handled by an AsyncFTPSession. The blocking calls to the file system
+    are made on a pool of at most FTPSettings.async_worker_threads threads, so that an idle connection
+    only costs its coroutine and its buffers.
+    
+    Like ThreadedFTPServer, it is run by serve_forever, and stopped from another thread by stop.
+    """
+
+    banner = "CloudAlpha FTP manager ready."
+    max_cons = 256
+
+    _address = None
+    _authorizer = None
+    _loop = None
+    _executor = None
+    _sessions = None
+
+    def __init__(self, address, authorizer):
+        """Create a server listening on the given (host, port) address, and authenticating its users with the given authorizer."""
+        self._address = address
+        self._authorizer = authorizer
+        self._loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max(FTPSettings.async_worker_threads, 1))
+        self._sessions = set()
+
+    def run_blocking(self, function):
+        """Return an awaitable calling the given function on the thread pool of the server."""
+        return self._loop.run_in_executor(self._executor, function)
+
+    async def _handle_connection(self, reader, writer):
+        """Handle a new control connection."""
+        if len(self._sessions) >= self.max_cons:
+            writer.write(b"421 Too many connections. Service temporarily unavailable.\r\n")
+            writer.close()
+            return
+        session = AsyncFTPSession(self, reader, writer, self._authorizer)
+        task = asyncio.current_task()
+        self._sessions.add(task)
+        try:
+            await session.handle(self.banner)
+        finally:
+            self._sessions.discard(task)
+
+    def serve_forever(self):
+        """Accept and handle connections until stop is called."""
+        asyncio.set_event_loop(self._loop)
+        server = self._loop.run_until_complete(asyncio.start_server(self._handle_connection, *self._address))
+        try:
+            self._loop.run_forever()
+        finally:
+            server.close()
+            for task in list(self._sessions):
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(server.wait_closed(), *self._sessions, return_exceptions=True))
+            self._loop.close()
+            self._executor.shutdown(wait=False)
+
+    def stop(self):
+        """Stop the server. Can be called from any thread."""
+        self._loop.call_soon_threadsafe(self._loop.stop)
@@ -0,0 +1,848 @@
+# ==============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+#
+#
+#
+# This file contains work derived from the source code of the pyftpdlib library,
+# covered by the following copyright notice:
+# Copyright (C) 2007-2014 Giampaolo Rodola' <g.rodola@gmail.com>
+#
+# ==============================================================================
+
+import asyncio
+from functools import partial
+import glob
+import socket
+import time
+
+from pyftpdlib.authorizers import AuthenticationFailed
+from pyftpdlib.filesystems import FilesystemError as FTPError
+from pyftpdlib.handlers import _FileReadWriteError, proto_cmds
+from pyftpdlib.log import logger
+from cloudalpha.exceptions import FileSystemError, InvalidPathFileSystemError, InvalidTargetFileSystemError, \
+    AlreadyExistsFileSystemError, InsufficientSpaceFileSystemError, AccessFailedFileSystemError
+from cloudalpha.managers.ftp.ftp_server.adapted_file_producer import AdaptedFileProducer
+from cloudalpha.managers.ftp.ftp_server.file_system_adapter import FileSystemAdapter
+from cloudalpha.managers.ftp.ftp_server.file_uploader import FileUploader
+from cloudalpha.managers.ftp.ftp_server.ftp_server import FTPServer
+
+
+class _DataChannelError(Exception):
+    """Exception raised when a data connection cannot be established."""
+
+
+_FILE_SYSTEM_ERROR_MESSAGES = {
+    InvalidPathFileSystemError: "No such file or directory",
+    InvalidTargetFileSystemError: "Not a valid target",
+    AlreadyExistsFileSystemError: "File exists",
+    InsufficientSpaceFileSystemError: "Insufficient storage space",
+    AccessFailedFileSystemError: "File system currently inaccessible",
+}
+
+
+class AsyncFTPSession(object):
+    """The handling of an FTP control connection by an AsyncFTPServer, as a coroutine.
+    
+    The commands are those handled by AdaptedFTPHandler, with the same replies, and the
+    file system is accessed through a FileSystemAdapter. As the methods of FileSystemAdapter
+    and FileSystemView block, they are called on the thread pool of the server.
+    
+    The commands of a session are handled one at a time. A command received during a data transfer
+    waits for the end of the transfer, except ABOR, which interrupts it, and STAT without argument.
+    
+    Like FTPHandler, the session only exchanges data with the address of the client, unless
+    permit_foreign_addresses is True, and does not connect to privileged ports, unless
+    permit_privileged_ports is True. A data connection making no progress for data_timeout
+    seconds is closed along with the control connection.
+    """
+
+    # Attributes read by FileSystemAdapter, as if it belonged to an FTPHandler
+    use_gmt_times = True
+    unicode_errors = "replace"
+
+    timeout = 300
+    data_timeout = 300
+    transfer_buffer_size = 65536
+    sendfile_block_size = 1048576
+    permit_foreign_addresses = False
+    permit_privileged_ports = False
+
+    _server = None
+    _reader = None
+    _writer = None
+    _authorizer = None
+    _username = None
+    _authenticated = False
+    _fs = None
+    _restart_position = 0
+    _rename_from = None
+    _current_facts = None
+    _passive_server = None
+    _passive_connection = None
+    _active_address = None
+    _transfer = None
+
+    _available_facts = ["type", "perm", "size", "modify"]
+
+    @property
+    def fs(self):
+        """Return the FileSystemAdapter of the session, or None if the user is not authenticated."""
+        return self._fs
+
+    def __init__(self, server, reader, writer, authorizer):
+        """Create a session for the control connection corresponding to the given StreamReader and StreamWriter."""
+        self._server = server
+        self._reader = reader
+        self._writer = writer
+        self._authorizer = authorizer
+        self._current_facts = list(self._available_facts)
+
+    def _run(self, function, *args):
+        """Return an awaitable calling the given function with the given arguments on the thread pool of the server."""
+        return self._server.run_blocking(partial(function, *args))
+
+    async def respond(self, line):
+        """Send a reply to the client."""
+        self._writer.write((line + "\r\n").encode("utf8", self.unicode_errors))
+        await self._writer.drain()
+
+    async def handle(self, banner):
+        """Greet the client with the given banner, then handle its commands until it quits or disconnects."""
+        try:
+            # Receive the urgent data sent along with ABOR as part of the command
+            self._writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_OOBINLINE, 1)
+        except (AttributeError, OSError):
+            pass
+        try:
+            await self.respond("220 " + banner)
+            while True:
+                try:
+                    if self._transfer is not None and not self._transfer.done():
+                        line = await self._reader.readline()
+                    else:
+                        line = await asyncio.wait_for(self._reader.readline(), self.timeout)
+                except asyncio.TimeoutError:
+                    await self.respond("421 Control connection timed out.")
+                    break
+                except ValueError:
+                    await self.respond("500 Command too long.")
+                    break
+                if not line:
+                    break
+                # Drop the Telnet "interrupt process" and "synch" signals that some clients send before ABOR
+                line = line.lstrip(b"\xff\xf4\xf2").decode("utf8", self.unicode_errors).rstrip("\r\n")
+                cmd, _, arg = line.partition(" ")
+                cmd = cmd.upper()
+                if cmd != "ABOR" and (cmd != "STAT" or arg):
+                    await self._wait_transfer()
+                if cmd == "QUIT":
+                    await self.respond("221 Goodbye.")
+                    break
+                await self._dispatch(cmd, arg)
+        except ConnectionError:
+            pass
+        finally:
+            await self._close()
+
+    async def _dispatch(self, cmd, arg):
+        """Handle the given command."""
+        if cmd == "SITE" and arg:
+            # Handle "SITE CHMOD 755 file" with ftp_SITE_CHMOD("755 file")
+            subcommand, _, arg = arg.partition(" ")
+            cmd = "SITE " + subcommand.upper()
+        method = getattr(self, "ftp_" + cmd.replace(" ", "_"), None)
+        if method is None or not cmd.replace(" ", "").isalpha():
+            if cmd == "SITE":
+                await self.respond("501 Syntax error: command needs an argument.")
+            else:
+                await self.respond('500 Command "%s" not understood.' % cmd)
+            return
+        if not self._authenticated and (cmd not in ("USER", "PASS", "SYST", "FEAT", "OPTS", "NOOP", "HELP", "STAT") or
+                                        (cmd == "STAT" and arg)):
+            await self.respond("530 Log in with USER and PASS first.")
+            return
+        perm = proto_cmds[cmd]["perm"] if cmd in proto_cmds else None
+        if perm is not None and cmd != "STOU" and (cmd != "STAT" or arg):
+            if not self._authorizer.has_perm(self._username, perm, self._perm_path(cmd, arg)):
+                await self.respond("550 Not enough privileges.")
+                return
+        try:
+            await method(arg)
+        except (FTPError, FileSystemError) as e:
+            await self.respond("550 %s." % self._strerror(e))
+        except ConnectionError:
+            raise
+        except Exception:
+            logger.exception("Unhandled exception in command %s", cmd)
+            await self.respond("451 Requested action aborted: local error in processing.")
+
+    @staticmethod
+    def _strerror(error):
+        """Return the message describing the given FilesystemError of pyftpdlib or FileSystemError."""
+        if isinstance(error, FileSystemError):
+            return _FILE_SYSTEM_ERROR_MESSAGES.get(type(error), "Operation failed")
+        return str(error)
+
+    async def _wait_transfer(self):
+        """Wait for the end of the current data transfer, if any."""
+        if self._transfer is not None:
+            try:
+                await self._transfer
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._transfer = None
+
+    async def _close(self):
+        """Interrupt the current data transfer, if any, and close the connections."""
+        if self._transfer is not None and not self._transfer.done():
+            self._transfer.cancel()
+            await self._wait_transfer()
+        self._close_passive_server()
+        self._writer.close()
+
+    def _ftp_path(self, arg):
+        """Return the absolute path corresponding to the given command argument, or the current directory if empty."""
+        return self._fs.ftp2fs(arg or self._fs.cwd)
+
+    def _perm_path(self, cmd, arg):
+        """Return the path on which the permission required by the given command is checked."""
+        if cmd in ("CWD", "XCWD"):
+            return self._ftp_path(arg or "/")
+        if cmd in ("CDUP", "XCUP"):
+            return self._ftp_path("..")
+        if cmd == "LIST" and arg.startswith("-"):
+            arg = arg.partition(" ")[2]
+        elif cmd == "SITE CHMOD":
+            arg = arg.partition(" ")[2]
+        return self._ftp_path(arg)
+
+    @staticmethod
+    def _normalize_ip(ip):
+        """Return the given IP address, with an IPv4-mapped IPv6 address written as an IPv4 address."""
+        if ip.startswith("::ffff:"):
+            return ip[7:]
+        return ip
+
+    def _remote_ip(self):
+        """Return the IP address of the client."""
+        return self._normalize_ip(self._writer.get_extra_info("peername")[0])
+
+    # --- Data channel
+
+    def _close_passive_server(self):
+        """Stop listening for a passive data connection, and close the one not used yet, if any."""
+        if self._passive_server is not None:
+            self._passive_server.close()
+            self._passive_server = None
+        if self._passive_connection is not None:
+            if self._passive_connection.done() and not self._passive_connection.cancelled():
+                self._passive_connection.result()[1].close()
+            else:
+                self._passive_connection.cancel()
+            self._passive_connection = None
+        self._active_address = None
+
+    async def _listen(self):
+        """Listen for a passive data connection on a free port, and return the port."""
+        self._close_passive_server()
+        connection = asyncio.get_event_loop().create_future()
+        remote_ip = self._remote_ip()
+
+        def accept(reader, writer):
+            peer_address = writer.get_extra_info("peername")
+            if not self.permit_foreign_addresses and self._normalize_ip(peer_address[0]) != remote_ip:
+                # Keep waiting for the client, as it is not to blame
+                logger.warning("Rejected data connection from foreign address %s:%s.", *peer_address[:2])
+                writer.close()
+            elif connection.done():
+                writer.close()
+            else:
+                connection.set_result((reader, writer))
+
+        host = self._writer.get_extra_info("sockname")[0]
+        self._passive_server = await asyncio.start_server(accept, host, 0)
+        self._passive_connection = connection
+        return self._passive_server.sockets[0].getsockname()[1]
+
+    async def _open_data_channel(self):
+        """Return the StreamReader and StreamWriter of the data connection prepared by PASV, EPSV, PORT or EPRT.
+        
+        If the connection cannot be established, raise _DataChannelError.
+        """
+        try:
+            if self._passive_connection is not None:
+                connection = self._passive_connection
+                self._passive_connection = None
+                try:
+                    return await asyncio.wait_for(connection, self.data_timeout)
+                finally:
+                    self._close_passive_server()
+            if self._active_address is not None:
+                address = self._active_address
+                self._active_address = None
+                return await asyncio.wait_for(asyncio.open_connection(*address), self.data_timeout)
+        except (OSError, asyncio.TimeoutError):
+            raise _DataChannelError("Can't open data connection.")
+        raise _DataChannelError("No data connection")
+
+    async def _start_transfer(self, coroutine):
+        """Open the data connection, then run the given coroutine function with its StreamReader and StreamWriter
+        in a new task, reporting the result of the transfer to the client.
+        """
+        await self.respond("150 File status okay. About to open data connection.")
+        try:
+            reader, writer = await self._open_data_channel()
+        except _DataChannelError as e:
+            await self.respond("425 %s" % str(e))
+            return
+
+        async def transfer():
+            try:
+                await coroutine(reader, writer)
+                writer.close()
+                await self.respond("226 Transfer complete.")
+            except asyncio.CancelledError:
+                writer.close()
+                raise
+            except asyncio.TimeoutError:
+                writer.close()
+                await self.respond("421 Data connection timed out.")
+                self._writer.close()
+            except (ConnectionError, OSError):
+                writer.close()
+                await self.respond("426 Transfer aborted; connection closed.")
+            except (FTPError, _FileReadWriteError, FileSystemError) as e:
+                writer.close()
+                await self.respond("550 Error during transfer: %s." % self._strerror(e))
+            except Exception:
+                writer.close()
+                logger.exception("Unhandled exception during transfer")
+                await self.respond("451 Requested action aborted: local error in processing.")
+
+        self._transfer = asyncio.ensure_future(transfer())
+
+    async def _read_data(self, reader):
+        """Return the next data received on the data connection, or an empty bytes object at its end.
+        
+        If nothing is received for data_timeout seconds, raise asyncio.TimeoutError.
+        """
+        return await asyncio.wait_for(reader.read(self.transfer_buffer_size), self.data_timeout)
+
+    async def _send_data(self, writer, data):
+        """Send the given data on the data connection.
+        
+        If the client does not receive it for data_timeout seconds, raise asyncio.TimeoutError.
+        """
+        writer.write(data)
+        await asyncio.wait_for(writer.drain(), self.data_timeout)
+
+    async def _send_local_file(self, writer, local_file, offset):
+        """Send the given local file from the given offset on the data connection with sendfile when possible,
+        by blocks of sendfile_block_size bytes.
+        
+        If a block is not received by the client within data_timeout seconds, raise asyncio.TimeoutError.
+        """
+        loop = asyncio.get_event_loop()
+        while True:
+            sent = await asyncio.wait_for(loop.sendfile(writer.transport, local_file, offset, self.sendfile_block_size),
+                                          self.data_timeout)
+            if not sent:
+                break
+            offset += sent
+
+    async def _send_iterator(self, iterator, reader, writer):
+        """Send the lines yielded by the given blocking iterator on the data connection,
+        building them on the thread pool, by blocks of transfer_buffer_size bytes.
+        """
+        def next_block():
+            block = bytearray()
+            for line in iterator:
+                block += line
+                if len(block) >= self.transfer_buffer_size:
+                    break
+            return bytes(block)
+        while True:
+            block = await self._run(next_block)
+            if not block:
+                break
+            await self._send_data(writer, block)
+
+    # --- Connection and authentication
+
+    async def ftp_USER(self, arg):
+        """Set the username of the session."""
+        if self._authenticated:
+            await self.respond("503 User already authenticated.")
+            return
+        self._username = arg
+        await self.respond("331 Username ok, send password.")
+
+    async def ftp_PASS(self, arg):
+        """Attempt to authenticate the user."""
+        if self._authenticated:
+            await self.respond("503 User already authenticated.")
+            return
+        if self._username is None:
+            await self.respond("503 Login with USER first.")
+            return
+        try:
+            self._authorizer.validate_authentication(self._username, arg, self)
+            file_system_view = FTPServer().get_file_system_view(self._username)
+        except (AuthenticationFailed, KeyError):
+            self._username = None
+            await self.respond("530 Authentication failed.")
+            return
+        self._fs = FileSystemAdapter("/", self)
+        self._fs.file_system_view = file_system_view
+        self._authenticated = True
+        await self.respond("230 Login successful.")
+
+    async def ftp_SYST(self, arg):
+        """Return the system type."""
+        await self.respond("215 UNIX Type: L8")
+
+    async def ftp_FEAT(self, arg):
+        """List the features supported in addition to those of RFC 959."""
+        facts = "".join(fact + ("*;" if fact in self._current_facts else ";") for fact in self._available_facts)
+        features = sorted(["UTF8", "TVFS", "EPRT", "EPSV", "MDTM", "SIZE", "REST STREAM", "MLST " + facts])
+        await self.respond("211-Features supported:\r\n" + "".join(" %s\r\n" % feature for feature in features) + "211 End FEAT.")
+
+    async def ftp_OPTS(self, arg):
+        """Set the facts returned by MLST and MLSD."""
+        cmd, _, facts = arg.partition(" ")
+        if cmd.upper() == "UTF8":
+            await self.respond("200 UTF8 mode is always enabled.")
+            return
+        if cmd.upper() != "MLST" or (facts and ";" not in facts):
+            await self.respond('501 Unsupported command "%s".' % cmd)
+            return
+        self._current_facts = [fact for fact in facts.lower().split(";") if fact in self._available_facts]
+        await self.respond("200 MLST OPTS " + "".join(fact + ";" for fact in self._current_facts))
+
+    async def ftp_NOOP(self, arg):
+        """Do nothing."""
+        await self.respond("200 I successfully done nothin'.")
+
+    async def ftp_HELP(self, arg):
+        """Return the list of the supported commands."""
+        cmds = sorted(set(name[4:].split("_")[0] for name in dir(self) if name.startswith("ftp_")))
+        await self.respond("214-The following commands are recognized:\r\n " + " ".join(cmds) + "\r\n214 Help command successful.")
+
+    async def ftp_TYPE(self, arg):
+        """Set the transfer type. Data is always transferred as is."""
+        if arg.upper() in ("A", "AN", "A N"):
+            await self.respond("200 Type set to: ASCII.")
+        elif arg.upper() in ("I", "L8", "L 8"):
+            await self.respond("200 Type set to: Binary.")
+        else:
+            await self.respond('504 Unsupported type "%s".' % arg)
+
+    async def ftp_MODE(self, arg):
+        """Set the transfer mode. Only stream mode is supported."""
+        if arg.upper() == "S":
+            await self.respond("200 Transfer mode set to: S")
+        else:
+            await self.respond("504 Unimplemented MODE type.")
+
+    async def ftp_STRU(self, arg):
+        """Set the file structure. Only file structure is supported."""
+        if arg.upper() == "F":
+            await self.respond("200 File transfer structure set to: F.")
+        else:
+            await self.respond("504 Unimplemented STRU type.")
+
+    async def ftp_ALLO(self, arg):
+        """Allocate storage, which is unnecessary."""
+        await self.respond("202 No storage allocation necessary.")
+
+    # --- Data connections
+
+    async def ftp_PASV(self, arg):
+        """Listen for a data connection, and return the address to connect to."""
+        port = await self._listen()
+        host = self._passive_server.sockets[0].getsockname()[0]
+        await self.respond("227 Entering passive mode (%s,%d,%d)." % (host.replace(".", ","), port // 256, port % 256))
+
+    async def ftp_EPSV(self, arg):
+        """Listen for a data connection, and return the port to connect to."""
+        port = await self._listen()
+        await self.respond("229 Entering extended passive mode (|||%d|)." % port)
+
+    async def ftp_PORT(self, arg):
+        """Connect to the given address for the next data transfer."""
+        try:
+            values = [int(value) for value in arg.split(",")]
+            if len(values) != 6 or not all(0 <= value <= 255 for value in values):
+                raise ValueError
+        except ValueError:
+            await self.respond("501 Invalid PORT format.")
+            return
+        await self._set_active_address(".".join(str(value) for value in values[:4]), values[4] * 256 + values[5])
+
+    async def ftp_EPRT(self, arg):
+        """Connect to the given extended address for the next data transfer."""
+        try:
+            _, _, host, port, _ = arg.split(arg[0])
+            port = int(port)
+            if not 0 <= port <= 65535:
+                raise ValueError
+        except (IndexError, ValueError):
+            await self.respond("501 Invalid EPRT format.")
+            return
+        await self._set_active_address(host, port)
+
+    async def _set_active_address(self, host, port):
+        """Connect to the given address for the next data transfer, unless it is not the address
+        of the client or its port is privileged.
+        """
+        if not self.permit_foreign_addresses and self._normalize_ip(host) != self._remote_ip():
+            response = "501 Rejected data connection to foreign address %s:%s." % (host, port)
+        elif not self.permit_privileged_ports and port < 1024:
+            response = '501 PORT against the privileged port "%s" refused.' % port
+        else:
+            self._close_passive_server()
+            self._active_address = (host, port)
+            await self.respond("200 Active data connection established.")
+            return
+        logger.warning(response)
+        await self.respond(response)
+
+    async def ftp_ABOR(self, arg):
+        """Interrupt the current data transfer."""
+        self._close_passive_server()
+        if self._transfer is None or self._transfer.done():
+            await self._wait_transfer()
+            await self.respond("225 No transfer to abort.")
+            return
+        self._transfer.cancel()
+        await self._wait_transfer()
+        await self.respond("426 Transfer aborted via ABOR.")
+        await self.respond("226 ABOR command successful.")
+
+    # --- Directories
+
+    async def ftp_PWD(self, arg):
+        """Return the name of the current working directory."""
+        await self.respond('257 "%s" is the current directory.' % self._fs.cwd.replace('"', '""'))
+
+    async def ftp_XPWD(self, arg):
+        """Same as PWD."""
+        await self.ftp_PWD(arg)
+
+    async def ftp_CWD(self, arg):
+        """Change the current working directory."""
+        await self._run(self._fs.chdir, self._ftp_path(arg or "/"))
+        await self.respond('250 "%s" is the current directory.' % self._fs.cwd)
+
+    async def ftp_XCWD(self, arg):
+        """Same as CWD."""
+        await self.ftp_CWD(arg)
+
+    async def ftp_CDUP(self, arg):
+        """Change the current working directory to its parent."""
+        await self.ftp_CWD("..")
+
+    async def ftp_XCUP(self, arg):
+        """Same as CDUP."""
+        await self.ftp_CDUP(arg)
+
+    async def ftp_MKD(self, arg):
+        """Create the given directory."""
+        path = self._ftp_path(arg)
+        await self._run(self._fs.mkdir, path)
+        await self.respond('257 "%s" directory created.' % path.replace('"', '""'))
+
+    async def ftp_XMKD(self, arg):
+        """Same as MKD."""
+        await self.ftp_MKD(arg)
+
+    async def ftp_RMD(self, arg):
+        """Remove the given directory."""
+        path = self._ftp_path(arg)
+        if path == "/":
+            await self.respond("550 Can't remove root directory.")
+            return
+        await self._run(self._fs.rmdir, path)
+        await self.respond("250 Directory removed.")
+
+    async def ftp_XRMD(self, arg):
+        """Same as RMD."""
+        await self.ftp_RMD(arg)
+
+    # --- Listings
+
+    async def ftp_LIST(self, arg):
+        """Send the listing of the given directory, or the description of the given file, on the data connection."""
+        if arg.startswith("-"):
+            # Ignore the options of the "ls" command, like "-la"
+            arg = arg.partition(" ")[2]
+        iterator = await self._list(self._ftp_path(arg))
+        await self._start_transfer(partial(self._send_iterator, iterator))
+
+    async def _list(self, path):
+        """Return an iterator yielding the lines of the listing of the given directory, or of the description
+        of the given file, in the format of the "ls" command.
+        """
+        if await self._run(self._fs.isdir, path):
+            listing = await self._run(self._fs.listdir, path)
+            return self._fs.format_list(path, listing)
+        basedir, filename = path.rsplit("/", 1)
+        return self._fs.format_list(basedir or "/", [filename], ignore_err=False)
+
+    async def ftp_STAT(self, arg):
+        """Return the status of the session or, if a path is given, its listing over the control connection."""
+        if not arg:
+            lines = ["Connected to: %s:%s" % self._writer.get_extra_info("sockname")[:2]]
+            if self._authenticated:
+                lines.append("Logged in as: %s" % self._username)
+            elif self._username is None:
+                lines.append("Waiting for username.")
+            else:
+                lines.append("Waiting for password.")
+            lines.append("TYPE: Binary; STRUcture: File; MODE: Stream")
+            if self._passive_connection is not None:
+                lines.append("Passive data channel waiting for connection.")
+            elif self._transfer is not None and not self._transfer.done():
+                lines.append("Data connection open.")
+            else:
+                lines.append("Data connection closed.")
+            await self.respond("211-FTP server status:\r\n" + "".join(" %s\r\n" % line for line in lines) + "211 End of status.")
+            return
+        if glob.has_magic(arg):
+            await self.respond("550 Globbing not supported.")
+            return
+        path = self._ftp_path(arg)
+        iterator = await self._list(path)
+        data = (await self._run(b"".join, iterator)).decode("utf8", self.unicode_errors)
+        await self.respond('213-Status of "%s":\r\n%s213 End of status.' % (path, data))
+
+    async def ftp_NLST(self, arg):
+        """Send the names of the contents of the given directory on the data connection."""
+        path = self._ftp_path(arg)
+        if await self._run(self._fs.isdir, path):
+            listing = await self._run(self._fs.listdir, path)
+        else:
+            listing = [path.rsplit("/", 1)[1]]
+        iterator = (name.encode("utf8", self.unicode_errors) + b"\r\n" for name in sorted(listing))
+        await self._start_transfer(partial(self._send_iterator, iterator))
+
+    async def ftp_MLSD(self, arg):
+        """Send the listing of the given directory in the format defined in RFC 3659 on the data connection."""
+        path = self._ftp_path(arg)
+        if not await self._run(self._fs.isdir, path):
+            await self.respond("501 No such directory.")
+            return
+        listing = await self._run(self._fs.listdir, path)
+        perms = self._authorizer.get_perms(self._username)
+        iterator = self._fs.format_mlsx(path, listing, perms, self._current_facts)
+        await self._start_transfer(partial(self._send_iterator, iterator))
+
+    async def ftp_MLST(self, arg):
+        """Return the description of the given path in the format defined in RFC 3659."""
+        path = self._ftp_path(arg)
+        basedir, basename = path.rsplit("/", 1) if path != "/" else ("/", "")
+        perms = self._authorizer.get_perms(self._username)
+        iterator = self._fs.format_mlsx(basedir or "/", [basename], perms, self._current_facts, ignore_err=False)
+        data = (await self._run(b"".join, iterator)).decode("utf8", self.unicode_errors)
+        await self.respond('250-Listing "%s":\r\n %s %s\r\n250 End MLST.' % (path, data.split(" ")[0], path))
+
+    # --- Files
+
+    async def ftp_SIZE(self, arg):
+        """Return the size of the given file."""
+        path = self._ftp_path(arg)
+        if await self._run(self._fs.isdir, path):
+            await self.respond("550 %s is not retrievable." % path)
+            return
+        await self.respond("213 %s" % await self._run(self._fs.getsize, path))
+
+    async def ftp_MDTM(self, arg):
+        """Return the time of the last modification to the given file."""
+        path = self._ftp_path(arg)
+        if not await self._run(self._fs.isfile, path):
+            await self.respond("550 %s is not retrievable." % path)
+            return
+        modified_time = await self._run(self._fs.getmtime, path)
+        await self.respond("213 " + time.strftime("%Y%m%d%H%M%S", time.gmtime(modified_time)))
+
+    async def ftp_REST(self, arg):
+        """Set the position from which the next file is retrieved."""
+        try:
+            position = int(arg)
+            if position < 0:
+                raise ValueError
+        except ValueError:
+            await self.respond("501 Invalid parameter.")
+            return
+        self._restart_position = position
+        await self.respond("350 Restarting at position %s." % position)
+
+    async def ftp_RETR(self, arg):
+        """Send the given file on the data connection."""
+        path = self._ftp_path(arg)
+        restart_position = self._restart_position
+        self._restart_position = 0
+        if not await self._run(self._fs.isfile, path):
+            await self.respond("550 %s is not retrievable." % path)
+            return
+        if restart_position and restart_position > await self._run(self._fs.getsize, path):
+            await self.respond("554 Invalid REST parameter.")
+            return
+        producer = AdaptedFileProducer(self._fs.file_system_view, path, restart_position)
+
+        async def send(reader, writer):
+            # A file available on the local disk is sent with sendfile when possible
+            try:
+                local_file = await self._run(self._fs.file_system_view.open_local_file, path)
+            except FileSystemError:
+                local_file = None
+            if local_file is not None:
+                try:
+                    await self._send_local_file(writer, local_file, restart_position)
+                finally:
+                    local_file.close()
+                return
+            try:
+                while True:
+                    data = await self._run(producer.more)
+                    if not data:
+                        break
+                    await self._send_data(writer, data)
+            finally:
+                producer.close()
+
+        await self._start_transfer(send)
+
+    async def ftp_STOR(self, arg):
+        """Receive the given file on the data connection."""
+        self._restart_position = 0
+        await self._store(self._ftp_path(arg))
+
+    async def ftp_APPE(self, arg):
+        """Receive data on the data connection, and append it to the given file, which is created if it does not exist."""
+        if self._restart_position:
+            self._restart_position = 0
+            await self.respond("450 Can't APPE while REST request is pending.")
+            return
+        await self._store(self._ftp_path(arg), True)
+
+    async def _store(self, path, append=False):
+        """Receive the file corresponding to the given path on the data connection.
+        If append is True, the received data follows the current contents of the file.
+        """
+        file_system_view = self._fs.file_system_view
+
+        async def receive(reader, writer):
+            new_file_id = await self._run(file_system_view.create_new_file)
+            file_uploader = FileUploader(file_system_view, path, new_file_id)
+            try:
+                if append:
+                    await self._run(self._copy_contents, path, file_uploader)
+                while True:
+                    data = await self._read_data(reader)
+                    if not data:
+                        break
+                    await self._run(file_uploader.write, data)
+                await self._run(file_uploader.close)
+            except BaseException:
+                await asyncio.shield(self._run(self._discard_upload, file_uploader, new_file_id))
+                raise
+            self._fs.invalidate(path)
+            await self._run(file_system_view.commit_new_file, new_file_id, path)
+
+        await self._start_transfer(receive)
+
+    def _copy_contents(self, path, file_uploader):
+        """Write the contents of the file corresponding to the given path, if it exists, with the given FileUploader."""
+        try:
+            if self._fs.file_system_view.is_dir(path):
+                return
+        except InvalidPathFileSystemError:
+            return
+        producer = AdaptedFileProducer(self._fs.file_system_view, path, 0)
+        try:
+            while True:
+                data = producer.more()
+                if not data:
+                    break
+                file_uploader.write(data)
+        finally:
+            producer.close()
+
+    def _discard_upload(self, file_uploader, new_file_id):
+        """Drop the data of an interrupted upload, and delete the corresponding uncommitted file."""
+        try:
+            file_uploader.discard()
+        finally:
+            self._fs.file_system_view.flush_new_file(new_file_id)
+
+    async def ftp_STOU(self, arg):
+        """Return an error message indicating that the server does not support the STOU command."""
+        await self.respond("500 Syntax error, command unrecognized.")
+
+    async def ftp_SITE_CHMOD(self, arg):
+        """Change the mode of the given file, which has no effect on the file system."""
+        mode, _, arg = arg.partition(" ")
+        if not arg:
+            await self.respond("501 Syntax error: command needs two arguments.")
+            return
+        if len(mode) not in (3, 4) or not all(digit in "01234567" for digit in mode):
+            await self.respond("501 Invalid SITE CHMOD format.")
+            return
+        await self._run(self._fs.chmod, self._ftp_path(arg), int(mode, 8))
+        await self.respond("200 SITE CHMOD successful.")
+
+    async def ftp_SITE_HELP(self, arg):
+        """Return the list of the supported SITE commands, or the description of the given one."""
+        site_cmds = sorted(name[9:] for name in dir(self) if name.startswith("ftp_SITE_"))
+        if not arg:
+            await self.respond("214-The following SITE commands are recognized:\r\n" + "".join(" %s\r\n" % cmd for cmd in site_cmds) +
+                               "214 Help SITE command successful.")
+        elif arg.upper() in site_cmds:
+            await self.respond("214 %s" % proto_cmds["SITE " + arg.upper()]["help"])
+        else:
+            await self.respond("501 Unrecognized SITE command.")
+
+    async def ftp_DELE(self, arg):
+        """Delete the given file."""
+        await self._run(self._fs.remove, self._ftp_path(arg))
+        await self.respond("250 File removed.")
+
+    async def ftp_RNFR(self, arg):
+        """Set the path of the file or directory to rename."""
+        path = self._ftp_path(arg)
+        if path == "/":
+            await self.respond("550 Can't rename home directory.")
+            return
+        if not await self._run(self._fs.lexists, path):
+            await self.respond("550 No such file or directory.")
+            return
+        self._rename_from = path
+        await self.respond("350 Ready for destination name.")
+
+    async def ftp_RNTO(self, arg):
+        """Rename the file or directory given by RNFR to the given path."""
+        if self._rename_from is None:
+            await self.respond("503 Bad sequence of commands: use RNFR first.")
+            return
+        source_path = self._rename_from
+        self._rename_from = None
+        await self._run(self._fs.rename, source_path, self._ftp_path(arg))
+        await self.respond("250 Renaming ok.")
@@ -27,19 +27,61 @@
 # ==============================================================================
 
 from pyftpdlib.filesystems import AbstractedFS, FilesystemError as FTPError
+from cloudalpha.content_listing import ContentListing
 from cloudalpha.exceptions import InvalidPathFileSystemError, InvalidTargetFileSystemError, AccessFailedFileSystemError, AlreadyExistsFileSystemError
+from cloudalpha.managers.ftp.ftp_server.listing_cache import ListingCache
 from cloudalpha.managers.ftp.ftp_server.stat_result import StatResult
+from cloudalpha.managers.ftp.settings import FTPSettings
 
 class FileSystemAdapter(AbstractedFS):
     """An adapter between pyftpdlib and cloudalpha.file_system_view.FileSystemView."""
 
-    _listed_dirs = {}
+    _listing_cache = None
+    _prefetched_metadata = None
 
     file_system_view = None
 
     def __init__(self, root, cmd_channel):
         """FileSystemAdapter initializer"""
         self.cmd_channel = cmd_channel
+        self._listing_cache = ListingCache(FTPSettings.listing_cache_ttl, FTPSettings.listing_cache_max_entries)
+        self._prefetched_metadata = {}
+
+    def invalidate(self, path):
+        """Forget the cached listings affected by a modification of the given path."""
+        self._listing_cache.invalidate(self.ftpnorm(path))
+        self._prefetched_metadata.clear()
+
+    def _prefetch_metadata(self, basedir, listing):
+        """Request at once the metadata of the given entries of basedir that are not in the listing cache,
+        so that formatting the listing does not request it entry by entry.
+        """
+        basedir = self.ftpnorm(basedir)
+        paths = []
+        for name in listing:
+            if self._listing_cache.get(basedir, name) is None:
+                paths.append(basedir.rstrip("/") + "/" + name)
+        self._prefetched_metadata.clear()
+        if len(paths) < 2:
+            return
+        try:
+            self._prefetched_metadata.update(zip(paths, self.file_system_view.get_metadata_many(paths)))
+        except AccessFailedFileSystemError:
+            pass
+
+    def format_list(self, basedir, listing, ignore_err=True):
+        """Return an iterator object that yields the entries of the given listing of basedir,
+        emulating the "/bin/ls -lA" UNIX command output.
+        """
+        self._prefetch_metadata(basedir, listing)
+        return super(FileSystemAdapter, self).format_list(basedir, listing, ignore_err)
+
+    def format_mlsx(self, basedir, listing, perms, facts, ignore_err=True):
+        """Return an iterator object that yields the entries of the given listing of basedir,
+        in the format of the MLSD and MLST commands.
+        """
+        self._prefetch_metadata(basedir, listing)
+        return super(FileSystemAdapter, self).format_mlsx(basedir, listing, perms, facts, ignore_err)
 
     @property
     def cwd(self):
@@ -94,6 +136,7 @@ class FileSystemAdapter(AbstractedFS):
 
     def mkdir(self, path):
         """Create the specified directory."""
+        self.invalidate(path)
         try:
             self.file_system_view.make_dir(path)
         except InvalidPathFileSystemError:
@@ -108,11 +151,9 @@ class FileSystemAdapter(AbstractedFS):
         if path[-1] != "/":
             path += "/"
         try:
-            self._listed_dirs[path] = self.file_system_view.get_content_metadata(path)
-            res = []
-            for metadata in self._listed_dirs[path]:
-                res.append(metadata.name)
-            return res
+            content_listing = ContentListing.from_metadata(self.file_system_view.get_content_metadata(path))
+            self._listing_cache.set(self.ftpnorm(path), content_listing)
+            return content_listing.names
         except InvalidPathFileSystemError:
             raise FTPError("No such file or directory")
         except InvalidTargetFileSystemError:
@@ -122,7 +163,8 @@ class FileSystemAdapter(AbstractedFS):
 
     def rmdir(self, path):
         """Remove the specified directory."""
-        with self.file_system_view.lock:
+        self.invalidate(path)
+        with self.file_system_view.get_path_lock(path):
             try:
                 if self.file_system_view.is_dir(path):
                         self.file_system_view.delete(path)
@@ -135,7 +177,8 @@ class FileSystemAdapter(AbstractedFS):
 
     def remove(self, path):
         """Remove the specified file."""
-        with self.file_system_view.lock:
+        self.invalidate(path)
+        with self.file_system_view.get_path_lock(path):
             try:
                 if self.file_system_view.is_file(path):
                     self.file_system_view.delete(path)
@@ -151,7 +194,9 @@ class FileSystemAdapter(AbstractedFS):
 
     def rename(self, src, dst):
         """Rename the specified src file to the dst filename."""
-        with self.file_system_view.lock:
+        self.invalidate(src)
+        self.invalidate(dst)
+        with self.file_system_view.get_path_lock(src, dst):
             try:
                 if not self.file_system_view.exists(src):
                     raise FTPError("No such file or directory")
@@ -173,16 +218,14 @@ class FileSystemAdapter(AbstractedFS):
     def metadata(self, path):
         """Return a FileMetadata object corresponding to path."""
         path = self.ftpnorm(path)
-        if path[-1] == "/":
-            path = path[:-1]
-        path_split = path.rsplit("/", 1)
-        parent_path = path_split[0]
-        filename = path_split[-1]
         meta = None
-        if parent_path in self._listed_dirs:
-            for content_meta in self._listed_dirs[parent_path]:
-                if content_meta.name == filename:
-                    meta = content_meta
+        if path != "/":
+            parent_path, filename = path.rstrip("/").rsplit("/", 1)
+            meta = self._listing_cache.get(parent_path, filename)
+        if meta == None and path in self._prefetched_metadata:
+            meta = self._prefetched_metadata.pop(path)
+            if meta == None:
+                raise FTPError("No such file or directory")
         if meta == None:
             try:
                 meta = self.file_system_view.get_metadata(path)
@@ -198,7 +241,7 @@ class FileSystemAdapter(AbstractedFS):
         mode = StatResult.Modes.FILE
         if meta.is_dir:
             mode = StatResult.Modes.DIRECTORY
-        return StatResult(mode, meta.size, meta.accessed_datetime.timestamp(), meta.modified_datetime.timestamp(), meta.created_datetime.timestamp())
+        return StatResult(mode, meta.size, meta.accessed_time, meta.modified_time, meta.created_time)
 
     def lstat(self, path):
         """Same as stat."""
@@ -226,7 +269,7 @@ class FileSystemAdapter(AbstractedFS):
 
     def getmtime(self, path):
         """Return the last modified time of path as a number of seconds since the epoch."""
-        return self.metadata(path).modified_datetime.timestamp()
+        return self.metadata(path).modified_time
 
     def realpath(self, path):
         """Return the given path as is."""
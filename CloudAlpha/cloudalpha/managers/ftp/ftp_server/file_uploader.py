@@ -19,13 +19,24 @@
 # http://github.com/plbrault/cloudalpha
 # =============================================================================
 
+from cloudalpha.managers.ftp.settings import FTPSettings
+from cloudalpha.managers.ftp.ftp_server.upload_sender import UploadSender
+
 class FileUploader(object):
     """This class handles the writing to a file of the file system
-    in order to store files transferred from the client to the server."""
+    in order to store files transferred from the client to the server.
+    
+    The data is accumulated in a buffer of FTPSettings.upload_buffer_size bytes,
+    and written to the file system by chunks of that size. Unless FTPSettings.upload_queue_chunks
+    is zero, the chunks are written by an UploadSender thread, while the next ones are received.
+    """
 
     _file_path = None
     _new_file_id = None
     _file_system_view = None
+    _buffer_size = 0
+    _buffer = None
+    _sender = None
 
     closed = False
 
@@ -39,11 +50,51 @@ class FileUploader(object):
         self._file_system_view = file_system_view
         self._file_path = file_path
         self._new_file_id = new_file_id
+        self._buffer_size = FTPSettings.upload_buffer_size
+        self._buffer = bytearray()
+
+    def _write_chunk(self, data):
+        """Write a chunk of data to the file, or queue it for the UploadSender thread."""
+        if FTPSettings.upload_queue_chunks <= 0:
+            self._file_system_view.write_to_new_file(self._new_file_id, data)
+            return
+        if self._sender is None:
+            self._sender = UploadSender(self._file_system_view, self._new_file_id, FTPSettings.upload_queue_chunks)
+            self._sender.start()
+        self._sender.send(data)
 
     def write(self, chunk):
         """Append a chunk of data to the end of the file."""
-        self._file_system_view.write_to_new_file(self._new_file_id, chunk)
+        if self._buffer_size <= 0:
+            self._write_chunk(chunk)
+            return
+        self._buffer.extend(chunk)
+        while len(self._buffer) >= self._buffer_size:
+            data = bytes(self._buffer[:self._buffer_size])
+            del self._buffer[:self._buffer_size]
+            self._write_chunk(data)
+
+    def flush(self):
+        """Write the buffered data to the file, and wait for all the queued chunks to be written."""
+        if self._buffer:
+            data = bytes(self._buffer)
+            self._buffer = bytearray()
+            self._write_chunk(data)
+        if self._sender is not None:
+            sender = self._sender
+            self._sender = None
+            sender.finish()
 
     def close(self):
-        """Set closed to True."""
+        """Write the buffered data to the file, then set closed to True."""
+        if not self.closed:
+            self.flush()
+            self.closed = True
+
+    def discard(self):
+        """Drop the buffered and queued data without writing it, then set closed to True."""
+        self._buffer = bytearray()
+        if self._sender is not None:
+            self._sender.discard()
+            self._sender = None
         self.closed = True
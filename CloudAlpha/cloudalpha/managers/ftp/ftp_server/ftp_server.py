@@ -22,6 +22,7 @@
 from pyftpdlib.servers import ThreadedFTPServer as Server
 from pyftpdlib.authorizers import DummyAuthorizer
 from cloudalpha.managers.ftp.settings import FTPSettings
+from cloudalpha.content_cache import ContentCache
 from cloudalpha.managers.ftp.ftp_server.ftp_server_thread import FTPServerThread
 import cloudalpha.managers.ftp.ftp_server.strerror  # @UnusedImport
 
@@ -37,6 +38,7 @@ class FTPServer:
     _thread = None
     _authorizer = DummyAuthorizer()
     _file_system_views = {}
+    _content_cache = None
 
     use_count = 0
 
@@ -45,6 +47,8 @@ class FTPServer:
         if not cls._instance:
             cls._instance = super(FTPServer, cls).__new__(cls, *args, **kwargs)
             cls._instance._port = FTPSettings.ftp_server_port
+            if FTPSettings.content_cache_dir:
+                cls._instance._content_cache = ContentCache(FTPSettings.content_cache_dir, FTPSettings.content_cache_max_size)
         return cls._instance
 
     def user_exists(self, username):
@@ -54,38 +58,67 @@ class FTPServer:
     def add_user(self, username, password, file_system_view):
         """Add a new user with the given username and password, associated
         to the specified cloudalpha.file_system_view.FileSystemView instance."""
+        file_system_view.content_cache = self._content_cache
         self._file_system_views[username] = file_system_view
         self._authorizer.add_user(username, password, "/", perm="elradfmw")
+        if self._server is not None and FTPSettings.ftp_server_mode == "prefork":
+            self._server.reload()
 
     def remove_user(self, username):
         """Remove the user corresponding to the given username."""
         self._authorizer.remove_user(username)
         del self._file_system_views[username]
+        if self._server is not None and FTPSettings.ftp_server_mode == "prefork":
+            self._server.reload()
 
     def get_file_system_view(self, username):
         """Get the cloudalpha.file_system_view.FileSystemView instance
         corresponding to the given username."""
         return self._file_system_views[username]
 
+    def _create_threaded_server(self, address_or_socket):
+        """Return a new pyftpdlib ThreadedFTPServer listening on the given (host, port) address or socket."""
+        from cloudalpha.managers.ftp.ftp_server.file_system_adapter import FileSystemAdapter
+        from cloudalpha.managers.ftp.ftp_server.adapted_ftp_handler import AdaptedFTPHandler
+
+        # Get FileSystemAdapter
+        fs_adapter = FileSystemAdapter
+
+        # Initiate the FTP Handler class
+        handler = AdaptedFTPHandler
+        handler.authorizer = self._authorizer
+        handler.abstracted_fs = fs_adapter
+        handler.banner = "CloudAlpha FTP manager ready."
+
+        # Initiate the server
+        server = Server(address_or_socket, handler)
+        server.max_cons = server.max_cons_per_ip = FTPSettings.max_connections
+        return server
+
     def start_using(self):
-        """Increment use_count. If the FTP server is currently not running, start it in a new thread."""
+        """Increment use_count. If the FTP server is currently not running, start it in a new thread.
+        
+        If FTPSettings.ftp_server_mode is "asyncio", the server is an AsyncFTPServer.
+        If it is "prefork", the server is a PreforkFTPServer whose workers run pyftpdlib ThreadedFTPServers.
+        Otherwise, it is a pyftpdlib ThreadedFTPServer.
+        """
         self.use_count += 1
-        if self._server is None:
-            from cloudalpha.managers.ftp.ftp_server.file_system_adapter import FileSystemAdapter
-            from cloudalpha.managers.ftp.ftp_server.adapted_ftp_handler import AdaptedFTPHandler
-
-            # Get FileSystemAdapter
-            fs_adapter = FileSystemAdapter
-
-            # Initiate the FTP Handler class
-            handler = AdaptedFTPHandler
-            handler.authorizer = self._authorizer
-            handler.abstracted_fs = fs_adapter
-            handler.banner = "CloudAlpha FTP manager ready."
-
-            # Initiate and start the server
-            self._server = Server(("0.0.0.0", self._port), handler)
-            self._server.max_cons = self._server.max_cons_per_ip = 256
+        if self._server is None and FTPSettings.ftp_server_mode == "asyncio":
+            from cloudalpha.managers.ftp.ftp_server.async_ftp_server import AsyncFTPServer
+
+            self._server = AsyncFTPServer(("0.0.0.0", self._port), self._authorizer)
+            self._server.max_cons = FTPSettings.max_connections
+            self._thread = FTPServerThread(self._server)
+            self._thread.start()
+        elif self._server is None and FTPSettings.ftp_server_mode == "prefork":
+            from cloudalpha.managers.ftp.ftp_server.prefork_ftp_server import PreforkFTPServer
+
+            self._server = PreforkFTPServer(("0.0.0.0", self._port), self._create_threaded_server,
+                                            self._file_system_views, self._content_cache)
+            self._thread = FTPServerThread(self._server)
+            self._thread.start()
+        elif self._server is None:
+            self._server = self._create_threaded_server(("0.0.0.0", self._port))
             self._thread = FTPServerThread(self._server)
             self._thread.start()
 
@@ -0,0 +1,100 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+from collections import OrderedDict
+import time
+
+from cloudalpha.content_listing import ContentListing
+
+class ListingCache(object):
+    """A cache of the directory listings obtained by an FTP session, indexed by
+    directory path and file name.
+    
+    Listings are stored as ContentListing objects, and expire after a given time to live.
+    The least recently used listings are evicted when the total number of cached entries
+    exceeds the given limit.
+    """
+
+    _ttl = 0
+    _max_entries = 0
+    _num_entries = 0
+    _listings = None
+
+    @staticmethod
+    def _normalize_path(path):
+        """Return the key under which the listing of the given directory is stored."""
+        return path.rstrip("/") or "/"
+
+    def _remove(self, key):
+        """Remove the listing stored under the given key."""
+        listing = self._listings.pop(key)[1]
+        self._num_entries -= len(listing)
+
+    def set(self, dir_path, content_metadata):
+        """Store the given iterable of FileMetadata objects as the listing of the directory corresponding to dir_path."""
+        key = self._normalize_path(dir_path)
+        listing = ContentListing.from_metadata(content_metadata)
+        if key in self._listings:
+            self._remove(key)
+        if self._ttl <= 0 or len(listing) > self._max_entries:
+            return
+        self._listings[key] = (time.monotonic() + self._ttl, listing)
+        self._num_entries += len(listing)
+        while self._num_entries > self._max_entries:
+            self._remove(next(iter(self._listings)))
+
+    def get(self, dir_path, name):
+        """Return the FileMetadata object corresponding to the given name in the listing of the
+        directory corresponding to dir_path. If there is no such object, or if the listing
+        expired, return None.
+        """
+        key = self._normalize_path(dir_path)
+        entry = self._listings.get(key)
+        if entry is None:
+            return None
+        expiry, listing = entry
+        if expiry < time.monotonic():
+            self._remove(key)
+            return None
+        self._listings.move_to_end(key)
+        return listing.get(name)
+
+    def invalidate(self, path):
+        """Remove the listings of the given path, of its subdirectories and of its parent directory."""
+        key = self._normalize_path(path)
+        parent_key = key.rsplit("/", 1)[0] or "/"
+        prefix = key.rstrip("/") + "/"
+        for cached_key in [k for k in self._listings if k == key or k == parent_key or k.startswith(prefix)]:
+            self._remove(cached_key)
+
+    def clear(self):
+        """Remove all listings."""
+        self._listings.clear()
+        self._num_entries = 0
+
+    def __init__(self, ttl, max_entries):
+        """Create a cache whose listings live for ttl seconds, and holding at most max_entries entries.
+        
+        If ttl or max_entries is zero, the cache is disabled.
+        """
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._listings = OrderedDict()
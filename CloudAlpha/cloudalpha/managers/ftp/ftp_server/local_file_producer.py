@@ -0,0 +1,48 @@
+# ==============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+#
+#
+#
+# This file contains work derived from the source code of the pyftpdlib library,
+# covered by the following copyright notice:
+# Copyright (C) 2007-2014 Giampaolo Rodola' <g.rodola@gmail.com>
+#
+# ==============================================================================
+
+
+from pyftpdlib.handlers import FileProducer
+
+class LocalFileProducer(FileProducer):
+    """This class handles the sending of a file stored on the local disk, as returned by
+    cloudalpha.file_system_view.FileSystemView.open_local_file.
+    
+    The data channel sends it with the sendfile system call when possible, so that its
+    contents are not copied in Python. Otherwise, it is read in chunks of buffer_size bytes.
+    """
+
+    def __init__(self, file, offset=0):
+        """LocalFileProducer instance initializer. The file is read from the given offset."""
+        # The data is sent as is, whatever the transfer type, like AdaptedFileProducer does
+        super(LocalFileProducer, self).__init__(file, "i")
+        self.file.seek(offset)
+
+    def close(self):
+        """Close the file."""
+        self.file.close()
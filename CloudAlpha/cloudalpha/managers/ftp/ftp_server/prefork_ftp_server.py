@@ -0,0 +1,400 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+import itertools
+import json
+import os
+import selectors
+import signal
+import socket
+import tempfile
+from threading import Lock, Thread
+
+from pyftpdlib.log import logger
+
+from cloudalpha.managers.ftp.settings import FTPSettings
+from cloudalpha.shared_metadata_store import SharedMetadataStore
+
+
+class _RetiredWorkerError(Exception):
+    """Raised in a worker asked to stop accepting connections."""
+
+
+class _Worker(object):
+    """A worker of a PreforkFTPServer, as seen from the parent process."""
+
+    channel = None
+    buffer = None
+    file_systems = None
+    num_messages = 0
+    num_acknowledged_messages = 0
+    retiring = False
+
+    def __init__(self, channel, file_systems):
+        """Create a worker connected to the parent process by the given channel,
+        and serving the given list of FileSystem instances.
+        """
+        self.channel = channel
+        self.buffer = bytearray()
+        self.file_systems = file_systems
+
+
+class PreforkFTPServer(object):
+    """An FTP server made of several worker processes accepting connections on a shared listening socket,
+    so that the protocol work and the formatting of the listings are spread over several cores.
+    
+    The workers are created by os.fork, and each of them runs its own server, created by the given function.
+    They share the metadata cached by their file systems through a SharedMetadataStore, and each modification
+    made by a worker is relayed by the parent process to the other workers, which remove the corresponding
+    entries from their own caches.
+    
+    The state of the file systems that must have a single owner, like the in-memory mirror of a Dropbox account,
+    is kept up to date by the parent process only, which sends the changes made to it to the workers.
+    
+    The workers are created from the state of the parent process at the time they are started. Changes made
+    afterwards, like the addition of a user, require calling reload, which replaces the workers. The replaced
+    workers stop accepting connections, and exit once their sessions are closed.
+    
+    Like ThreadedFTPServer, it is run by serve_forever, and stopped from another thread by stop.
+    Only available on POSIX systems.
+    """
+
+    _RESPAWN_CHECK_INTERVAL = 1
+
+    _address = None
+    _create_server = None
+    _file_system_views = None
+    _content_cache = None
+    _num_workers = 0
+    _socket = None
+    _store_dir = None
+    _workers = None
+    _wakeup_reader = None
+    _wakeup_writer = None
+
+    def __init__(self, address, create_server, file_system_views, content_cache=None):
+        """Create a server listening on the given (host, port) address.
+        
+        create_server is called in each worker with the listening socket, and must return a pyftpdlib server using it.
+        file_system_views is a dictionary whose values are the FileSystemView instances served, and content_cache
+        is the ContentCache shared by them, if any.
+        """
+        self._address = address
+        self._create_server = create_server
+        self._file_system_views = file_system_views
+        self._content_cache = content_cache
+        self._num_workers = FTPSettings.worker_processes or os.cpu_count() or 1
+        self._workers = {}
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+
+    def _get_file_systems(self):
+        """Return the list of the distinct FileSystem instances to which the served views are mapped."""
+        file_systems = []
+        for file_system_view in self._file_system_views.values():
+            if self._get_index(file_systems, file_system_view.file_system) is None:
+                file_systems.append(file_system_view.file_system)
+        return file_systems
+
+    @staticmethod
+    def _get_index(file_systems, file_system):
+        """Return the index of the given FileSystem instance in the given list, or None if it is not in it."""
+        for index, other_file_system in enumerate(file_systems):
+            if other_file_system is file_system:
+                return index
+        return None
+
+    def _spawn_worker(self, file_systems, selector):
+        """Fork a new worker serving the given file systems, and register the channel connecting it to the parent process."""
+        channel, worker_channel = socket.socketpair()
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                channel.close()
+                self._run_worker(file_systems, worker_channel, selector)
+            except:
+                exit_code = 1
+            finally:
+                os._exit(exit_code)
+        worker_channel.close()
+        self._workers[pid] = _Worker(channel, file_systems)
+        selector.register(channel, selectors.EVENT_READ, pid)
+
+    def _close_channel(self, pid, selector):
+        """Unregister and close the channel connecting the given worker to the parent process, if still open."""
+        worker = self._workers[pid]
+        if worker.channel is not None:
+            selector.unregister(worker.channel)
+            worker.channel.close()
+            worker.channel = None
+
+    def _run_worker(self, file_systems, channel, selector):
+        """Serve FTP connections in a worker process, until it receives SIGTERM or the parent process exits.
+        When it receives SIGUSR1, stop accepting connections, and return once the sessions are closed.
+        """
+        signal.signal(signal.SIGTERM, self._exit_worker)
+        signal.signal(signal.SIGUSR1, self._retire_worker)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        selector.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+        for worker in self._workers.values():
+            if worker.channel is not None:
+                worker.channel.close()
+        self._workers = {}
+        shared_metadata_store = SharedMetadataStore(os.path.join(self._store_dir, "metadata.db"))
+        # Also held while a replica update is applied, so that it cannot miss a modification being published
+        channel_lock = Lock()
+        message_numbers = itertools.count(1)
+        # The (message number, index, path) of the modifications the parent process may not have received yet
+        pending_modifications = []
+
+        def publish(index, path):
+            """Send the given modification to the parent process."""
+            message = (json.dumps([index, path]) + "\n").encode("utf-8")
+            with channel_lock:
+                pending_modifications.append((next(message_numbers), index, path))
+                try:
+                    channel.sendall(message)
+                except OSError:
+                    pass
+
+        for index, file_system in enumerate(file_systems):
+            file_system.after_fork()
+            file_system.set_shared_metadata_store(shared_metadata_store)
+            file_system.add_modification_listener(lambda path, index=index: publish(index, path))
+        if self._content_cache is not None:
+            self._content_cache.after_fork()
+        Thread(target=self._receive_messages, args=(file_systems, channel, channel_lock, pending_modifications),
+               daemon=True).start()
+        server = self._create_server(self._socket)
+        try:
+            server.serve_forever()
+        except _RetiredWorkerError:
+            server.close()
+            self._join_sessions(server)
+
+    @staticmethod
+    def _join_sessions(server):
+        """Wait until the sessions of the given pyftpdlib server are closed.
+        
+        pyftpdlib offers no public way to do it, so this relies on the _active_tasks list in which the
+        multi-threaded server of pyftpdlib 1.4 keeps the threads running its sessions. If the server has
+        no such list, return immediately.
+        """
+        for task in list(getattr(server, "_active_tasks", ())):
+            task.join()
+
+    @staticmethod
+    def _exit_worker(signum, frame):
+        """Make the server of a worker close its connections and return."""
+        raise SystemExit()
+
+    @staticmethod
+    def _retire_worker(signum, frame):
+        """Make the server of a worker return without closing its connections."""
+        raise _RetiredWorkerError()
+
+    @staticmethod
+    def _receive_messages(file_systems, channel, channel_lock, pending_modifications):
+        """Apply the modifications made by the other workers to the caches of the given file systems,
+        and the replica updates sent by the parent process. When the parent process exits, terminate the worker.
+        
+        An invalid message is logged and ignored. Any other error also terminates the worker, whose caches
+        could no longer be kept up to date, so that the parent process replaces it.
+        """
+        try:
+            for line in channel.makefile("rb"):
+                try:
+                    message = json.loads(line.decode("utf-8"))
+                    if isinstance(message, list):
+                        index, path = message
+                        file_systems[index].invalidate_cache(path)
+                    else:
+                        with channel_lock:
+                            pending_modifications[:] = [modification for modification in pending_modifications
+                                                        if modification[0] > message["acknowledged"]]
+                            if "index" in message:
+                                stale_paths = [path for number, index, path in pending_modifications
+                                               if index == message["index"]]
+                                file_systems[message["index"]].apply_replica_update(message["update"], stale_paths)
+                except (ValueError, LookupError, TypeError):
+                    logger.exception("Ignored an invalid message from the parent process")
+        except Exception:
+            logger.exception("Failed to apply a message from the parent process")
+        finally:
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    @staticmethod
+    def _send(worker, message):
+        """Send the given message to the given worker, if its channel is still open."""
+        if worker.channel is not None:
+            try:
+                worker.channel.sendall((json.dumps(message) + "\n").encode("utf-8"))
+            except OSError:
+                pass
+
+    def _relay(self, pid, selector):
+        """Apply the complete modification messages received from the given worker to the file systems of the
+        parent process, and forward them to the other workers. If the worker closed its channel, close it too.
+        """
+        worker = self._workers[pid]
+        if worker.channel is None:
+            return
+        try:
+            data = worker.channel.recv(65536)
+        except OSError:
+            data = b""
+        if not data:
+            self._close_channel(pid, selector)
+            return
+        worker.buffer += data
+        end = worker.buffer.rfind(b"\n") + 1
+        if end == 0:
+            return
+        lines = bytes(worker.buffer[:end]).splitlines()
+        del worker.buffer[:end]
+        for line in lines:
+            worker.num_messages += 1
+            try:
+                index, path = json.loads(line.decode("utf-8"))
+                file_system = worker.file_systems[index]
+            except:
+                continue
+            file_system.invalidate_cache(path)
+            for other_pid, other_worker in self._workers.items():
+                other_index = self._get_index(other_worker.file_systems, file_system)
+                if other_pid != pid and other_index is not None:
+                    self._send(other_worker, [other_index, path])
+
+    def _send_replica_updates(self):
+        """Send the changes made to the state of the file systems of the parent process to the workers serving them.
+        
+        Each worker is also sent the number of modification messages received from it before the changes were
+        collected, so that it knows which of its modifications they take into account.
+        """
+        file_systems = []
+        for worker in self._workers.values():
+            for file_system in worker.file_systems:
+                if self._get_index(file_systems, file_system) is None:
+                    file_systems.append(file_system)
+        for file_system in file_systems:
+            update = file_system.get_replica_update()
+            if update is None:
+                continue
+            for worker in self._workers.values():
+                index = self._get_index(worker.file_systems, file_system)
+                if index is not None:
+                    self._send(worker, {"index": index, "update": update, "acknowledged": worker.num_messages})
+                    worker.num_acknowledged_messages = worker.num_messages
+        for worker in self._workers.values():
+            if worker.num_acknowledged_messages < worker.num_messages:
+                self._send(worker, {"acknowledged": worker.num_messages})
+                worker.num_acknowledged_messages = worker.num_messages
+
+    def _retire_workers(self):
+        """Make the current workers stop accepting connections, and exit once their sessions are closed."""
+        for pid, worker in self._workers.items():
+            if not worker.retiring:
+                worker.retiring = True
+                try:
+                    os.kill(pid, signal.SIGUSR1)
+                except OSError:
+                    pass
+
+    def _stop_workers(self, selector):
+        """Terminate all the workers and wait for them to exit."""
+        for pid in self._workers:
+            self._close_channel(pid, selector)
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        for pid in self._workers:
+            try:
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self._workers = {}
+
+    def _reap_workers(self, selector):
+        """Forget the workers that exited."""
+        for pid in list(self._workers):
+            try:
+                exited_pid, status = os.waitpid(pid, os.WNOHANG)
+            except OSError:
+                exited_pid = pid
+            if exited_pid == pid:
+                self._close_channel(pid, selector)
+                del self._workers[pid]
+
+    def serve_forever(self):
+        """Start the workers and relay their modifications until stop is called.
+        The workers that exit unexpectedly are replaced.
+        """
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind(self._address)
+        self._socket.listen(100)
+        self._store_dir = tempfile.mkdtemp(prefix="cloudalpha-")
+        # Create the database before the workers open it concurrently
+        SharedMetadataStore(os.path.join(self._store_dir, "metadata.db"))
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeup_reader, selectors.EVENT_READ, None)
+        file_systems = self._get_file_systems()
+        # The first workers are copies of the current state, so only the changes made from now on are sent to them
+        for file_system in file_systems:
+            file_system.get_replica_update()
+        stopped = False
+        try:
+            while not stopped:
+                self._reap_workers(selector)
+                while len([worker for worker in self._workers.values() if not worker.retiring]) < self._num_workers:
+                    self._spawn_worker(file_systems, selector)
+                for key, events in selector.select(self._RESPAWN_CHECK_INTERVAL):
+                    if key.data is not None:
+                        if key.data in self._workers:
+                            self._relay(key.data, selector)
+                        continue
+                    for command in self._wakeup_reader.recv(4096):
+                        if command == ord("s"):
+                            stopped = True
+                        elif command == ord("r"):
+                            self._retire_workers()
+                            file_systems = self._get_file_systems()
+                self._send_replica_updates()
+        finally:
+            self._stop_workers(selector)
+            selector.close()
+            self._socket.close()
+            for filename in os.listdir(self._store_dir):
+                os.remove(os.path.join(self._store_dir, filename))
+            os.rmdir(self._store_dir)
+
+    def reload(self):
+        """Replace the workers by new ones, created from the current state of the parent process, without closing
+        the sessions of the current workers, which exit once they are closed. Can be called from any thread.
+        """
+        self._wakeup_writer.send(b"r")
+
+    def stop(self):
+        """Stop the server and its workers. Can be called from any thread."""
+        self._wakeup_writer.send(b"s")
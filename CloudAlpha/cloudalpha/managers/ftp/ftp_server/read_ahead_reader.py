@@ -0,0 +1,191 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Thread, Condition
+
+from cloudalpha.managers.ftp.settings import FTPSettings
+
+class ReadAheadReader(Thread):
+    """A thread reading a file of a FileSystemView by blocks of FTPSettings.read_ahead_block_size
+    bytes, ahead of the consumer of the data.
+    
+    If the file is at least FTPSettings.parallel_download_min_size bytes long, up to
+    FTPSettings.parallel_download_streams blocks are read concurrently by a pool of threads,
+    and handed to the consumer in order. Otherwise, the blocks are read one at a time.
+    
+    Each reader holds at most FTPSettings.read_ahead_blocks blocks, including the one being
+    consumed, or one more than the number of concurrent streams if it is greater. All readers
+    together hold at most FTPSettings.read_ahead_max_memory bytes, except that a reader
+    holding no block may always read one, so that every transfer makes progress.
+    """
+
+    _condition = Condition()
+    _used_blocks = 0
+
+    _file_system_view = None
+    _file_path = None
+    _offset = 0
+    _block_size = 0
+    _file_size = None
+    _metadata = None
+    _streams = 1
+    _max_blocks = 0
+    _blocks = None
+    _held_blocks = 0
+    _current_block = None
+    _position = 0
+    _finished = False
+    _closed = False
+
+    def __init__(self, file_system_view, file_path, offset=0):
+        """Create a reader for the file corresponding to file_path, starting at the given offset.
+        The reading begins when the thread is started.
+        """
+        self._file_system_view = file_system_view
+        self._file_path = file_path
+        self._offset = offset
+        self._block_size = FTPSettings.read_ahead_block_size
+        self._max_blocks = FTPSettings.read_ahead_blocks
+        self._blocks = deque()
+        super(ReadAheadReader, self).__init__(daemon=True)
+
+    def _may_hold_block(self):
+        """Return a boolean value indicating if the reader may hold one more block."""
+        if self._held_blocks == 0:
+            return True
+        max_blocks = FTPSettings.read_ahead_max_memory // self._block_size
+        return self._held_blocks < self._max_blocks and ReadAheadReader._used_blocks < max_blocks
+
+    def _release_blocks(self, num_blocks=1):
+        """Release the memory accounted for the given number of blocks held by the reader."""
+        with self._condition:
+            self._held_blocks -= num_blocks
+            ReadAheadReader._used_blocks -= num_blocks
+            self._condition.notify_all()
+
+    def _prepare_streams(self):
+        """Get the metadata of the file, so that it is not requested again for each block,
+        and determine the number of blocks to read concurrently, depending on the size of the file.
+        """
+        try:
+            metadata = self._file_system_view.get_metadata(self._file_path)
+        except:
+            # Let the first read report the error
+            return
+        if metadata.is_dir:
+            return
+        self._metadata = metadata
+        if FTPSettings.parallel_download_streams > 1 and metadata.size >= FTPSettings.parallel_download_min_size:
+            self._file_size = metadata.size
+            self._streams = FTPSettings.parallel_download_streams
+            self._max_blocks = max(self._max_blocks, self._streams + 1)
+
+    def _read_block(self, offset):
+        """Read the block beginning at offset. If reading it fails, return the exception raised."""
+        try:
+            data = self._file_system_view.read(self._file_path, offset, self._block_size, self._metadata)
+            if not data:
+                data = b""
+            return data
+        except Exception as e:
+            return e
+
+    def run(self):
+        """Read the file block by block, until its end is reached or the reader is closed."""
+        self._prepare_streams()
+        executor = ThreadPoolExecutor(self._streams) if self._streams > 1 else None
+        try:
+            while self._file_size is None or self._offset < self._file_size:
+                with self._condition:
+                    while not self._closed and not self._may_hold_block():
+                        self._condition.wait()
+                    if self._closed:
+                        return
+                    self._held_blocks += 1
+                    ReadAheadReader._used_blocks += 1
+                if executor is not None:
+                    data = executor.submit(self._read_block, self._offset)
+                else:
+                    data = self._read_block(self._offset)
+                with self._condition:
+                    if self._closed:
+                        self._release_blocks()
+                        return
+                    self._blocks.append(data)
+                    self._condition.notify_all()
+                if executor is None and (isinstance(data, Exception) or len(data) < self._block_size):
+                    return
+                self._offset += self._block_size
+            # Mark the end of the file with an empty block, in case the last block read is a full one
+            with self._condition:
+                if not self._closed:
+                    self._held_blocks += 1
+                    ReadAheadReader._used_blocks += 1
+                    self._blocks.append(b"")
+                    self._condition.notify_all()
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+
+    def read(self, size):
+        """Return at most size bytes of data, waiting for the next block if needed.
+        At the end of the file, return an empty bytes object.
+        
+        If reading the file failed, raise the exception raised by the FileSystemView.
+        """
+        while self._current_block is None or self._position >= len(self._current_block):
+            if self._current_block is not None:
+                self._current_block = None
+                self._release_blocks()
+            if self._finished:
+                return b""
+            with self._condition:
+                while not self._blocks:
+                    self._condition.wait()
+                data = self._blocks.popleft()
+            if isinstance(data, Future):
+                data = data.result()
+            if isinstance(data, Exception):
+                self._finished = True
+                self._release_blocks()
+                raise data
+            if len(data) < self._block_size:
+                self._finished = True
+            self._current_block = memoryview(data)
+            self._position = 0
+        chunk = bytes(self._current_block[self._position:self._position + size])
+        self._position += len(chunk)
+        return chunk
+
+    def close(self):
+        """Stop reading ahead and release all the blocks held by the reader."""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            held_blocks = len(self._blocks)
+            if self._current_block is not None:
+                held_blocks += 1
+            self._blocks.clear()
+            self._current_block = None
+            self._release_blocks(held_blocks)
@@ -20,18 +20,18 @@
 # =============================================================================
 
 class StatResult():
-    """A mock of the os.stat result class."""
+    """A mock of the os.stat result class.
+    
+    The attributes that vary are declared in __slots__, as an instance is built for each entry of a listing.
+    """
+
+    __slots__ = ("st_mode", "st_size", "st_atime", "st_mtime", "st_ctime")
 
-    st_mode = None
     st_ino = 0
     st_dev = 0
     st_nlink = 1
     st_uid = 0
     st_gid = 0
-    st_size = None
-    st_atime = None
-    st_mtime = None
-    st_ctime = None
 
     def __init__(self, mode, size, accessed_time, modified_time, created_time):
         """StatResult initializer"""
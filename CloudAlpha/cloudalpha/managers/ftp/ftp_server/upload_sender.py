@@ -0,0 +1,90 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+from queue import Queue
+from threading import Thread
+
+class UploadSender(Thread):
+    """A thread writing chunks of data to an uncommitted file of a FileSystemView,
+    in the order in which they are queued, so that receiving data from the client
+    overlaps with sending it to the file system.
+    
+    At most max_chunks chunks wait in the queue. When it is full, queueing a chunk
+    blocks until the thread has taken one, which stops the data channel from
+    reading the socket in the meantime.
+    """
+
+    _file_system_view = None
+    _new_file_id = None
+    _queue = None
+    _error = None
+    _discarded = False
+
+    def __init__(self, file_system_view, new_file_id, max_chunks):
+        """Create a sender for the uncommitted file corresponding to new_file_id.
+        The sending begins when the thread is started.
+        """
+        self._file_system_view = file_system_view
+        self._new_file_id = new_file_id
+        self._queue = Queue(max_chunks)
+        super(UploadSender, self).__init__(daemon=True)
+
+    def _raise_error(self):
+        """If writing a chunk failed, raise the exception raised by the FileSystemView."""
+        if self._error is not None:
+            raise self._error
+
+    def run(self):
+        """Write the queued chunks until the end of the queue is reached.
+        After a failure, the remaining chunks are dropped.
+        """
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            if self._error is None and not self._discarded:
+                try:
+                    self._file_system_view.write_to_new_file(self._new_file_id, data)
+                except Exception as e:
+                    self._error = e
+
+    def send(self, data):
+        """Queue a chunk of data, waiting for room in the queue if needed.
+        
+        If writing a previous chunk failed, raise the exception raised by the FileSystemView.
+        """
+        self._raise_error()
+        self._queue.put(data)
+
+    def finish(self):
+        """Wait for all the queued chunks to be written.
+        
+        If writing a chunk failed, raise the exception raised by the FileSystemView.
+        """
+        self._queue.put(None)
+        self.join()
+        self._raise_error()
+
+    def discard(self):
+        """Drop the queued chunks and wait for the thread to stop."""
+        self._discarded = True
+        self._queue.put(None)
+        self.join()
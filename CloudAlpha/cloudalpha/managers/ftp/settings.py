@@ -26,6 +26,21 @@ class FTPSettings(Settings):
     """A static class containing global settings for all FTP managers."""
 
     ftp_server_port = 21
+    ftp_server_mode = "threaded"
+    max_connections = 256
+    async_worker_threads = 32
+    worker_processes = 0
+    listing_cache_ttl = 10
+    listing_cache_max_entries = 100000
+    read_ahead_block_size = 4194304
+    read_ahead_blocks = 2
+    read_ahead_max_memory = 268435456
+    parallel_download_streams = 4
+    parallel_download_min_size = 16777216
+    upload_buffer_size = 4194304
+    upload_queue_chunks = 2
+    content_cache_dir = None
+    content_cache_max_size = 1073741824
 
     @classmethod
     def set(cls, name, value):
@@ -41,5 +56,77 @@ class FTPSettings(Settings):
                 cls.ftp_server_port = int(value)
             except:
                 raise ValueParsingSettingError
+        elif name == "ftp_server_mode":
+            if str(value).lower() in ("threaded", "asyncio", "prefork"):
+                cls.ftp_server_mode = str(value).lower()
+            else:
+                raise ValueParsingSettingError
+        elif name == "max_connections":
+            try:
+                cls.max_connections = int(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "async_worker_threads":
+            try:
+                cls.async_worker_threads = int(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "worker_processes":
+            try:
+                cls.worker_processes = int(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "listing_cache_ttl":
+            try:
+                cls.listing_cache_ttl = float(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "listing_cache_max_entries":
+            try:
+                cls.listing_cache_max_entries = int(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "read_ahead_block_size":
+            try:
+                cls.read_ahead_block_size = int(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "read_ahead_blocks":
+            try:
+                cls.read_ahead_blocks = int(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "read_ahead_max_memory":
+            try:
+                cls.read_ahead_max_memory = int(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "parallel_download_streams":
+            try:
+                cls.parallel_download_streams = int(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "parallel_download_min_size":
+            try:
+                cls.parallel_download_min_size = int(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "upload_buffer_size":
+            try:
+                cls.upload_buffer_size = int(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "upload_queue_chunks":
+            try:
+                cls.upload_queue_chunks = int(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "content_cache_dir":
+            cls.content_cache_dir = value
+        elif name == "content_cache_max_size":
+            try:
+                cls.content_cache_max_size = int(value)
+            except:
+                raise ValueParsingSettingError
         else:
             raise InvalidNameSettingError
@@ -0,0 +1,177 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+from collections import OrderedDict
+from threading import Lock
+import time
+
+class MetadataCache(object):
+    """A thread-safe cache of file metadata, indexed by path.
+    
+    Entries expire after a given time to live, and the least recently used
+    entries are evicted when the number of entries exceeds the given limit.
+    Paths are compared case-insensitively, and without their trailing "/".
+    
+    The hits and misses attributes count the successful and unsuccessful calls to get.
+    
+    A cache can be shared with other processes through a SharedMetadataStore, in which case
+    the values must be serializable to JSON, or be converted by the functions given to share.
+    """
+
+    hits = 0
+    misses = 0
+
+    _ttl = 0
+    _max_entries = 0
+    _entries = None
+    _lock = None
+    _shared_store = None
+    _namespace = None
+    _encode = None
+    _decode = None
+
+    @staticmethod
+    def normalize_path(path):
+        """Return the key under which the given path is stored."""
+        return path.rstrip("/").lower() or "/"
+
+    @property
+    def enabled(self):
+        """Return a boolean value indicating if the cache may hold entries."""
+        return self._ttl > 0 and self._max_entries > 0
+
+    def get(self, path):
+        """Return the value stored for the given path. If there is no such value, or if it expired, return None.
+        
+        If the cache is shared and the value is not stored locally, look for it in the shared store.
+        """
+        key = self.normalize_path(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] >= time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+        if self._shared_store is not None and self.enabled:
+            value = self._shared_store.get(self._namespace, key)
+            if value is not None:
+                if self._decode is not None:
+                    value = self._decode(value)
+                self._set_local(key, value)
+                with self._lock:
+                    self.hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def get_expired(self, path):
+        """Return the value stored for the given path, even if it expired. If there is no such value, return None.
+        
+        Expired values are kept until they are evicted, replaced or invalidated, so that
+        they can be revalidated instead of being fetched again.
+        """
+        key = self.normalize_path(path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            return entry[1]
+
+    def _set_local(self, key, value):
+        """Store the given value under the given key in the current process only."""
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def set(self, path, value):
+        """Store the given value for the given path, evicting the least recently used entries if needed."""
+        if not self.enabled:
+            return
+        key = self.normalize_path(path)
+        self._set_local(key, value)
+        if self._shared_store is not None:
+            if self._encode is not None:
+                value = self._encode(value)
+            self._shared_store.set(self._namespace, key, value, self._ttl)
+
+    def invalidate(self, path):
+        """Remove the entry corresponding to the given path, if any."""
+        key = self.normalize_path(path)
+        with self._lock:
+            self._entries.pop(key, None)
+        if self._shared_store is not None:
+            self._shared_store.invalidate(self._namespace, key)
+
+    def invalidate_tree(self, path):
+        """Remove the entries corresponding to the given path and to all its subpaths."""
+        key = self.normalize_path(path)
+        with self._lock:
+            if key == "/":
+                self._entries.clear()
+            else:
+                prefix = key + "/"
+                for cached_key in [k for k in self._entries if k == key or k.startswith(prefix)]:
+                    del self._entries[cached_key]
+        if self._shared_store is not None:
+            self._shared_store.invalidate_tree(self._namespace, key)
+
+    def clear(self):
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+        if self._shared_store is not None:
+            self._shared_store.invalidate_tree(self._namespace, "/")
+
+    def share(self, shared_store, namespace, encode=None, decode=None):
+        """Also store the entries in the given SharedMetadataStore, under the given namespace,
+        and look for the entries missing locally in it.
+        
+        If given, encode is called with each value to get the object serialized to JSON,
+        and decode is called with each deserialized object to get the value back.
+        """
+        self._shared_store = shared_store
+        self._namespace = namespace
+        self._encode = encode
+        self._decode = decode
+
+    def after_fork(self):
+        """Replace the lock inherited from the parent process. Must be called in a child process
+        created by os.fork, before using the cache.
+        """
+        self._lock = Lock()
+
+    def __len__(self):
+        """Return the number of entries currently stored, including expired ones."""
+        with self._lock:
+            return len(self._entries)
+
+    def __init__(self, ttl, max_entries):
+        """Create a cache whose entries live for ttl seconds, and holding at most max_entries entries.
+        
+        If ttl or max_entries is zero, the cache is disabled.
+        """
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
@@ -0,0 +1,156 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+from threading import Condition, get_ident
+
+class PathLock(object):
+    """A lock over some paths of a PathLockManager, taken in shared mode on some of
+    them and in exclusive mode on the others. It can be used in a with statement.
+    """
+
+    _manager = None
+    _shared_paths = ()
+    _exclusive_paths = ()
+
+    def __init__(self, manager, shared_paths=(), exclusive_paths=()):
+        """Create a lock over the given paths of the given PathLockManager."""
+        self._manager = manager
+        self._shared_paths = tuple(shared_paths)
+        self._exclusive_paths = tuple(exclusive_paths)
+
+    def acquire(self):
+        """Wait until the lock can be taken, then take it."""
+        self._manager._acquire(self._shared_paths, self._exclusive_paths)
+
+    def release(self):
+        """Release the lock."""
+        self._manager._release(self._shared_paths, self._exclusive_paths)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class PathLockManager(object):
+    """Provide shared and exclusive locks keyed by path, for the implementation of FileSystem subclasses.
+    
+    A lock on a path also protects its subpaths. Two locks conflict if their paths are equal and at least
+    one of them is exclusive, or if the path of one is a subpath of the path of the other and the lock on
+    the ancestor is exclusive. Thus, an exclusive lock on "/" conflicts with any other lock, while the
+    modification of a file does not prevent other threads from reading its parent directory.
+    Paths are compared case-insensitively.
+    
+    A thread is never blocked by its own locks: the locks it takes on paths already covered by the
+    locks it holds are granted immediately, so that an operation can call other operations on the
+    paths it has locked. A lock covers its path and its subpaths, in shared mode if it is shared and
+    in both modes if it is exclusive. The other locks wait for the conflicting locks of the other
+    threads to be released, so an operation should take the locks on all the paths it needs at once.
+    """
+
+    _condition = None
+    _held = None
+
+    @staticmethod
+    def _normalize(path):
+        """Return the key corresponding to the given path."""
+        return path.rstrip("/").lower()
+
+    @staticmethod
+    def _is_within(key, other_key):
+        """Return True if the given key is equal to the other key or corresponds to one of its subpaths."""
+        return key == other_key or key.startswith(other_key + "/")
+
+    @classmethod
+    def _conflict(cls, key, exclusive, other_key, other_exclusive):
+        """Return True if a lock on the given key conflicts with a lock on the other key, in the given modes."""
+        if key == other_key:
+            return exclusive or other_exclusive
+        if cls._is_within(key, other_key):
+            return other_exclusive
+        if cls._is_within(other_key, key):
+            return exclusive
+        return False
+
+    def _conflicts(self, thread_id, shared_keys, exclusive_keys):
+        """Return True if a thread other than the given one holds a lock conflicting with the given keys."""
+        for holder, key, exclusive in self._held:
+            if holder == thread_id:
+                continue
+            for keys, other_exclusive in ((shared_keys, False), (exclusive_keys, True)):
+                for other_key in keys:
+                    if self._conflict(key, exclusive, other_key, other_exclusive):
+                        return True
+        return False
+
+    def _covered(self, thread_id, key, exclusive):
+        """Return True if a lock held by the given thread covers the given key in the given mode."""
+        for holder, held_key, held_exclusive in self._held:
+            if holder == thread_id and (held_exclusive or not exclusive):
+                if self._is_within(key, held_key):
+                    return True
+        return False
+
+    def _acquire(self, shared_paths, exclusive_paths):
+        """Wait until the given paths can be locked, then lock them."""
+        thread_id = get_ident()
+        shared_keys = [self._normalize(path) for path in shared_paths]
+        exclusive_keys = [self._normalize(path) for path in exclusive_paths]
+        with self._condition:
+            shared_keys_to_check = [key for key in shared_keys if not self._covered(thread_id, key, False)]
+            exclusive_keys_to_check = [key for key in exclusive_keys if not self._covered(thread_id, key, True)]
+            while self._conflicts(thread_id, shared_keys_to_check, exclusive_keys_to_check):
+                self._condition.wait()
+            for keys, exclusive in ((shared_keys, False), (exclusive_keys, True)):
+                for key in keys:
+                    entry = (thread_id, key, exclusive)
+                    self._held[entry] = self._held.get(entry, 0) + 1
+
+    def _release(self, shared_paths, exclusive_paths):
+        """Unlock the given paths."""
+        thread_id = get_ident()
+        with self._condition:
+            for paths, exclusive in ((shared_paths, False), (exclusive_paths, True)):
+                for path in paths:
+                    entry = (thread_id, self._normalize(path), exclusive)
+                    self._held[entry] -= 1
+                    if self._held[entry] == 0:
+                        del self._held[entry]
+            self._condition.notify_all()
+
+    def shared(self, *paths):
+        """Return a PathLock taking a shared lock on the given paths."""
+        return PathLock(self, paths, ())
+
+    def exclusive(self, *paths):
+        """Return a PathLock taking an exclusive lock on the given paths."""
+        return PathLock(self, (), paths)
+
+    def lock(self, shared_paths=(), exclusive_paths=()):
+        """Return a PathLock taking a shared lock on shared_paths and an exclusive lock on exclusive_paths."""
+        return PathLock(self, shared_paths, exclusive_paths)
+
+    def __init__(self):
+        """PathLockManager initializer"""
+        self._condition = Condition()
+        self._held = {}
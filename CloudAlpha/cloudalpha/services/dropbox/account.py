@@ -27,7 +27,10 @@ from cloudalpha.account import Account
 from cloudalpha.datastore import DataStore
 from cloudalpha.exceptions import AuthenticationFailedAccountError, MissingSettingAccountError
 from cloudalpha.services.dropbox.file_system import DropboxFileSystem
+from cloudalpha.services.dropbox.client_pool import DropboxClientPool
+from cloudalpha.services.dropbox.quota_tracker import QuotaTracker
 from cloudalpha.services.dropbox.settings import DropboxSettings
+from cloudalpha.services.dropbox.stand_in_client import StandInDropboxClient
 
 
 class DropboxAccount(Account):
@@ -57,12 +60,16 @@ class DropboxAccount(Account):
         return access_token
 
     def _validate_token(self, access_token):
-        """Validate the access token. If valid, pass it to the file system.
-        If not, get a new one.
+        """Validate the access token. If valid, pass a pool of clients using it, and a quota tracker
+        initialized by the validation request, to the file system. If not, get a new one.
         """
         try:
-            self.file_system._client = DropboxClient(access_token)
-            self.file_system._client.account_info()
+            if DropboxSettings.api_url:
+                self.file_system._client_pool = DropboxClientPool(StandInDropboxClient, access_token)
+            else:
+                self.file_system._client_pool = DropboxClientPool(DropboxClient, access_token)
+            self.file_system._quota_tracker = QuotaTracker(self.file_system._client_pool)
+            self.file_system._quota_tracker.sync()
         except:
             self._validate_token(self._get_new_token())
 
@@ -84,6 +91,8 @@ class DropboxAccount(Account):
                 if access_token == None:
                     access_token = self._get_new_token()
                 self._validate_token(access_token)
+                if DropboxSettings.delta_sync:
+                    self.file_system._start_namespace_mirror()
                 print("Authentication succeeded")
             except:
                 raise AuthenticationFailedAccountError
@@ -0,0 +1,116 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition
+from time import time
+
+from dropbox.rest import ErrorResponse, RESTClientObject
+
+from cloudalpha.services.dropbox.settings import DropboxSettings
+
+
+class DropboxClientPool(object):
+    """A pool of at most DropboxSettings.client_pool_size clients of the Dropbox API sharing
+    an access token. Each client keeps its own persistent connections, which are reused
+    by the successive operations borrowing it.
+    
+    When a client has been idle for more than DropboxSettings.client_keep_alive seconds, or
+    when a request made with it failed without a response from Dropbox, its connections are
+    closed before it is borrowed again, so that it reconnects instead of using a stale connection.
+    """
+
+    _client_class = None
+    _access_token = None
+    _size = 0
+    _num_clients = 0
+    _idle_clients = None
+    _condition = None
+
+    def _create_client(self):
+        """Return a new client with its own connections."""
+        return self._client_class(self._access_token, rest_client=RESTClientObject(max_reusable_connections=1))
+
+    @staticmethod
+    def _close_connections(client):
+        """Close the persistent connections of the given client."""
+        client.rest_client.pool_manager.clear()
+
+    def _acquire(self):
+        """Return an idle client, or a new one if there is none and the pool is not full.
+        Otherwise, wait for a client to be released.
+        """
+        with self._condition:
+            while not self._idle_clients and self._num_clients >= self._size:
+                self._condition.wait()
+            if self._idle_clients:
+                client, last_used = self._idle_clients.pop()
+                if time() - last_used > DropboxSettings.client_keep_alive:
+                    self._close_connections(client)
+                return client
+            self._num_clients += 1
+        try:
+            return self._create_client()
+        except:
+            with self._condition:
+                self._num_clients -= 1
+                self._condition.notify()
+            raise
+
+    def _release(self, client, healthy=True):
+        """Return the given client to the pool. If it is not healthy, close its connections first."""
+        if not healthy:
+            self._close_connections(client)
+        with self._condition:
+            self._idle_clients.append((client, time()))
+            self._condition.notify()
+
+    @contextmanager
+    def borrow(self):
+        """Borrow a client for the duration of a with statement, waiting for one to be available if needed."""
+        client = self._acquire()
+        healthy = True
+        try:
+            yield client
+        except ErrorResponse:
+            raise
+        except:
+            healthy = False
+            raise
+        finally:
+            self._release(client, healthy)
+
+    def after_fork(self):
+        """Forget the clients inherited from the parent process, whose connections are shared with it.
+        Must be called in a child process created by os.fork, before using the pool.
+        """
+        self._num_clients = 0
+        self._idle_clients = deque()
+        self._condition = Condition()
+
+    def __init__(self, client_class, access_token):
+        """Create a pool of instances of client_class, a subclass of DropboxClient, using the given access token."""
+        self._client_class = client_class
+        self._access_token = access_token
+        self._size = max(DropboxSettings.client_pool_size, 1)
+        self._idle_clients = deque()
+        self._condition = Condition()
@@ -20,38 +20,306 @@
 # =============================================================================
 
 from datetime import datetime
-from threading import RLock
+from threading import Lock
 
 from cloudalpha.exceptions import AccessFailedFileSystemError, \
     AlreadyExistsFileSystemError, InvalidPathFileSystemError, \
     InvalidTargetFileSystemError, ForbiddenOperationFileSystemError, \
     InsufficientSpaceFileSystemError, IDNotFoundFileSystemError
+from cloudalpha.content_listing import ContentListing
 from cloudalpha.file_metadata import FileMetadata
 from cloudalpha.file_system import FileSystem
+from cloudalpha.metadata_cache import MetadataCache
+from cloudalpha.path_lock_manager import PathLockManager
+from cloudalpha.services.dropbox.metadata_index import MetadataIndex
+from cloudalpha.services.dropbox.namespace_mirror import NamespaceMirror
+from cloudalpha.services.dropbox.namespace_mirror_thread import NamespaceMirrorThread
+from cloudalpha.services.dropbox.settings import DropboxSettings
+from cloudalpha.services.dropbox.timestamp_parser import parse_timestamp
 
 
 class DropboxFileSystem(FileSystem):
     """This class allows to manage the files on a Dropbox account."""
 
+    supports_recursive_listing = True
+
+    # The modification time of the root directory when it is empty (2000-01-01 00:00:00 UTC)
+    _ROOT_MODIFIED_TIME = 946684800.0
+
     _lock = None
+    _client_pool = None
+    _quota_tracker = None
+    _path_locks = None
+    _uploads_lock = None
     _working_dir = '/'
-    _upload_offsets = {}
+    _upload_offsets = None
+    _metadata_cache = None
+    _negative_cache = None
+    _content_metadata_cache = None
+    _namespace_mirror = None
+    _namespace_mirror_thread = None
 
     @property
     def lock(self):
-        """Return the Lock object for the current instance."""
+        """Return the Lock object for the current instance.
+        
+        Holding it prevents any other thread from operating on the file system.
+        """
         return self._lock
 
+    def get_path_lock(self, *paths):
+        """Return a Lock object preventing other threads from operating on the given paths,
+        on their subpaths and from modifying their ancestors, for operations that span several calls.
+        
+        The given paths must be absolute POSIX pathnames, with "/" representing the root of the file system.
+        """
+        return self._path_locks.exclusive(*paths)
+
     @property
-    def space_used(self):
-        """Return the number of bytes used on the file system.
+    def negative_cache(self):
+        """Return the MetadataCache remembering the paths recently found not to exist.
+        Its hits and misses attributes allow tuning the negative_cache_ttl and
+        negative_cache_max_entries settings.
+        """
+        return self._negative_cache
+
+    @staticmethod
+    def _get_parent_path(path):
+        """Return the path of the parent directory of the given path."""
+        return path.rstrip("/").rsplit("/", 1)[0] or "/"
+
+    def _split_contents(self, dropbox_meta):
+        """Return a tuple of the given Dropbox metadata dictionary without the "contents" of the directory
+        it may describe, and of a ContentListing representing these contents, or None if it has none.
+        """
+        if "contents" not in dropbox_meta:
+            return dropbox_meta, None
+        dropbox_meta = dict(dropbox_meta)
+        return dropbox_meta, self._make_content_listing(dropbox_meta.pop("contents"))
+
+    def _get_dropbox_meta(self, path, with_contents=False):
+        """Return a tuple of the Dropbox metadata dictionary of the given path, without the "contents"
+        of the directory it may describe, and of a ContentListing representing these contents, or None
+        if they are not known. Use the metadata caches if possible. If the path does not exist, return (None, None).
+        
+        If with_contents is True and the path corresponds to a directory, the ContentListing is never None.
+        
+        If the real file system is inaccessible, raise AccessFailedFileSystemError.
+        """
+        if self._namespace_mirror is not None and self._namespace_mirror.is_current(path):
+            dropbox_meta = self._namespace_mirror.get(path, with_contents)
+            if dropbox_meta is None:
+                return None, None
+            return self._split_contents(dropbox_meta)
+        dropbox_meta = self._metadata_cache.get(path)
+        content_listing = None
+        if dropbox_meta is not None and with_contents and dropbox_meta["is_dir"]:
+            content_listing = self._content_metadata_cache.get(path)
+            if content_listing is None:
+                dropbox_meta = None
+        if dropbox_meta is None:
+            if self._negative_cache.get(path):
+                return None, None
+            expired_meta = self._metadata_cache.get_expired(path)
+            expired_listing = self._content_metadata_cache.get_expired(path)
+            folder_hash = None
+            if expired_meta is not None and expired_listing is not None:
+                folder_hash = expired_meta.get("hash")
+            try:
+                with self._client_pool.borrow() as client:
+                    dropbox_meta, content_listing = self._split_contents(client.metadata(path, hash=folder_hash))
+            except Exception as e:
+                if folder_hash is not None and str(e).startswith("[304]"):
+                    dropbox_meta, content_listing = expired_meta, expired_listing
+                elif str(e).startswith("[404] \"Path \'"):
+                    self._negative_cache.set(path, True)
+                    return None, None
+                else:
+                    raise AccessFailedFileSystemError()
+            self._metadata_cache.set(path, dropbox_meta)
+            if content_listing is not None:
+                self._content_metadata_cache.set(path, content_listing)
+        if dropbox_meta.get("is_deleted"):
+            return None, None
+        return dropbox_meta, content_listing
+
+    def _get_metadata(self, path):
+        """Return a FileMetadata object representing the file or directory corresponding to the given path.
+        If the path does not exist, return None.
+        
+        If the path is not cached on its own, it is looked up in the cached listing of its parent directory.
         
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
+        is_root = not path.rstrip("/")
+        if not is_root and not (self._namespace_mirror is not None and self._namespace_mirror.is_current(path)):
+            content_listing = self._content_metadata_cache.get(self._get_parent_path(path))
+            if content_listing is not None:
+                metadata = content_listing.get(path.rstrip("/").rsplit("/", 1)[1], True)
+                if metadata is None:
+                    return None
+                return FileMetadata(path, metadata.is_dir, metadata.size, metadata.created_time,
+                                    metadata.accessed_time, metadata.modified_time, metadata.revision)
+        dropbox_meta, content_listing = self._get_dropbox_meta(path, is_root)
+        if dropbox_meta is None:
+            return None
+        if is_root:
+            modified = self._ROOT_MODIFIED_TIME
+            for metadata in content_listing:
+                if metadata.modified_time > modified:
+                    modified = metadata.modified_time
+        else:
+            modified = parse_timestamp(dropbox_meta["modified"])
+        return FileMetadata(path, dropbox_meta["is_dir"], dropbox_meta["bytes"], modified, modified, modified, dropbox_meta.get("rev"))
+
+    def _make_content_listing(self, contents):
+        """Return a ContentListing built from the given Dropbox metadata dictionaries of the contents of a directory."""
+        content_listing = ContentListing()
+        for content in contents:
+            modified = parse_timestamp(content["modified"])
+            content_listing.add(content["path"], content["is_dir"], content["bytes"], modified, modified, modified, content.get("rev"))
+        return content_listing
+
+    def _get_delta_tree(self, path):
+        """Return a dictionary mapping the key of the directory corresponding to the given path, and the key
+        of each of its subdirectories, to the list of the Dropbox metadata dictionaries of its contents,
+        as listed by the delta API restricted to the given path.
+        
+        If the real file system is inaccessible, raise AccessFailedFileSystemError.
+        """
+        root_key = MetadataCache.normalize_path(path)
+        path_prefix = None if root_key == "/" else path
+        entries = {}
+        cursor = None
+        has_more = True
         try:
-            return self._client.account_info()["quota_info"]["normal"] + self._client.account_info()["quota_info"]["shared"]
+            while has_more:
+                with self._client_pool.borrow() as client:
+                    delta = client.delta(cursor, path_prefix)
+                for key, dropbox_meta in delta["entries"]:
+                    if dropbox_meta is None:
+                        entries.pop(key, None)
+                    else:
+                        entries[key] = dropbox_meta
+                cursor = delta["cursor"]
+                has_more = delta["has_more"]
         except:
-            raise AccessFailedFileSystemError
+            raise AccessFailedFileSystemError()
+        tree = {root_key: []}
+        for key, dropbox_meta in entries.items():
+            if key == root_key:
+                continue
+            if dropbox_meta["is_dir"]:
+                tree.setdefault(key, [])
+            tree.setdefault(key.rsplit("/", 1)[0] or "/", []).append(dropbox_meta)
+        return tree
+
+    def invalidate_cache(self, path):
+        """Remove the cached metadata of the given path, of its subpaths and of its parent directory,
+        and forget that the given path and its subpaths did not exist.
+        
+        If the in-memory mirror of the account is running, the given path is ignored by the mirror
+        until it is updated by its thread, which is asked to do it without waiting. In a replica
+        of the mirror, the path is ignored until the next call to apply_replica_update.
+        
+        The given path must be an absolute POSIX pathname, with "/" representing the root of the file system.
+        """
+        self._metadata_cache.invalidate_tree(path)
+        self._negative_cache.invalidate_tree(path)
+        self._content_metadata_cache.invalidate_tree(path)
+        self._content_metadata_cache.invalidate(self._get_parent_path(path))
+        self._metadata_cache.invalidate(self._get_parent_path(path))
+        if self._namespace_mirror is not None:
+            self._namespace_mirror.mark_stale(path)
+        if self._namespace_mirror_thread is not None:
+            self._namespace_mirror_thread.request_update()
+
+    def _invalidate(self, path):
+        """Notify the modification listeners of a modification, and remove the cached information about the given path."""
+        # The listeners are notified first, so that the path is already among the stale_paths given
+        # to apply_replica_update when the replica of the mirror marks it as stale
+        self._notify_modified(path)
+        self.invalidate_cache(path)
+
+    def set_shared_metadata_store(self, shared_metadata_store):
+        """Make the metadata caches of the current instance also store their entries in the given
+        SharedMetadataStore, so that they are shared with the instances copied in other processes.
+        """
+        self._metadata_cache.share(shared_metadata_store, self._account.unique_id + ":metadata")
+        self._content_metadata_cache.share(shared_metadata_store, self._account.unique_id + ":listing",
+                                           ContentListing.to_columns, ContentListing.from_columns)
+        self._negative_cache.share(shared_metadata_store, self._account.unique_id + ":negative")
+
+    def after_fork(self):
+        """Discard the resources inherited from the parent process that cannot be shared with it,
+        like locks, network connections and threads. Must be called in a child process created by
+        os.fork, before using the current instance.
+        
+        If the in-memory mirror of the account was running, keep it as a replica, only updated by
+        apply_replica_update, so that the account is only mirrored and indexed by the parent process.
+        """
+        self._path_locks = PathLockManager()
+        self._lock = self._path_locks.exclusive("/")
+        self._uploads_lock = Lock()
+        self._upload_offsets = {}
+        self._metadata_cache.after_fork()
+        self._negative_cache.after_fork()
+        self._content_metadata_cache.after_fork()
+        if self._client_pool is not None:
+            self._client_pool.after_fork()
+        if self._quota_tracker is not None:
+            self._quota_tracker.after_fork()
+        if self._namespace_mirror is not None:
+            self._namespace_mirror.after_fork()
+            self._namespace_mirror_thread = None
+
+    def get_replica_update(self):
+        """Return the changes made to the in-memory mirror of the account since the previous call, as a dictionary
+        that can be serialized to JSON and applied by apply_replica_update to the instances copied in other processes.
+        If the mirror is not running or did not change, return None.
+        
+        The first call after the mirror is started returns its whole content.
+        """
+        if self._namespace_mirror_thread is None:
+            return None
+        return self._namespace_mirror_thread.namespace_mirror.get_replica_update()
+
+    def apply_replica_update(self, update, stale_paths):
+        """Apply to the replica of the in-memory mirror of the account an update returned by get_replica_update
+        in the parent process. If the current instance has no replica yet, create it from the update.
+        
+        stale_paths are the paths modified through the current instance that the parent process may not have
+        been notified of when the update was made.
+        """
+        namespace_mirror = self._namespace_mirror
+        if namespace_mirror is None:
+            namespace_mirror = NamespaceMirror(None)
+        namespace_mirror.apply_replica_update(update, stale_paths)
+        self._namespace_mirror = namespace_mirror
+
+    def _start_namespace_mirror(self):
+        """Start keeping an in-memory mirror of the whole account, updated in a background thread.
+        Until the mirror is bootstrapped, metadata is requested from Dropbox path by path.
+        If DropboxSettings.metadata_index_file is set, the mirror is persisted in that file.
+        If already done, do nothing.
+        """
+        with self._lock:
+            if self._namespace_mirror is None:
+                metadata_index = None
+                if DropboxSettings.metadata_index_file:
+                    metadata_index = MetadataIndex(DropboxSettings.metadata_index_file, self._account.unique_id)
+                namespace_mirror = NamespaceMirror(self._client_pool, metadata_index)
+                self._namespace_mirror_thread = NamespaceMirrorThread(namespace_mirror)
+                self._namespace_mirror = namespace_mirror
+                self._namespace_mirror_thread.start()
+
+    @property
+    def space_used(self):
+        """Return the number of bytes used on the file system.
+        
+        If the real file system is inaccessible, raise AccessFailedFileSystemError.
+        """
+        return self._quota_tracker.space_used
 
     @property
     def free_space(self):
@@ -59,10 +327,7 @@ class DropboxFileSystem(FileSystem):
         
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        try:
-            return self._client.account_info()["quota_info"]["quota"] - self._client.account_info()["quota_info"]["normal"] - self._client.account_info()["quota_info"]["shared"]
-        except:
-            raise AccessFailedFileSystemError
+        return self._quota_tracker.free_space
 
     def exists(self, path):
         """Return True if the given path points to an existing file or directory, excluding uncommitted files.
@@ -71,16 +336,8 @@ class DropboxFileSystem(FileSystem):
         
         If the real file system is inaccessible, raise AccessFailedFileSystemError.        
         """
-        with self._lock:
-            try:
-                dropbox_meta = self._client.metadata(path)
-                return not dropbox_meta.get("is_deleted")
-            except Exception as e:
-                if str(e).startswith("[404] \"Path \'"):
-                    return False
-                else:
-                    raise AccessFailedFileSystemError()
-
+        with self._path_locks.shared(path):
+            return self._get_metadata(path) is not None
 
     def list_dir(self, path):
         """Return the content of the specified directory. If no directory is specified, return the content of the current working directory.
@@ -94,15 +351,13 @@ class DropboxFileSystem(FileSystem):
         If the given path does not correspond to a directory, raise InvalidTargetFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        items = []
-        with self._lock:
-            try:
-                dropbox_meta = self._client.metadata(path)
-                for contents in dropbox_meta["contents"]:
-                    items.append(contents['path'].rsplit("/", 1)[1])
-                return items
-            except:
-                raise AccessFailedFileSystemError()
+        with self._path_locks.shared(path):
+            dropbox_meta, content_listing = self._get_dropbox_meta(path, True)
+            if dropbox_meta is None:
+                raise InvalidPathFileSystemError()
+            if not dropbox_meta["is_dir"]:
+                raise InvalidTargetFileSystemError()
+            return list(content_listing.names)
 
     def is_dir(self, path):
         """Return a boolean value indicating if the given path corresponds to a directory.
@@ -112,15 +367,11 @@ class DropboxFileSystem(FileSystem):
         If the given path is invalid, raise InvalidPathFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
-            if self.exists(path):
-                try:
-                    dropbox_meta = self._client.metadata(path)
-                    return dropbox_meta["is_dir"]
-                except:
-                    raise AccessFailedFileSystemError()
-            else:
+        with self._path_locks.shared(path):
+            metadata = self._get_metadata(path)
+            if metadata is None:
                 raise InvalidPathFileSystemError()
+            return metadata.is_dir
 
     def is_file(self, path):
         """Return a boolean value indicating if the given path corresponds to a file.
@@ -130,15 +381,11 @@ class DropboxFileSystem(FileSystem):
         If the given path is invalid, raise InvalidPathFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
-            if self.exists(path):
-                try:
-                    dropbox_meta = self._client.metadata(path)
-                    return not dropbox_meta["is_dir"]
-                except:
-                    raise AccessFailedFileSystemError()
-            else:
+        with self._path_locks.shared(path):
+            metadata = self._get_metadata(path)
+            if metadata is None:
                 raise InvalidPathFileSystemError()
+            return not metadata.is_dir
 
     def get_size(self, path):
         """Return the size, in bytes, of the file corresponding to the given path.
@@ -149,15 +396,11 @@ class DropboxFileSystem(FileSystem):
         If the given path is invalid, raise InvalidPathFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError. 
         """
-        with self._lock:
-            if self.exists(path):
-                try:
-                    dropbox_meta = self._client.metadata(path)
-                    return dropbox_meta["bytes"]
-                except:
-                    raise AccessFailedFileSystemError()
-            else:
+        with self._path_locks.shared(path):
+            metadata = self._get_metadata(path)
+            if metadata is None:
                 raise InvalidPathFileSystemError()
+            return metadata.size
 
     def get_metadata(self, path):
         """Return a FileMetadata object representing the file or directory corresponding to the given path.
@@ -167,25 +410,43 @@ class DropboxFileSystem(FileSystem):
         If the given path is invalid, raise InvalidPathFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError. 
         """
-        with self._lock:
-            try:
-                dropbox_meta = self._client.metadata(path)
-            except Exception as e:
-                if str(e).startswith("[404] \"Path \'"):
-                    raise InvalidPathFileSystemError
-                else:
-                    raise AccessFailedFileSystemError
-            if dropbox_meta.get("is_deleted"):
+        with self._path_locks.shared(path):
+            metadata = self._get_metadata(path)
+            if metadata is None:
                 raise InvalidPathFileSystemError
-            if path == "/":
-                modified = datetime(2000, 1, 1)
-                for content in dropbox_meta["contents"]:
-                    content_modified = datetime.strptime(content["modified"], '%a, %d %b %Y %H:%M:%S +0000')
-                    if  content_modified > modified:
-                        modified = content_modified
-            else:
-                modified = datetime.strptime(dropbox_meta["modified"], '%a, %d %b %Y %H:%M:%S +0000')
-            return FileMetadata(path, dropbox_meta["is_dir"], dropbox_meta["bytes"], modified, modified, modified)
+            return metadata
+
+    def _prefetch_parents(self, paths):
+        """Request at once the listings of the directories containing several of the given paths,
+        so that the metadata of these paths, or their absence, is then found in the cached listings.
+        """
+        if not self._content_metadata_cache.enabled or (self._namespace_mirror is not None and self._namespace_mirror.ready):
+            return
+        children = {}
+        for path in paths:
+            if path.rstrip("/"):
+                children.setdefault(self._get_parent_path(path).lower(), []).append(path)
+        parent_paths = [self._get_parent_path(child_paths[0]) for child_paths in children.values() if len(child_paths) > 1]
+
+        def get_listing(parent_path):
+            with self._path_locks.shared(parent_path):
+                self._get_dropbox_meta(parent_path, True)
+
+        self._map_concurrently(get_listing, parent_paths)
+
+    def get_metadata_many(self, paths):
+        """Return a list of FileMetadata objects representing the files or directories corresponding
+        to the given iterable of paths, in the same order. For each invalid path, the list contains None.
+        
+        The given paths must be absolute POSIX pathnames, with "/" representing the root of the file system.
+        
+        The paths sharing a parent directory are looked up with a single listing of that directory.
+        
+        If the real file system is inaccessible, raise AccessFailedFileSystemError.
+        """
+        paths = list(paths)
+        self._prefetch_parents(paths)
+        return super(DropboxFileSystem, self).get_metadata_many(paths)
 
     def get_content_metadata(self, path):
         """Return an iterable of FileMetadata objects representing the contents of the directory corresponding to the given path.
@@ -196,22 +457,47 @@ class DropboxFileSystem(FileSystem):
         If the given path does not point to a directory, raise InvalidTargetFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.         
         """
-        with self._lock:
-            try:
-                dropbox_meta = self._client.metadata(path)
-                if not dropbox_meta["is_dir"]:
-                    raise InvalidTargetFileSystemError
-                content_metadata = []
-                for content in dropbox_meta["contents"]:
-                    modified = datetime.strptime(content["modified"], '%a, %d %b %Y %H:%M:%S +0000')
-                    content_metadata.append(FileMetadata(content["path"], content["is_dir"], content["bytes"], modified, modified, modified))
-                return content_metadata
-            except Exception as e:
-                raise e
-                if str(e).startswith("[404] \"Path \'"):
-                    raise InvalidPathFileSystemError
-                else:
-                    raise AccessFailedFileSystemError
+        with self._path_locks.shared(path):
+            dropbox_meta, content_listing = self._get_dropbox_meta(path, True)
+            if dropbox_meta is None:
+                raise InvalidPathFileSystemError
+            if not dropbox_meta["is_dir"]:
+                raise InvalidTargetFileSystemError
+            return content_listing
+
+    def get_tree_metadata(self, path):
+        """Return a dictionary mapping the path of the directory corresponding to the given path, and the path
+        of each of its subdirectories, to a ContentListing representing its contents.
+        
+        The whole tree is listed by the delta API, or taken from the in-memory mirror of the account if ready.
+        
+        The given path must be an absolute POSIX pathname, with "/" representing the root of the file system.
+        
+        If the given path is invalid, raise InvalidPathFileSystemError.
+        If the given path does not point to a directory, raise InvalidTargetFileSystemError.
+        If the real file system is inaccessible, raise AccessFailedFileSystemError.
+        """
+        with self._path_locks.shared(path):
+            metadata = self._get_metadata(path)
+            if metadata is None:
+                raise InvalidPathFileSystemError
+            if not metadata.is_dir:
+                raise InvalidTargetFileSystemError
+            tree = None
+            if self._namespace_mirror is not None and self._namespace_mirror.is_current(path, True):
+                tree = self._namespace_mirror.get_tree(path)
+            if tree is None:
+                tree = self._get_delta_tree(path)
+        dir_paths = {MetadataCache.normalize_path(path): path}
+        for contents in tree.values():
+            for content in contents:
+                if content["is_dir"]:
+                    dir_paths[MetadataCache.normalize_path(content["path"])] = content["path"]
+        tree_metadata = {}
+        for key, contents in tree.items():
+            if key in dir_paths:
+                tree_metadata[dir_paths[key]] = self._make_content_listing(contents)
+        return tree_metadata
 
     def get_created_datetime(self, path):
         """Return the date and time of creation of the file or directory corresponding to the given path.
@@ -231,24 +517,16 @@ class DropboxFileSystem(FileSystem):
         
         The given path must be an absolute POSIX pathname, with "/" representing the root of the file system.
         
-        The return value is a datetime object.
+        The return value is a naive datetime object expressing the time in UTC, as given by Dropbox.
         
         If the given path is invalid, raise InvalidPathFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
-            try:
-                dropbox_meta = self._client.metadata(path)
-                if path == "/":
-                    modified = datetime(2000, 1, 1)
-                    for content in dropbox_meta["contents"]:
-                        content_modified = datetime.strptime(content["modified"], '%a, %d %b %Y %H:%M:%S +0000')
-                        if  content_modified > modified:
-                            modified = content_modified
-                    return modified
-                return datetime.strptime(dropbox_meta["modified"], '%a, %d %b %Y %H:%M:%S +0000')
-            except:
-                raise AccessFailedFileSystemError()
+        with self._path_locks.shared(path):
+            metadata = self._get_metadata(path)
+            if metadata is None:
+                raise InvalidPathFileSystemError()
+            return datetime.utcfromtimestamp(metadata.modified_time)
 
     def get_accessed_datetime(self, path):
         """Return the date and time of the last time the given file or directory was accessed.
@@ -272,16 +550,19 @@ class DropboxFileSystem(FileSystem):
         If the given path corresponds to an existing file or directory, raise AlreadyExistsFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
+        parentPath = path.rsplit("/", 1)[0]
+        with self._path_locks.lock((parentPath,), (path,)):
             if self.exists(path):
                 raise AlreadyExistsFileSystemError()
-            parentPath = path.rsplit("/", 1)[0]
             if not self.exists(parentPath):
                 raise InvalidPathFileSystemError()
             try:
-                self._client.file_create_folder(path)
+                with self._client_pool.borrow() as client:
+                    client.file_create_folder(path)
             except:
                 raise AccessFailedFileSystemError()
+            finally:
+                self._invalidate(path)
 
     def move(self, old_path, new_path):
         """Move and/or rename a file or directory from old_path to new_path.
@@ -295,7 +576,7 @@ class DropboxFileSystem(FileSystem):
         If new_path is a subpath of old_path , raise ForbiddenOperationFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
+        with self._path_locks.exclusive(old_path, new_path):
             if not self.exists(old_path):
                 raise InvalidPathFileSystemError()
             if self.exists(new_path):
@@ -303,9 +584,13 @@ class DropboxFileSystem(FileSystem):
             if new_path.rsplit("/", 1)[0].startswith(old_path):
                 raise ForbiddenOperationFileSystemError()
             try:
-                self._client.file_move(old_path, new_path)
+                with self._client_pool.borrow() as client:
+                    client.file_move(old_path, new_path)
             except:
                 raise AccessFailedFileSystemError()
+            finally:
+                self._invalidate(old_path)
+                self._invalidate(new_path)
 
     def copy(self, path, copy_path):
         """Copy a file or directory from path to copy_path.
@@ -318,17 +603,26 @@ class DropboxFileSystem(FileSystem):
         If new_path is a subpath of old_path , raise ForbiddenOperationFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError. 
         """
-        with self._lock:
+        with self._path_locks.lock((path,), (copy_path,)):
             if not self.exists(path):
                 raise InvalidPathFileSystemError()
             if self.exists(copy_path):
                 raise AlreadyExistsFileSystemError()
             if path in copy_path.rsplit("/", 1)[0]:
                 raise ForbiddenOperationFileSystemError()
+            metadata = self._get_metadata(path)
             try:
-                self._client.file_copy(path, copy_path)
+                with self._client_pool.borrow() as client:
+                    client.file_copy(path, copy_path)
             except:
+                self._quota_tracker.invalidate()
                 raise AccessFailedFileSystemError()
+            finally:
+                self._invalidate(copy_path)
+            if metadata is not None and not metadata.is_dir:
+                self._quota_tracker.adjust(metadata.size)
+            else:
+                self._quota_tracker.invalidate()
 
     def delete(self, path):
         """Delete the file or directory corresponding to the given path.
@@ -341,17 +635,24 @@ class DropboxFileSystem(FileSystem):
         If the given path is invalid, raise InvalidPathFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
-            if not self.exists(path):
+        with self._path_locks.exclusive(path):
+            metadata = self._get_metadata(path)
+            if metadata is None:
                 raise InvalidPathFileSystemError()
             try:
-                if self.is_dir(path):
-                    dropbox_meta = self._client.metadata(path)
-                    for contents in dropbox_meta["contents"]:
-                        self.delete(contents.get("path"))
-                self._client.file_delete(path)
+                # Dropbox deletes the contents of a directory along with it
+                with self._client_pool.borrow() as client:
+                    client.file_delete(path)
             except:
+                self._quota_tracker.invalidate()
                 raise AccessFailedFileSystemError()
+            finally:
+                self._invalidate(path)
+            if metadata.is_dir:
+                # The size of the contents is unknown
+                self._quota_tracker.invalidate()
+            else:
+                self._quota_tracker.adjust(-metadata.size)
 
     def read(self, path, start_byte, num_bytes=None):
         """Read the number of bytes corresponding to num_bytes from the file corresponding to the given path,
@@ -369,23 +670,26 @@ class DropboxFileSystem(FileSystem):
         If the given path corresponds to a directory, raise InvalidTargetFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
-            if not self.exists(path):
+        with self._path_locks.shared(path):
+            metadata = self._get_metadata(path)
+            if metadata is None:
                 raise InvalidPathFileSystemError()
-            if self.is_dir(path):
+            if metadata.is_dir:
                 raise InvalidTargetFileSystemError()
-            file_size = self.get_size(path)
+            file_size = metadata.size
             if start_byte >= file_size:
                 return ()
             if num_bytes == None:
                 num_bytes = file_size - start_byte
-            try:
-                file = self._client.get_file(path, None, start_byte, num_bytes)
+        # The download is performed outside the lock, so that several ranges can be read concurrently
+        try:
+            with self._client_pool.borrow() as client:
+                file = client.get_file(path, None, start_byte, num_bytes)
                 data = file.read()
                 file.close()
-                return data
-            except:
-                raise AccessFailedFileSystemError()
+            return data
+        except:
+            raise AccessFailedFileSystemError()
 
     def create_new_file(self):
         """Create an empty file that will be populated by successive calls to write_to_new_file. Return a unique
@@ -393,13 +697,14 @@ class DropboxFileSystem(FileSystem):
         
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
-            try:
-                new_file_id = self._client.upload_chunk(bytearray(), 0, 0)[-1]
-                self._upload_offsets[new_file_id] = 0
-            except:
-                raise AccessFailedFileSystemError
-            return new_file_id
+        try:
+            with self._client_pool.borrow() as client:
+                new_file_id = client.upload_chunk(bytearray(), 0, 0)[-1]
+        except:
+            raise AccessFailedFileSystemError
+        with self._uploads_lock:
+            self._upload_offsets[new_file_id] = 0
+        return new_file_id
 
     def write_to_new_file(self, new_file_id, data):
         """Append the given data to the uncommitted file corresponding to new_file_id.
@@ -410,23 +715,25 @@ class DropboxFileSystem(FileSystem):
         If there is not enough free space to store the new data, raise InsufficientSpaceFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
+        with self._uploads_lock:
             if new_file_id in self._upload_offsets:
                 uploaded_bytes = self._upload_offsets[new_file_id]
             else:
                 raise IDNotFoundFileSystemError
         try:
-            self._client.upload_chunk(data, offset=uploaded_bytes, upload_id=new_file_id)
-            with self._lock:
+            with self._client_pool.borrow() as client:
+                client.upload_chunk(data, offset=uploaded_bytes, upload_id=new_file_id)
+            with self._uploads_lock:
                 self._upload_offsets[new_file_id] += len(data)
         except:
-            with self._lock:
-                try:
-                    if len(data) > self.free_space:
-                        raise InsufficientSpaceFileSystemError
-                except:
-                    raise AccessFailedFileSystemError
-                raise AccessFailedFileSystemError
+            # The free space is known without asking Dropbox unless it is out of date
+            try:
+                insufficient_space = len(data) > self._quota_tracker.free_space
+            except AccessFailedFileSystemError:
+                insufficient_space = False
+            if insufficient_space:
+                raise InsufficientSpaceFileSystemError
+            raise AccessFailedFileSystemError
 
     def commit_new_file(self, new_file_id, path):
         """Commit the file corresponding to new_file_id and store it at the location represented by path.
@@ -440,24 +747,38 @@ class DropboxFileSystem(FileSystem):
         If the given path corresponds to an existing directory, raise InvalidTargetFileSystemError.  
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
-            if new_file_id not in self._upload_offsets:
-                raise IDNotFoundFileSystemError
-            parent_path = path.rsplit("/", 1)[0] + "/"
-            parent_metadata = self.get_metadata(parent_path)
-            if not parent_metadata.is_dir:
-                raise InvalidTargetFileSystemError
+        parent_path = path.rsplit("/", 1)[0] + "/"
+        with self._path_locks.lock((parent_path,), (path,)):
+            with self._uploads_lock:
+                if new_file_id not in self._upload_offsets:
+                    raise IDNotFoundFileSystemError
+                # Removed while committing, so that the file cannot be written, committed or flushed concurrently
+                new_file_size = self._upload_offsets.pop(new_file_id)
             try:
-                path_metadata = self.get_metadata(path)
-                if path_metadata.is_dir:
+                parent_metadata = self.get_metadata(parent_path)
+                if not parent_metadata.is_dir:
                     raise InvalidTargetFileSystemError
-            except InvalidPathFileSystemError:
-                pass
-            try:
-                self._client.commit_chunked_upload("/auto/" + path.strip("/"), new_file_id, overwrite=True)
-                del self._upload_offsets[new_file_id]
+                replaced_size = 0
+                try:
+                    path_metadata = self.get_metadata(path)
+                    if path_metadata.is_dir:
+                        raise InvalidTargetFileSystemError
+                    replaced_size = path_metadata.size
+                except InvalidPathFileSystemError:
+                    pass
+                try:
+                    with self._client_pool.borrow() as client:
+                        client.commit_chunked_upload("/auto/" + path.strip("/"), new_file_id, overwrite=True)
+                except:
+                    self._quota_tracker.invalidate()
+                    raise AccessFailedFileSystemError
+                finally:
+                    self._invalidate(path)
             except:
-                raise AccessFailedFileSystemError
+                with self._uploads_lock:
+                    self._upload_offsets[new_file_id] = new_file_size
+                raise
+            self._quota_tracker.adjust(new_file_size - replaced_size)
 
     def flush_new_file(self, new_file_id):
         """Delete an uncommitted file.
@@ -465,11 +786,17 @@ class DropboxFileSystem(FileSystem):
         If there is no uncommited file corresponding to new_file_id, raise IDNotFoundFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.                
         """
-        with self._lock:
+        with self._uploads_lock:
             if new_file_id not in self._upload_offsets:
                 raise InvalidTargetFileSystemError()
-            del self._new_files[new_file_id]
+            del self._upload_offsets[new_file_id]
 
     def __init__(self, account):
-        self._lock = RLock()
+        self._path_locks = PathLockManager()
+        self._lock = self._path_locks.exclusive("/")
+        self._uploads_lock = Lock()
+        self._upload_offsets = {}
+        self._metadata_cache = MetadataCache(DropboxSettings.metadata_cache_ttl, DropboxSettings.metadata_cache_max_entries)
+        self._content_metadata_cache = MetadataCache(DropboxSettings.metadata_cache_ttl, DropboxSettings.metadata_cache_max_entries)
+        self._negative_cache = MetadataCache(DropboxSettings.negative_cache_ttl, DropboxSettings.negative_cache_max_entries)
         super(DropboxFileSystem, self).__init__(account)
@@ -0,0 +1,91 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+import sqlite3
+from threading import Lock
+
+
+class MetadataIndex(object):
+    """A SQLite-backed copy of the content of a NamespaceMirror, allowing the
+    mirror to be restored after a restart and then updated from its last delta cursor.
+    
+    A single database file may hold the indexes of several accounts.
+    """
+
+    _ENTRIES_TABLE_NAME = "metadata_index"
+    _CURSORS_TABLE_NAME = "metadata_index_cursor"
+
+    _unique_id = None
+    _db_conn = None
+    _lock = None
+
+    def load(self):
+        """Return a tuple containing the saved delta cursor, or None if there is none,
+        and a list of (key, dropbox_meta) tuples for all the indexed files and directories,
+        sorted so that each directory comes before its content.
+        """
+        with self._lock:
+            cur = self._db_conn.execute("SELECT cursor FROM " + self._CURSORS_TABLE_NAME + " WHERE owner_unique_id = ?",
+                                        (self._unique_id,))
+            row = cur.fetchone()
+            if row is None:
+                return None, []
+            cur = self._db_conn.execute("SELECT path_lower, path, is_dir, size, modified, rev FROM " + self._ENTRIES_TABLE_NAME
+                                        + " WHERE owner_unique_id = ? ORDER BY length(path_lower)", (self._unique_id,))
+            entries = []
+            for key, path, is_dir, size, modified, rev in cur:
+                entries.append((key, {"path": path, "is_dir": bool(is_dir), "bytes": size, "modified": modified, "rev": rev}))
+            return row[0], entries
+
+    def save(self, changes, cursor, reset=False):
+        """Apply the given changes and store the given delta cursor, in a single transaction.
+        
+        changes is an iterable of (key, dropbox_meta) tuples, where dropbox_meta is None
+        for removed files and directories. If reset is True, all the indexed entries are
+        removed before the changes are applied.
+        """
+        with self._lock:
+            with self._db_conn:
+                if reset:
+                    self._db_conn.execute("DELETE FROM " + self._ENTRIES_TABLE_NAME + " WHERE owner_unique_id = ?", (self._unique_id,))
+                for key, dropbox_meta in changes:
+                    if dropbox_meta is None:
+                        self._db_conn.execute("DELETE FROM " + self._ENTRIES_TABLE_NAME + " WHERE owner_unique_id = ? AND path_lower = ?",
+                                              (self._unique_id, key))
+                    else:
+                        self._db_conn.execute("INSERT OR REPLACE INTO " + self._ENTRIES_TABLE_NAME
+                                              + "(owner_unique_id, path_lower, parent, path, is_dir, size, modified, rev) VALUES(?, ?, ?, ?, ?, ?, ?, ?)",
+                                              (self._unique_id, key, key.rsplit("/", 1)[0] or "/", dropbox_meta["path"], int(dropbox_meta["is_dir"]),
+                                               dropbox_meta.get("bytes", 0), dropbox_meta.get("modified"), dropbox_meta.get("rev")))
+                self._db_conn.execute("INSERT OR REPLACE INTO " + self._CURSORS_TABLE_NAME + "(owner_unique_id, cursor) VALUES(?, ?)",
+                                      (self._unique_id, cursor))
+
+    def __init__(self, db_file, unique_id):
+        """Open or create the index of the account corresponding to unique_id, in the given SQLite database file."""
+        self._unique_id = unique_id
+        self._lock = Lock()
+        self._db_conn = sqlite3.connect(db_file, check_same_thread=False)
+        with self._db_conn:
+            self._db_conn.execute("CREATE TABLE IF NOT EXISTS " + self._ENTRIES_TABLE_NAME
+                                  + "(owner_unique_id TEXT NOT NULL, path_lower TEXT NOT NULL, parent TEXT NOT NULL, path TEXT NOT NULL,"
+                                  + " is_dir INTEGER NOT NULL, size INTEGER NOT NULL, modified TEXT, rev TEXT, PRIMARY KEY (owner_unique_id, path_lower))")
+            self._db_conn.execute("CREATE TABLE IF NOT EXISTS " + self._CURSORS_TABLE_NAME
+                                  + "(owner_unique_id TEXT PRIMARY KEY, cursor TEXT NOT NULL)")
@@ -0,0 +1,289 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+from threading import Lock
+
+from cloudalpha.metadata_cache import MetadataCache
+
+
+class NamespaceMirror(object):
+    """An in-memory copy of the metadata of all the files and directories of a Dropbox account.
+    
+    The mirror is bootstrapped and kept up to date by successive calls to update,
+    which only pull the changes made since the previous call through the delta API.
+    
+    If a MetadataIndex is given, the mirror is restored from it on the first update,
+    and every change is saved to it along with the delta cursor.
+    
+    The paths modified through the file system are marked as stale until the next update,
+    so that their metadata is requested from Dropbox in the meantime.
+    
+    A mirror copied in a child process by os.fork is turned into a replica by after_fork, and is
+    then only updated from the changes returned by get_replica_update on the original mirror.
+    """
+
+    _client_pool = None
+    _metadata_index = None
+    _changes = None
+    _replica_changes = None
+    _replica_reset = False
+    _replica_state = None
+    _cursor = None
+    _entries = None
+    _children = None
+    _stale_keys = None
+    _generation = 0
+    _lock = None
+    _update_lock = None
+
+    ready = False
+
+    def _reset(self):
+        """Empty the mirror, keeping only the root directory."""
+        self._entries = {"/": {"path": "/", "is_dir": True, "bytes": 0}}
+        self._children = {"/": set()}
+        if self._replica_changes is not None:
+            self._replica_changes = {}
+            self._replica_reset = True
+
+    def _record_change(self, key, dropbox_meta):
+        """Remember that the given entry changed, so that the change can be saved to the metadata index
+        and sent to the replicas.
+        """
+        if self._changes is not None:
+            self._changes[key] = dropbox_meta
+        if self._replica_changes is not None:
+            self._replica_changes[key] = dropbox_meta
+
+    def _remove(self, key):
+        """Remove the given entry and all its descendants."""
+        if key not in self._entries:
+            return
+        for child_key in list(self._children.get(key, ())):
+            self._remove(child_key)
+        self._children.pop(key, None)
+        del self._entries[key]
+        self._record_change(key, None)
+        parent_children = self._children.get(key.rsplit("/", 1)[0] or "/")
+        if parent_children is not None:
+            parent_children.discard(key)
+
+    def _add(self, key, dropbox_meta):
+        """Add the given entry, creating its missing parent directories."""
+        parent_key = key.rsplit("/", 1)[0] or "/"
+        if parent_key not in self._entries or not self._entries[parent_key]["is_dir"]:
+            self._remove(parent_key)
+            self._add(parent_key, {"path": parent_key, "is_dir": True, "bytes": 0, "modified": dropbox_meta.get("modified")})
+        self._entries[key] = dropbox_meta
+        self._record_change(key, dropbox_meta)
+        self._children[parent_key].add(key)
+        if dropbox_meta["is_dir"]:
+            self._children.setdefault(key, set())
+
+    def _apply_entry(self, key, dropbox_meta):
+        """Apply a delta entry to the mirror."""
+        existing_meta = self._entries.get(key)
+        if dropbox_meta is None:
+            self._remove(key)
+        elif existing_meta is not None and existing_meta["is_dir"] and dropbox_meta["is_dir"]:
+            self._entries[key] = dropbox_meta
+            self._record_change(key, dropbox_meta)
+        else:
+            self._remove(key)
+            self._add(key, dropbox_meta)
+
+    def update(self):
+        """Pull and apply all the changes made to the account since the last update.
+        
+        On failure, the mirror is marked as not ready until the next successful update,
+        and the exception raised by the client is propagated.
+        """
+        with self._update_lock:
+            with self._lock:
+                generation = self._generation
+            try:
+                if self._cursor is None and self._metadata_index is not None:
+                    self._load_index()
+                has_more = True
+                while has_more:
+                    with self._client_pool.borrow() as client:
+                        delta = client.delta(self._cursor)
+                    with self._lock:
+                        if self._metadata_index is not None:
+                            self._changes = {}
+                        if delta["reset"]:
+                            self._reset()
+                        for key, dropbox_meta in delta["entries"]:
+                            self._apply_entry(MetadataCache.normalize_path(key), dropbox_meta)
+                        changes = self._changes
+                        self._changes = None
+                    if self._metadata_index is not None:
+                        self._metadata_index.save(changes.items(), delta["cursor"], delta["reset"])
+                    self._cursor = delta["cursor"]
+                    has_more = delta["has_more"]
+            except:
+                self.ready = False
+                raise
+            with self._lock:
+                self._stale_keys = dict((key, key_generation) for key, key_generation
+                                        in self._stale_keys.items() if key_generation > generation)
+            self.ready = True
+
+    def mark_stale(self, path):
+        """Remember that the given path was modified, so that the mirror is not considered current
+        for it, for its subpaths and for the listing of its parent directory until the next update.
+        """
+        key = MetadataCache.normalize_path(path)
+        with self._lock:
+            self._generation += 1
+            self._stale_keys[key] = self._generation
+
+    def is_current(self, path, recursive=False):
+        """Return a boolean value indicating if the mirror is ready and reflects the last modifications
+        made to the given path, to its ancestors and to the contents of the directory it points to.
+        
+        If recursive is True, the modifications made to all its subpaths are also considered.
+        """
+        if not self.ready:
+            return False
+        key = MetadataCache.normalize_path(path)
+        with self._lock:
+            for stale_key in self._stale_keys:
+                if key == stale_key or key.startswith(stale_key.rstrip("/") + "/"):
+                    return False
+                if key == (stale_key.rsplit("/", 1)[0] or "/"):
+                    return False
+                if recursive and stale_key.startswith(key.rstrip("/") + "/"):
+                    return False
+        return True
+
+    def get_replica_update(self):
+        """Return a dictionary describing the changes made to the mirror since the previous call, which can be
+        serialized to JSON and applied to the replicas by apply_replica_update. If nothing changed, return None.
+        
+        The first call returns the whole content of the mirror.
+        """
+        with self._lock:
+            if self._replica_changes is None:
+                self._replica_changes = dict((key, dropbox_meta) for key, dropbox_meta
+                                             in self._entries.items() if key != "/")
+                self._replica_reset = True
+            state = (self.ready, sorted(self._stale_keys))
+            if not self._replica_changes and not self._replica_reset and state == self._replica_state:
+                return None
+            # Parents first, so that their children are not attached to placeholder directories
+            entries = sorted(self._replica_changes.items(), key=lambda entry: len(entry[0]))
+            update = {"reset": self._replica_reset, "entries": entries, "ready": state[0], "stale_keys": state[1]}
+            self._replica_changes = {}
+            self._replica_reset = False
+            self._replica_state = state
+            return update
+
+    def apply_replica_update(self, update, stale_paths):
+        """Apply to a replica an update returned by get_replica_update on the original mirror.
+        
+        stale_paths are the paths modified through the replica that the original mirror may not have
+        been notified of when the update was made. They remain marked as stale, with the paths the original
+        mirror considered stale.
+        """
+        with self._lock:
+            if update["reset"]:
+                self._reset()
+            for key, dropbox_meta in update["entries"]:
+                self._apply_entry(key, dropbox_meta)
+            self._stale_keys = dict((key, 0) for key in update["stale_keys"])
+            for path in stale_paths:
+                self._stale_keys[MetadataCache.normalize_path(path)] = 0
+            self.ready = update["ready"]
+
+    def after_fork(self):
+        """Turn the current instance, copied in a child process created by os.fork, into a replica of the original
+        mirror, which is left in charge of the Dropbox account and of the metadata index.
+        """
+        self._client_pool = None
+        self._metadata_index = None
+        self._changes = None
+        self._replica_changes = None
+        self._replica_reset = False
+        self._replica_state = None
+        self._lock = Lock()
+        self._update_lock = Lock()
+
+    def _load_index(self):
+        """Restore the content and the delta cursor of the mirror from the metadata index."""
+        cursor, entries = self._metadata_index.load()
+        with self._lock:
+            self._reset()
+            for key, dropbox_meta in entries:
+                self._apply_entry(key, dropbox_meta)
+        self._cursor = cursor
+
+    def get(self, path, with_contents=False):
+        """Return the Dropbox metadata dictionary of the given path. If the path does not exist, return None.
+        
+        If with_contents is True and the path corresponds to a directory, the returned
+        dictionary includes the "contents" of the directory.
+        """
+        key = MetadataCache.normalize_path(path)
+        with self._lock:
+            dropbox_meta = self._entries.get(key)
+            if dropbox_meta is None or not (with_contents and dropbox_meta["is_dir"]):
+                return dropbox_meta
+            dropbox_meta = dict(dropbox_meta)
+            dropbox_meta["contents"] = [self._entries[child_key] for child_key in self._children[key]]
+            return dropbox_meta
+
+    def get_tree(self, path):
+        """Return a dictionary mapping the key of the directory corresponding to the given path, and the key
+        of each of its subdirectories, to the list of the Dropbox metadata dictionaries of its contents.
+        If the path does not correspond to a directory, return None.
+        """
+        key = MetadataCache.normalize_path(path)
+        with self._lock:
+            dropbox_meta = self._entries.get(key)
+            if dropbox_meta is None or not dropbox_meta["is_dir"]:
+                return None
+            tree = {}
+            dir_keys = [key]
+            while dir_keys:
+                dir_key = dir_keys.pop()
+                child_keys = self._children[dir_key]
+                tree[dir_key] = [self._entries[child_key] for child_key in child_keys]
+                dir_keys.extend(child_key for child_key in child_keys if self._entries[child_key]["is_dir"])
+            return tree
+
+    def __len__(self):
+        """Return the number of files and directories in the mirror, including the root directory."""
+        with self._lock:
+            return len(self._entries)
+
+    def __init__(self, client_pool, metadata_index=None):
+        """Create an empty mirror that will be populated through a client of the given DropboxClientPool,
+        and optionally restored from and saved to the given MetadataIndex.
+        
+        If client_pool is None, the mirror is a replica, only updated by apply_replica_update.
+        """
+        self._client_pool = client_pool
+        self._metadata_index = metadata_index
+        self._stale_keys = {}
+        self._lock = Lock()
+        self._update_lock = Lock()
+        self._reset()
@@ -0,0 +1,63 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+import logging
+from threading import Thread, Event
+
+from cloudalpha.services.dropbox.settings import DropboxSettings
+
+
+class NamespaceMirrorThread(Thread):
+    """A thread that periodically updates a NamespaceMirror instance,
+    or earlier when an update is requested.
+    """
+
+    namespace_mirror = None
+    _stopped = None
+    _update_requested = None
+
+    def __init__(self, namespace_mirror):
+        """NamespaceMirrorThread initializer"""
+        self.namespace_mirror = namespace_mirror
+        self._stopped = Event()
+        self._update_requested = Event()
+        super(NamespaceMirrorThread, self).__init__(daemon=True)
+
+    def run(self):
+        """Bootstrap the mirror, then update it every DropboxSettings.delta_sync_interval seconds,
+        or as soon as requested, until stopped. Failed updates are logged and retried later.
+        """
+        while not self._stopped.is_set():
+            self._update_requested.clear()
+            try:
+                self.namespace_mirror.update()
+            except Exception:
+                logging.getLogger(__name__).exception("Failed to update the Dropbox namespace mirror")
+            self._update_requested.wait(DropboxSettings.delta_sync_interval)
+
+    def request_update(self):
+        """Update the mirror as soon as possible, without waiting for the update to complete."""
+        self._update_requested.set()
+
+    def stop(self):
+        """Stop updating the mirror."""
+        self._stopped.set()
+        self._update_requested.set()
@@ -0,0 +1,101 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+from threading import Lock
+from time import time
+
+from cloudalpha.exceptions import AccessFailedFileSystemError
+from cloudalpha.services.dropbox.settings import DropboxSettings
+
+
+class QuotaTracker(object):
+    """Keeps track of the quota and of the space used on a Dropbox account.
+    
+    The quota information is requested from Dropbox at most once every
+    DropboxSettings.quota_sync_interval seconds. In between, the space used is
+    adjusted locally as files are added and deleted. Operations whose effect on
+    the space used is unknown make the next request ask Dropbox again.
+    """
+
+    _client_pool = None
+    _quota = None
+    _used = None
+    _synced_time = None
+    _lock = None
+
+    def sync(self):
+        """Request the quota information from Dropbox if it is missing or out of date.
+        
+        If Dropbox is inaccessible, raise AccessFailedFileSystemError.
+        """
+        with self._lock:
+            if self._synced_time is not None and time() - self._synced_time < DropboxSettings.quota_sync_interval:
+                return
+            try:
+                with self._client_pool.borrow() as client:
+                    quota_info = client.account_info()["quota_info"]
+            except:
+                raise AccessFailedFileSystemError()
+            self._quota = quota_info["quota"]
+            self._used = quota_info["normal"] + quota_info["shared"]
+            self._synced_time = time()
+
+    @property
+    def space_used(self):
+        """Return the number of bytes used on the account.
+        
+        If Dropbox is inaccessible, raise AccessFailedFileSystemError.
+        """
+        self.sync()
+        with self._lock:
+            return self._used
+
+    @property
+    def free_space(self):
+        """Return the free space remaining on the account, in bytes.
+        
+        If Dropbox is inaccessible, raise AccessFailedFileSystemError.
+        """
+        self.sync()
+        with self._lock:
+            return max(self._quota - self._used, 0)
+
+    def adjust(self, num_bytes):
+        """Add num_bytes, which may be negative, to the space used on the account."""
+        with self._lock:
+            if self._used is not None:
+                self._used = max(self._used + num_bytes, 0)
+
+    def invalidate(self):
+        """Make the next request ask Dropbox for the quota information again."""
+        with self._lock:
+            self._synced_time = None
+
+    def after_fork(self):
+        """Replace the lock inherited from the parent process. Must be called in a child process
+        created by os.fork, before using the tracker.
+        """
+        self._lock = Lock()
+
+    def __init__(self, client_pool):
+        """Create a tracker requesting the quota information with clients borrowed from the given DropboxClientPool."""
+        self._client_pool = client_pool
+        self._lock = Lock()
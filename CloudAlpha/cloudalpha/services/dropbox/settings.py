@@ -20,13 +20,24 @@
 # =============================================================================
 
 from cloudalpha.settings import Settings
-from cloudalpha.exceptions import InvalidNameSettingError
+from cloudalpha.exceptions import InvalidNameSettingError, ValueParsingSettingError
 
 class DropboxSettings(Settings):
     """This class contains global settings accessible by all Dropbox accounts."""
 
     app_key = None
     app_secret = None
+    metadata_cache_ttl = 10
+    metadata_cache_max_entries = 10000
+    negative_cache_ttl = 2
+    negative_cache_max_entries = 10000
+    delta_sync = False
+    delta_sync_interval = 60
+    metadata_index_file = None
+    api_url = None
+    client_pool_size = 8
+    client_keep_alive = 30
+    quota_sync_interval = 60
 
     @classmethod
     def set(cls, name, value):
@@ -41,5 +52,56 @@ class DropboxSettings(Settings):
             cls.app_key = str(value)
         elif name == "app_secret":
             cls.app_secret = str(value)
+        elif name == "metadata_cache_ttl":
+            try:
+                cls.metadata_cache_ttl = float(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "metadata_cache_max_entries":
+            try:
+                cls.metadata_cache_max_entries = int(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "negative_cache_ttl":
+            try:
+                cls.negative_cache_ttl = float(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "negative_cache_max_entries":
+            try:
+                cls.negative_cache_max_entries = int(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "delta_sync":
+            if str(value).lower() in ("true", "1", "yes"):
+                cls.delta_sync = True
+            elif str(value).lower() in ("false", "0", "no"):
+                cls.delta_sync = False
+            else:
+                raise ValueParsingSettingError
+        elif name == "delta_sync_interval":
+            try:
+                cls.delta_sync_interval = float(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "metadata_index_file":
+            cls.metadata_index_file = str(value)
+        elif name == "api_url":
+            cls.api_url = str(value)
+        elif name == "client_pool_size":
+            try:
+                cls.client_pool_size = int(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "client_keep_alive":
+            try:
+                cls.client_keep_alive = float(value)
+            except:
+                raise ValueParsingSettingError
+        elif name == "quota_sync_interval":
+            try:
+                cls.quota_sync_interval = float(value)
+            except:
+                raise ValueParsingSettingError
         else:
             raise InvalidNameSettingError
\ No newline at end of file
@@ -0,0 +1,40 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+from urllib.parse import urlsplit, urlunsplit
+
+from dropbox.client import DropboxClient
+
+from cloudalpha.services.dropbox.settings import DropboxSettings
+
+
+class StandInDropboxClient(DropboxClient):
+    """A DropboxClient that sends all its requests to the URL set by DropboxSettings.api_url
+    instead of the Dropbox servers, for instance to a local HTTP stand-in for the Dropbox API.
+    """
+
+    def request(self, target, params=None, method='POST', content_server=False, notification_server=False):
+        """Build the URL, parameters and headers of a request, then redirect the URL to DropboxSettings.api_url."""
+        url, params, headers = super(StandInDropboxClient, self).request(target, params, method, content_server, notification_server)
+        api_url = urlsplit(DropboxSettings.api_url)
+        url = urlsplit(url)
+        url = urlunsplit((api_url.scheme, api_url.netloc, api_url.path.rstrip("/") + url.path, url.query, url.fragment))
+        return url, params, headers
@@ -0,0 +1,57 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+import calendar
+import time
+
+_MONTHS = {"Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
+           "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12}
+_DAYS_MAX_ENTRIES = 4096
+
+# The number of seconds since the epoch at the beginning of each recently parsed day,
+# keyed by the "%d %b %Y" part of the timestamps
+_days = {}
+
+
+def parse_timestamp(value):
+    """Return the number of seconds since the epoch corresponding to the given Dropbox timestamp,
+    formatted as "%a, %d %b %Y %H:%M:%S +0000", for instance "Sat, 21 Aug 2010 22:31:20 +0000".
+    
+    The format is parsed without regard to the locale. The beginning of each day is computed
+    once and remembered, as the files of a directory are often modified on the same days.
+    
+    If the value is not a valid timestamp, raise ValueError.
+    """
+    if len(value) != 31 or value[25:] != " +0000" or value[16] != " " or value[19] != ":" or value[22] != ":":
+        # Not the usual fixed-width format
+        return float(calendar.timegm(time.strptime(value, "%a, %d %b %Y %H:%M:%S +0000")))
+    day_key = value[5:16]
+    day_start = _days.get(day_key)
+    if day_start is None:
+        try:
+            month = _MONTHS[day_key[3:6]]
+        except KeyError:
+            raise ValueError("Invalid month in timestamp " + repr(value))
+        day_start = calendar.timegm((int(day_key[7:11]), month, int(day_key[0:2]), 0, 0, 0))
+        if len(_days) >= _DAYS_MAX_ENTRIES:
+            _days.clear()
+        _days[day_key] = day_start
+    return float(day_start + int(value[17:19]) * 3600 + int(value[20:22]) * 60 + int(value[23:25]))
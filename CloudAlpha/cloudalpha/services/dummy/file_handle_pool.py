@@ -0,0 +1,148 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+from collections import OrderedDict
+import mmap
+import os
+import stat
+from threading import Lock
+
+
+class FileHandlePool(object):
+    """A pool of at most max_handles file descriptors open for reading, keyed by real path, so that
+    the successive reads of a file do not need to open and close it each time.
+    
+    The least recently used descriptors are closed first. A descriptor is only closed once no thread
+    is using it anymore. The descriptors of a path must be invalidated when the file is replaced,
+    moved or deleted. The files must not be modified in place.
+    
+    Files of at least mmap_min_size bytes are memory-mapped, and read as memoryview objects over
+    the mapping, which is shared by all the reads of the file until it is invalidated. A mapping is
+    released once all the memoryview objects returned from it are.
+    """
+
+    _max_handles = 0
+    _mmap_min_size = 0
+    _handles = None
+    _lock = None
+
+    def _close(self, handle):
+        """Close the descriptor of the given handle if it is not in use, or mark it to be closed when released."""
+        handle[2] = True
+        if handle[1] == 0:
+            os.close(handle[0])
+
+    def _acquire(self, real_path):
+        """Return the handle of the given real path, opening the file if needed, and mark it as in use.
+        
+        If the path does not correspond to a file, raise the corresponding OSError.
+        """
+        with self._lock:
+            handle = self._handles.get(real_path)
+            if handle is not None:
+                self._handles.move_to_end(real_path)
+                handle[1] += 1
+                return handle
+        fd = os.open(real_path, os.O_RDONLY)
+        try:
+            stat_result = os.fstat(fd)
+            if stat.S_ISDIR(stat_result.st_mode):
+                raise IsADirectoryError(real_path)
+        except:
+            os.close(fd)
+            raise
+        # A handle is a list holding the descriptor, the number of threads using it, whether it must be closed,
+        # the size of the file and its mapping, if any
+        handle = [fd, 1, False, stat_result.st_size, None]
+        with self._lock:
+            other_handle = self._handles.get(real_path)
+            if other_handle is not None:
+                # Another thread opened the same file concurrently
+                other_handle[1] += 1
+                os.close(fd)
+                return other_handle
+            self._handles[real_path] = handle
+            while len(self._handles) > self._max_handles:
+                self._close(self._handles.popitem(last=False)[1])
+        return handle
+
+    def _release(self, handle):
+        """Mark the given handle as no longer in use by the current thread, and close it if it was invalidated or evicted."""
+        with self._lock:
+            handle[1] -= 1
+            if handle[2] and handle[1] == 0:
+                os.close(handle[0])
+
+    def _get_mapping(self, handle):
+        """Return the mapping of the file of the given handle, creating it if needed."""
+        with self._lock:
+            mapping = handle[4]
+        if mapping is None:
+            mapping = memoryview(mmap.mmap(handle[0], 0, access=mmap.ACCESS_READ))
+            with self._lock:
+                if handle[4] is None:
+                    handle[4] = mapping
+                else:
+                    # Another thread mapped the same file concurrently
+                    mapping = handle[4]
+        return mapping
+
+    def read(self, real_path, start_byte, num_bytes=None):
+        """Read the number of bytes corresponding to num_bytes from the file corresponding to the given real path,
+        beginning at start_byte. If num_bytes is not specified, read all remaining bytes of the file.
+        
+        Return a bytes object, or a memoryview object if the file is memory-mapped.
+        
+        If the path does not correspond to a file, raise the corresponding OSError.
+        """
+        handle = self._acquire(real_path)
+        try:
+            if num_bytes is None:
+                num_bytes = handle[3] - start_byte
+            if num_bytes <= 0 or start_byte >= handle[3]:
+                return b""
+            if self._mmap_min_size > 0 and handle[3] >= self._mmap_min_size:
+                return self._get_mapping(handle)[start_byte:start_byte + num_bytes]
+            return os.pread(handle[0], num_bytes, start_byte)
+        finally:
+            self._release(handle)
+
+    def invalidate(self, real_path):
+        """Close the descriptors of the given real path and of all its subpaths."""
+        prefix = os.path.join(real_path, "")
+        with self._lock:
+            for path in [p for p in self._handles if p == real_path or p.startswith(prefix)]:
+                self._close(self._handles.pop(path))
+
+    def after_fork(self):
+        """Replace the lock inherited from the parent process. Must be called in a child process
+        created by os.fork, before using the pool.
+        """
+        self._lock = Lock()
+
+    def __init__(self, max_handles, mmap_min_size=0):
+        """Create a pool keeping at most max_handles descriptors open, and memory-mapping the files
+        of at least mmap_min_size bytes. If mmap_min_size is zero, no file is memory-mapped.
+        """
+        self._max_handles = max(max_handles, 1)
+        self._mmap_min_size = mmap_min_size
+        self._handles = OrderedDict()
+        self._lock = Lock()
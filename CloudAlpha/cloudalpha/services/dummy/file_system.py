@@ -21,6 +21,8 @@
 
 import os
 import shutil
+import stat
+from multiprocessing import Value
 from threading import RLock
 from datetime import datetime
 
@@ -29,39 +31,73 @@ from cloudalpha.exceptions import AccessFailedFileSystemError, IDNotFoundFileSys
 from cloudalpha.exceptions import InsufficientSpaceFileSystemError
 from cloudalpha.file_system import FileSystem
 from cloudalpha.file_metadata import FileMetadata
+from cloudalpha.content_listing import ContentListing
+from cloudalpha.path_lock_manager import PathLockManager
+from cloudalpha.services.dummy.file_handle_pool import FileHandlePool
 
 
 class DummyFileSystem(FileSystem):
     """The file system of a dummy storage account, for testing purposes."""
 
+    supports_local_files = True
+
     _REAL_ROOT_DIR = ".dummyroot"
     _TEMP_DIR = ".dummytemp"
+    _MAX_OPEN_FILES = 64
+    # The files of at least this size are read from a memory-mapped view
+    _MMAP_MIN_SIZE = 1048576
 
     _total_space = 1000000000
-    _space_used = 0
+    # A counter shared with the instances copied in child processes by os.fork
+    _space_used = None
     _new_files = {}
     _next_new_file_id = 0
 
     _lock = None
+    _path_locks = None
+    _state_lock = None
+    _file_handles = None
 
     @property
     def lock(self):
-        """Return the Lock object for the current instance."""
+        """Return the Lock object for the current instance.
+        
+        Holding it prevents any other thread from operating on the file system.
+        """
         return self._lock
 
+    def get_path_lock(self, *paths):
+        """Return a Lock object preventing other threads from operating on the given paths,
+        on their subpaths and from modifying their ancestors, for operations that span several calls.
+        
+        The given paths must be absolute POSIX pathnames, with "/" representing the root of the file system.
+        """
+        return self._path_locks.exclusive(*paths)
+
     def _get_real_path(self, path):
         """Return the real path corresponding to the specified virtual path.
         """
         return os.path.abspath(os.path.join(self._REAL_ROOT_DIR, path[1:]))
 
+    def invalidate_cache(self, path):
+        """Close the pooled read handles of the given path and of its subpaths, as they were modified by another process.
+        
+        The given path must be an absolute POSIX pathname, with "/" representing the root of the file system.
+        """
+        self._file_handles.invalidate(self._get_real_path(path))
+
+    def _invalidate(self, path):
+        """Close the pooled read handles of the given path and of its subpaths after a modification, and notify the modification listeners."""
+        self.invalidate_cache(path)
+        self._notify_modified(path)
+
     @property
     def space_used(self):
         """Return the number of bytes used on the file system.
         
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
-            return self._space_used
+        return self._space_used.value
 
     @property
     def free_space(self):
@@ -69,8 +105,7 @@ class DummyFileSystem(FileSystem):
         
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
-            return self._total_space - self._space_used
+        return self._total_space - self._space_used.value
 
     def exists(self, path):
         """Return True if the given path points to an existing file or directory, excluding uncommitted files.
@@ -79,7 +114,7 @@ class DummyFileSystem(FileSystem):
         
         If the real file system is inaccessible, raise AccessFailedFileSystemError.        
         """
-        with self._lock:
+        with self._path_locks.shared(path):
             return os.path.exists(self._get_real_path(path))
 
     def list_dir(self, path):
@@ -94,7 +129,7 @@ class DummyFileSystem(FileSystem):
         If the given path does not correspond to a directory, raise InvalidTargetFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
+        with self._path_locks.shared(path):
             path = self._get_real_path(path)
             if not os.path.exists(path):
                 raise InvalidPathFileSystemError()
@@ -114,7 +149,7 @@ class DummyFileSystem(FileSystem):
         If the given path is invalid, raise InvalidPathFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
+        with self._path_locks.shared(path):
             path = self._get_real_path(path)
             if not os.path.exists(path):
                 raise InvalidPathFileSystemError
@@ -128,7 +163,7 @@ class DummyFileSystem(FileSystem):
         If the given path is invalid, raise InvalidPathFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
+        with self._path_locks.shared(path):
             path = self._get_real_path(path)
             if not os.path.exists(path):
                 raise InvalidPathFileSystemError
@@ -143,7 +178,7 @@ class DummyFileSystem(FileSystem):
         If the given path is invalid, raise InvalidPathFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError. 
         """
-        with self._lock:
+        with self._path_locks.shared(path):
             path = self._get_real_path(path)
             if not os.path.exists(path):
                 raise InvalidPathFileSystemError()
@@ -160,16 +195,28 @@ class DummyFileSystem(FileSystem):
         If the given path is invalid, raise InvalidPathFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError. 
         """
-        with self._lock:
-            if self.exists(path):
-                is_dir = self.is_dir(path)
-                if is_dir:
-                    size = 0
-                else:
-                    size = self.get_size(path)
-                return FileMetadata(path, is_dir, size, self.get_created_datetime(path), self.get_accessed_datetime(path), self.get_modified_datetime(path))
-            else:
+        with self._path_locks.shared(path):
+            try:
+                stat_result = os.stat(self._get_real_path(path))
+            except (FileNotFoundError, NotADirectoryError):
                 raise InvalidPathFileSystemError
+            except:
+                raise AccessFailedFileSystemError()
+            is_dir = stat.S_ISDIR(stat_result.st_mode)
+            return FileMetadata(path, is_dir, 0 if is_dir else stat_result.st_size, stat_result.st_ctime,
+                                stat_result.st_atime, stat_result.st_mtime)
+
+    def get_metadata_many(self, paths):
+        """Return a list of FileMetadata objects representing the files or directories corresponding
+        to the given iterable of paths, in the same order. For each invalid path, the list contains None.
+        
+        The given paths must be absolute POSIX pathnames, with "/" representing the root of the file system.
+        
+        Local paths are handled one after the other, as a pool of threads would not make it faster.
+        
+        If the real file system is inaccessible, raise AccessFailedFileSystemError.
+        """
+        return [self._get_metadata_or_none(path) for path in paths]
 
     def get_content_metadata(self, path):
         """Return an iterable of FileMetadata objects representing the contents of the directory corresponding to the given path.
@@ -180,19 +227,29 @@ class DummyFileSystem(FileSystem):
         If the given path does not point to a directory, raise InvalidTargetFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.         
         """
-        with self._lock:
-            if self.exists(path):
-                if self.is_dir(path):
-                    if path[-1:] != "/":
-                        path += "/"
-                    res = []
-                    for filename in self.list_dir(path):
-                        res.append(self.get_metadata(path + filename))
-                    return res
-                else:
+        with self._path_locks.shared(path):
+            prefix = path.rstrip("/") + "/"
+            content_listing = ContentListing()
+            try:
+                with os.scandir(self._get_real_path(path)) as entries:
+                    for entry in entries:
+                        # The result of the stat call is cached by the DirEntry object
+                        try:
+                            stat_result = entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        is_dir = stat.S_ISDIR(stat_result.st_mode)
+                        content_listing.add(prefix + entry.name, is_dir, 0 if is_dir else stat_result.st_size,
+                                            stat_result.st_ctime, stat_result.st_atime, stat_result.st_mtime)
+            except FileNotFoundError:
+                raise InvalidPathFileSystemError
+            except NotADirectoryError:
+                if os.path.isfile(self._get_real_path(path)):
                     raise InvalidTargetFileSystemError
-            else:
                 raise InvalidPathFileSystemError
+            except:
+                raise AccessFailedFileSystemError()
+            return content_listing
 
     def get_created_datetime(self, path):
         """Return the date and time of creation of the file or directory corresponding to the given path.
@@ -205,7 +262,7 @@ class DummyFileSystem(FileSystem):
         If the given path is invalid, raise InvalidPathFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
+        with self._path_locks.shared(path):
             path = self._get_real_path(path)
             if not os.path.exists(path):
                 raise InvalidPathFileSystemError
@@ -224,7 +281,7 @@ class DummyFileSystem(FileSystem):
         If the given path is invalid, raise InvalidPathFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
+        with self._path_locks.shared(path):
             path = self._get_real_path(path)
             if not os.path.exists(path):
                 raise InvalidPathFileSystemError
@@ -244,7 +301,7 @@ class DummyFileSystem(FileSystem):
         If the given path is invalid, raise InvalidPathFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
+        with self._path_locks.shared(path):
             path = self._get_real_path(path)
             if not os.path.exists(path):
                 raise InvalidPathFileSystemError
@@ -262,7 +319,7 @@ class DummyFileSystem(FileSystem):
         If the given path corresponds to an existing file or directory, raise AlreadyExistsFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
+        with self._path_locks.exclusive(path):
             real_path = self._get_real_path(path)
             real_parent_path = real_path.rsplit("/", 1)[0].rsplit("\\", 1)[0]
             if not os.path.exists(real_parent_path):
@@ -273,6 +330,8 @@ class DummyFileSystem(FileSystem):
                 os.mkdir(real_path)
             except:
                 raise AccessFailedFileSystemError()
+            finally:
+                self._invalidate(path)
 
     def move(self, old_path, new_path):
         """Move and/or rename a file or directory from old_path to new_path.
@@ -286,7 +345,7 @@ class DummyFileSystem(FileSystem):
         If new_path is a subpath of old_path , raise ForbiddenOperationFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
+        with self._path_locks.exclusive(old_path, new_path):
             real_old_path = self._get_real_path(old_path)
             real_new_path = self._get_real_path(new_path)
             if not os.path.exists(real_old_path):
@@ -299,6 +358,9 @@ class DummyFileSystem(FileSystem):
                 raise ForbiddenOperationFileSystemError()
             except:
                 raise AccessFailedFileSystemError()
+            finally:
+                self._invalidate(old_path)
+                self._invalidate(new_path)
 
     def copy(self, path, copy_path):
         """Copy a file or directory from path to copy_path.
@@ -311,7 +373,7 @@ class DummyFileSystem(FileSystem):
         If new_path is a subpath of old_path , raise ForbiddenOperationFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError. 
         """
-        with self._lock:
+        with self._path_locks.lock((path,), (copy_path,)):
             real_path = self._get_real_path(path)
             real_copy_path = self._get_real_path(copy_path)
             if not os.path.exists(real_path):
@@ -327,6 +389,8 @@ class DummyFileSystem(FileSystem):
                     shutil.copy(real_path, real_copy_path)
             except:
                 raise AccessFailedFileSystemError()
+            finally:
+                self._invalidate(copy_path)
 
     def delete(self, path):
         """Delete the file or directory corresponding to the given path.
@@ -339,23 +403,26 @@ class DummyFileSystem(FileSystem):
         If the given path is invalid, raise InvalidPathFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
-            path = self._get_real_path(path)
-            if os.path.exists(path):
+        with self._path_locks.exclusive(path):
+            real_path = self._get_real_path(path)
+            if os.path.exists(real_path):
                 try:
-                    if os.path.isdir(path):
-                        dir_size = 0
-                        for dir_path, dir_names, filenames in os.walk(path):
+                    if os.path.isdir(real_path):
+                        size = 0
+                        for dir_path, dir_names, filenames in os.walk(real_path):
                             for f in filenames:
                                 fp = os.path.join(dir_path, f)
-                                dir_size += os.path.getsize(fp)
-                        self._space_used -= dir_size
-                        shutil.rmtree(path)
+                                size += os.path.getsize(fp)
+                        shutil.rmtree(real_path)
                     else:
-                        self._space_used -= os.path.getsize(path)
-                        os.remove(path)
+                        size = os.path.getsize(real_path)
+                        os.remove(real_path)
+                    with self._space_used.get_lock():
+                        self._space_used.value -= size
                 except:
                     raise AccessFailedFileSystemError()
+                finally:
+                    self._invalidate(path)
             else:
                 raise InvalidPathFileSystemError()
 
@@ -369,26 +436,42 @@ class DummyFileSystem(FileSystem):
         
         The given path must be an absolute POSIX pathname, with "/" representing the root of the file system.
         
-        The return value is an iterable of bytes.
+        The return value is an iterable of bytes. For the files of at least _MMAP_MIN_SIZE bytes, it is a
+        memoryview object over a memory-mapped view of the file, shared by the concurrent reads.
+        
+        If the given path is invalid, raise InvalidPathFileSystemError.
+        If the given path corresponds to a directory, raise InvalidTargetFileSystemError.
+        If the real file system is inaccessible, raise AccessFailedFileSystemError.
+        """
+        with self._path_locks.shared(path):
+            try:
+                return self._file_handles.read(self._get_real_path(path), start_byte, num_bytes)
+            except (FileNotFoundError, NotADirectoryError):
+                raise InvalidPathFileSystemError()
+            except IsADirectoryError:
+                raise InvalidTargetFileSystemError()
+            except:
+                raise AccessFailedFileSystemError()
+
+    def open_local_file(self, path):
+        """Return a file object open for reading in binary mode on the local file holding the contents
+        of the file corresponding to the given path. The contents of the returned file do not change
+        while it is open, even if the file is replaced or deleted. The caller must close it.
+        
+        The given path must be an absolute POSIX pathname, with "/" representing the root of the file system.
         
         If the given path is invalid, raise InvalidPathFileSystemError.
         If the given path corresponds to a directory, raise InvalidTargetFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
+        with self._path_locks.shared(path):
             real_path = self._get_real_path(path)
             if not os.path.exists(real_path):
                 raise InvalidPathFileSystemError()
             if os.path.isdir(real_path):
                 raise InvalidTargetFileSystemError()
-            if num_bytes == None:
-                num_bytes = self.get_size(path) - start_byte
             try:
-                file = open(real_path, 'rb')
-                file.seek(start_byte)
-                data = bytearray(file.read(num_bytes))
-                file.close()
-                return data
+                return open(real_path, "rb")
             except:
                 raise AccessFailedFileSystemError()
 
@@ -398,10 +481,11 @@ class DummyFileSystem(FileSystem):
         
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
+        with self._state_lock:
             new_file_id = self._next_new_file_id = self._next_new_file_id + 1
             temp_dir_path = os.path.abspath(self._TEMP_DIR)
-            temp_path = os.path.join(temp_dir_path, str(new_file_id))
+            # The process ID keeps the names unique among the processes sharing the directory
+            temp_path = os.path.join(temp_dir_path, "%d-%d" % (os.getpid(), new_file_id))
             try:
                 self._new_files[new_file_id] = open(temp_path, "ab")
             except:
@@ -417,18 +501,19 @@ class DummyFileSystem(FileSystem):
         If there is not enough free space to store the new data, raise InsufficientSpaceFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
+        with self._state_lock:
             if new_file_id not in self._new_files:
                 raise IDNotFoundFileSystemError
-            if len(data) > self.free_space:
-                raise InsufficientSpaceFileSystemError
-            self._space_used += len(data)
+            with self._space_used.get_lock():
+                if len(data) > self.free_space:
+                    raise InsufficientSpaceFileSystemError
+                self._space_used.value += len(data)
             temp_file = self._new_files[new_file_id]
         try:
             temp_file.write(data)
         except:
-            with self._lock:
-                self._space_used -= len(data)
+            with self._space_used.get_lock():
+                self._space_used.value -= len(data)
             raise AccessFailedFileSystemError
 
     def commit_new_file(self, new_file_id, path):
@@ -443,9 +528,11 @@ class DummyFileSystem(FileSystem):
         If the given path corresponds to an existing directory, raise InvalidTargetFileSystemError.  
         If the real file system is inaccessible, raise AccessFailedFileSystemError.
         """
-        with self._lock:
-            if new_file_id not in self._new_files:
-                raise IDNotFoundFileSystemError
+        with self._path_locks.exclusive(path):
+            with self._state_lock:
+                if new_file_id not in self._new_files:
+                    raise IDNotFoundFileSystemError
+                temp_file = self._new_files[new_file_id]
             real_path = self._get_real_path(path)
             real_parent_path = real_path.rsplit("/", 1)[0].rsplit("\\", 1)[0]
             if not os.path.exists(real_parent_path):
@@ -454,13 +541,15 @@ class DummyFileSystem(FileSystem):
                 raise InvalidTargetFileSystemError
             if os.path.isdir(real_path):
                 raise InvalidTargetFileSystemError
-            temp_file = self._new_files[new_file_id]
             try:
                 temp_file.close()
                 shutil.move(temp_file.name, real_path)
-                del self._new_files[new_file_id]
+                with self._state_lock:
+                    del self._new_files[new_file_id]
             except:
                 raise AccessFailedFileSystemError
+            finally:
+                self._invalidate(path)
 
     def flush_new_file(self, new_file_id):
         """Delete an uncommitted file.
@@ -468,20 +557,36 @@ class DummyFileSystem(FileSystem):
         If there is no uncommited file corresponding to new_file_id, raise IDNotFoundFileSystemError.
         If the real file system is inaccessible, raise AccessFailedFileSystemError.                
         """
-        with self._lock:
+        with self._state_lock:
             if new_file_id not in self._new_files:
                 raise IDNotFoundFileSystemError
             temp_file = self._new_files[new_file_id]
             try:
-                self._space_used -= temp_file.tell()
+                with self._space_used.get_lock():
+                    self._space_used.value -= temp_file.tell()
                 temp_file.close()
                 os.remove(temp_file.name)
             except:
                 raise AccessFailedFileSystemError()
 
+    def after_fork(self):
+        """Discard the locks and the uncommitted files inherited from the parent process. The pooled read handles
+        remain usable, and the space used remains shared with the parent process and its other children.
+        Must be called in a child process created by os.fork, before using the current instance.
+        """
+        self._path_locks = PathLockManager()
+        self._lock = self._path_locks.exclusive("/")
+        self._state_lock = RLock()
+        self._new_files = {}
+        self._file_handles.after_fork()
+
     def __init__(self, account):
         """DummyFileSystem initializer"""
-        self._lock = RLock()
+        self._path_locks = PathLockManager()
+        self._lock = self._path_locks.exclusive("/")
+        self._state_lock = RLock()
+        self._space_used = Value("q", 0)
+        self._file_handles = FileHandlePool(self._MAX_OPEN_FILES, self._MMAP_MIN_SIZE)
         super(DummyFileSystem, self).__init__(account)
         root = os.path.abspath(self._REAL_ROOT_DIR)
         temp = os.path.abspath(self._TEMP_DIR)
@@ -0,0 +1,97 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+import json
+import sqlite3
+from threading import Lock
+import time
+
+
+class SharedMetadataStore(object):
+    """A SQLite-backed store of metadata entries shared by several processes, indexed by
+    namespace and key. It allows the MetadataCache instances of processes serving the same
+    accounts to reuse the metadata requested by each other.
+    
+    Entries expire after the time to live given when they are stored. The values must be
+    serializable to JSON.
+    
+    Each process must open the database file with its own instance.
+    """
+
+    _TABLE_NAME = "shared_metadata"
+    _PURGE_INTERVAL = 1000
+
+    _db_file = None
+    _db_conn = None
+    _lock = None
+    _num_sets = 0
+
+    def _connect(self):
+        """Open the connection to the database."""
+        self._db_conn = sqlite3.connect(self._db_file, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db_conn.execute("PRAGMA journal_mode=WAL")
+        # The store only holds a cache, which does not need to survive a crash
+        self._db_conn.execute("PRAGMA synchronous=OFF")
+
+    def get(self, namespace, key):
+        """Return the value stored under the given namespace and key. If there is no such value, or if it expired, return None."""
+        with self._lock:
+            row = self._db_conn.execute("SELECT value FROM " + self._TABLE_NAME + " WHERE namespace = ? AND key = ? AND expiry >= ?",
+                                        (namespace, key, time.time())).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set(self, namespace, key, value, ttl):
+        """Store the given value under the given namespace and key for ttl seconds."""
+        data = json.dumps(value)
+        with self._lock:
+            self._db_conn.execute("INSERT OR REPLACE INTO " + self._TABLE_NAME + "(namespace, key, expiry, value) VALUES(?, ?, ?, ?)",
+                                  (namespace, key, time.time() + ttl, data))
+            self._num_sets += 1
+            if self._num_sets % self._PURGE_INTERVAL == 0:
+                self._db_conn.execute("DELETE FROM " + self._TABLE_NAME + " WHERE expiry < ?", (time.time(),))
+
+    def invalidate(self, namespace, key):
+        """Remove the value stored under the given namespace and key, if any."""
+        with self._lock:
+            self._db_conn.execute("DELETE FROM " + self._TABLE_NAME + " WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def invalidate_tree(self, namespace, key):
+        """Remove the values stored under the given namespace, for the given key and all the keys beginning with key + "/".
+        If key is "/", remove all the values of the namespace.
+        """
+        with self._lock:
+            if key == "/":
+                self._db_conn.execute("DELETE FROM " + self._TABLE_NAME + " WHERE namespace = ?", (namespace,))
+            else:
+                # The range covers exactly the keys beginning with key + "/", as "0" follows "/"
+                self._db_conn.execute("DELETE FROM " + self._TABLE_NAME + " WHERE namespace = ? AND (key = ? OR (key >= ? AND key < ?))",
+                                      (namespace, key, key + "/", key + "0"))
+
+    def __init__(self, db_file):
+        """Open or create a store in the given SQLite database file."""
+        self._db_file = db_file
+        self._lock = Lock()
+        self._connect()
+        self._db_conn.execute("CREATE TABLE IF NOT EXISTS " + self._TABLE_NAME
+                              + "(namespace TEXT NOT NULL, key TEXT NOT NULL, expiry REAL NOT NULL, value TEXT NOT NULL,"
+                              + " PRIMARY KEY (namespace, key))")
@@ -0,0 +1,312 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+from hashlib import md5
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+from threading import Lock, Thread
+import time
+from urllib.parse import parse_qs, unquote, urlsplit
+
+
+class _StandInRequestHandler(BaseHTTPRequestHandler):
+    """Handle the requests made to a StandInDropboxServer."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        """Do not log the requests."""
+
+    def _send(self, status, body=b"", content_type="application/json", headers=()):
+        """Send a response with the given status and body."""
+        if not isinstance(body, (bytes, bytearray)):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self, method):
+        """Parse the request, pass it to the server, and send back its response."""
+        url = urlsplit(self.path)
+        params = dict((name, values[0]) for name, values in parse_qs(url.query).items())
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if method == "POST":
+            params.update((name, values[0]) for name, values in parse_qs(body.decode()).items())
+        self.server.stand_in.request_count += 1
+        try:
+            # Like Dropbox, ignore repeated slashes
+            path = "/".join(part for part in unquote(url.path).split("/") if part)
+            response = self.server.stand_in.handle(method, "/" + path, params, body, self.headers)
+        except _StandInError as e:
+            self._send(e.status, {"error": e.message} if e.message else b"")
+            return
+        if isinstance(response, tuple):
+            self._send(206 if response[1] else 200, response[0], "application/octet-stream", response[1])
+        else:
+            self._send(200, response)
+
+    def do_GET(self):
+        """Handle a GET request."""
+        self._handle("GET")
+
+    def do_POST(self):
+        """Handle a POST request."""
+        self._handle("POST")
+
+    def do_PUT(self):
+        """Handle a PUT request."""
+        self._handle("PUT")
+
+
+class _StandInError(Exception):
+    """An error response of a StandInDropboxServer."""
+
+    def __init__(self, status, message=None):
+        super(_StandInError, self).__init__(status, message)
+        self.status = status
+        self.message = message
+
+
+class StandInDropboxServer(object):
+    """A local HTTP stand-in for version 1 of the Dropbox API, keeping the files of a single account
+    in memory, to be used through a StandInDropboxClient by setting DropboxSettings.api_url to its url.
+
+    It implements the requests made by DropboxFileSystem, QuotaTracker and NamespaceMirror: account
+    information, metadata with folder hashes, delta, file operations, ranged downloads and chunked uploads.
+    The access token is not checked.
+
+    The request_count attribute counts the requests received. While the available attribute
+    is False, every request fails with a 503 error.
+    """
+
+    MODIFIED = "Sat, 21 Aug 2010 22:31:20 +0000"
+
+    quota = 1 << 30
+    request_count = 0
+    available = True
+
+    _http_server = None
+    _thread = None
+    _lock = None
+    _entries = None
+    _contents = None
+    _changes = None
+    _uploads = None
+    _next_rev = 1
+
+    @property
+    def url(self):
+        """Return the URL to which DropboxSettings.api_url must be set to use the server."""
+        return "http://%s:%d" % self._http_server.server_address[:2]
+
+    @staticmethod
+    def _key(path):
+        """Return the lowercase form of the given path, without its trailing "/"."""
+        return "/" + path.strip("/").lower() if path.strip("/") else "/"
+
+    @staticmethod
+    def _parent_key(key):
+        """Return the key of the parent directory of the given key."""
+        return key.rsplit("/", 1)[0] or "/"
+
+    def _children(self, key):
+        """Return the keys of the contents of the directory corresponding to the given key."""
+        prefix = key.rstrip("/") + "/"
+        return [child_key for child_key in self._entries
+                if child_key.startswith(prefix) and child_key[len(prefix):] and "/" not in child_key[len(prefix):]]
+
+    def _put(self, path, is_dir, data=b""):
+        """Create or replace the file or directory corresponding to the given path, and log the change."""
+        key = self._key(path)
+        dropbox_meta = {"path": "/" + path.strip("/"), "is_dir": is_dir, "bytes": len(data),
+                        "modified": time.strftime("%a, %d %b %Y %H:%M:%S +0000", time.gmtime())}
+        if not is_dir:
+            dropbox_meta["rev"] = "%x" % self._next_rev
+            self._next_rev += 1
+            self._contents[key] = bytes(data)
+        self._entries[key] = dropbox_meta
+        self._changes.append((key, dropbox_meta))
+        return dropbox_meta
+
+    def _remove(self, key):
+        """Delete the file or directory corresponding to the given key, with its contents, and log the change."""
+        for child_key in [child_key for child_key in self._entries if child_key.startswith(key + "/")]:
+            del self._entries[child_key]
+            self._contents.pop(child_key, None)
+        del self._entries[key]
+        self._contents.pop(key, None)
+        self._changes.append((key, None))
+
+    def _get_existing(self, path):
+        """Return the Dropbox metadata dictionary of the given path. If it does not exist, raise a 404 error."""
+        dropbox_meta = self._entries.get(self._key(path))
+        if dropbox_meta is None:
+            raise _StandInError(404, "Path '%s' not found" % path)
+        return dropbox_meta
+
+    def _check_new(self, path):
+        """If the given path exists or its parent directory does not, raise an error."""
+        key = self._key(path)
+        if key in self._entries:
+            raise _StandInError(403, "A file with that name already exists at path '%s'." % path)
+        parent_meta = self._entries.get(self._parent_key(key))
+        if parent_meta is None or not parent_meta["is_dir"]:
+            raise _StandInError(403, "The parent of path '%s' is not a folder." % path)
+
+    def _get_metadata(self, path, params):
+        """Return the response to a metadata request, or raise a 304 error if the folder hash is unchanged."""
+        dropbox_meta = dict(self._get_existing(path))
+        if dropbox_meta["is_dir"] and params.get("list", "true").lower() == "true":
+            contents = [self._entries[child_key] for child_key in sorted(self._children(self._key(path)))]
+            dropbox_meta["hash"] = md5(json.dumps(contents, sort_keys=True).encode()).hexdigest()
+            if params.get("hash") == dropbox_meta["hash"]:
+                raise _StandInError(304)
+            dropbox_meta["contents"] = contents
+        return dropbox_meta
+
+    def _delta(self, params):
+        """Return the response to a delta request, listing all the entries if no cursor is given."""
+        cursor = params.get("cursor")
+        prefix = self._key(params["path_prefix"]) if params.get("path_prefix") else "/"
+        if cursor is None:
+            changes = sorted((key, self._entries[key]) for key in self._entries if key != "/")
+        else:
+            changes = self._changes[int(cursor):]
+        entries = [[key, dropbox_meta] for key, dropbox_meta in changes
+                   if prefix == "/" or key == prefix or key.startswith(prefix + "/")]
+        return {"entries": entries, "reset": cursor is None, "cursor": str(len(self._changes)), "has_more": False}
+
+    def _get_file(self, path, headers):
+        """Return the content of a file and the headers of the response, honoring the Range header."""
+        dropbox_meta = self._get_existing(path)
+        if dropbox_meta["is_dir"]:
+            raise _StandInError(404, "Path '%s' is a folder" % path)
+        data = self._contents[self._key(path)]
+        byte_range = headers.get("Range")
+        if not byte_range:
+            return data, ()
+        start, end = byte_range.split("=", 1)[1].split("-")
+        if not start:
+            start, end = max(len(data) - int(end), 0), len(data) - 1
+        start, end = int(start), int(end) if end else len(data) - 1
+        return data[start:end + 1], (("Content-Range", "bytes %d-%d/%d" % (start, min(end, len(data) - 1), len(data))),)
+
+    def _upload_chunk(self, params, body):
+        """Append the given data to an upload, creating it if no upload_id is given."""
+        upload_id = params.get("upload_id")
+        if upload_id is None:
+            upload_id = "upload%d" % len(self._uploads)
+            self._uploads[upload_id] = bytearray()
+        elif upload_id not in self._uploads:
+            raise _StandInError(404, "The upload_id was not found or has expired.")
+        upload = self._uploads[upload_id]
+        if int(params.get("offset", 0)) != len(upload):
+            raise _StandInError(400, "Submitted input out of alignment: expected upload offset %d" % len(upload))
+        if self._space_used() + len(body) > self.quota:
+            raise _StandInError(507, "User is over quota.")
+        upload += body
+        return {"upload_id": upload_id, "offset": len(upload)}
+
+    def _space_used(self):
+        """Return the total size of the files of the account."""
+        return sum(len(data) for data in self._contents.values())
+
+    def _commit_chunked_upload(self, path, params):
+        """Store an upload at the given path."""
+        upload = self._uploads.pop(params.get("upload_id"), None)
+        if upload is None:
+            raise _StandInError(400, "The upload_id was not found or has expired.")
+        existing_meta = self._entries.get(self._key(path))
+        if existing_meta is not None:
+            if existing_meta["is_dir"] or params.get("overwrite", "true").lower() != "true":
+                raise _StandInError(409, "A file or folder already exists at path '%s'." % path)
+        else:
+            self._check_new(path)
+        return self._put(path, False, upload)
+
+    def _copy(self, from_path, to_path, move):
+        """Copy a file or directory, and delete the original if move is True."""
+        from_key = self._key(from_path)
+        self._get_existing(from_path)
+        self._check_new(to_path)
+        to_path = "/" + to_path.strip("/")
+        for key in sorted(key for key in self._entries if key == from_key or key.startswith(from_key + "/")):
+            dropbox_meta = self._entries[key]
+            new_path = to_path + dropbox_meta["path"][len(from_key):]
+            self._put(new_path, dropbox_meta["is_dir"], self._contents.get(key, b""))
+        if move:
+            self._remove(from_key)
+        return self._entries[self._key(to_path)]
+
+    def handle(self, method, path, params, body, headers):
+        """Return the response to the given request, as a JSON-serializable object, or as a tuple of the data
+        and the additional headers of a download. In case of error, raise _StandInError.
+        """
+        with self._lock:
+            if not self.available:
+                raise _StandInError(503, "Service unavailable")
+            if method == "GET" and path == "/1/account/info":
+                return {"uid": 1, "display_name": "Stand-in", "quota_info": {"quota": self.quota, "normal": self._space_used(), "shared": 0}}
+            if method == "GET" and path.startswith("/1/metadata/auto"):
+                return self._get_metadata(path[len("/1/metadata/auto"):] or "/", params)
+            if method == "POST" and path == "/1/delta":
+                return self._delta(params)
+            if method == "GET" and path.startswith("/1/files/auto/"):
+                return self._get_file(path[len("/1/files/auto"):], headers)
+            if method == "PUT" and path == "/1/chunked_upload":
+                return self._upload_chunk(params, body)
+            if method == "POST" and path.startswith("/1/commit_chunked_upload/auto/"):
+                return self._commit_chunked_upload(path[len("/1/commit_chunked_upload/auto"):], params)
+            if method == "POST" and path == "/1/fileops/create_folder":
+                self._check_new(params["path"])
+                return self._put(params["path"], True)
+            if method == "POST" and path == "/1/fileops/delete":
+                dropbox_meta = self._get_existing(params["path"])
+                self._remove(self._key(params["path"]))
+                return dict(dropbox_meta, is_deleted=True)
+            if method == "POST" and path in ("/1/fileops/move", "/1/fileops/copy"):
+                return self._copy(params["from_path"], params["to_path"], path.endswith("move"))
+            raise _StandInError(404, "Unknown request %s %s" % (method, path))
+
+    def start(self):
+        """Start serving requests in a background thread."""
+        self._thread = Thread(target=self._http_server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving requests and close the listening socket."""
+        self._http_server.shutdown()
+        self._http_server.server_close()
+
+    def __init__(self, address=("127.0.0.1", 0)):
+        """Create a server with an empty account, listening on the given address."""
+        self._lock = Lock()
+        self._entries = {"/": {"path": "/", "is_dir": True, "bytes": 0, "modified": self.MODIFIED}}
+        self._contents = {}
+        self._changes = []
+        self._uploads = {}
+        self._http_server = ThreadingHTTPServer(address, _StandInRequestHandler)
+        self._http_server.daemon_threads = True
+        self._http_server.stand_in = self
@@ -0,0 +1,151 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from cloudalpha.content_cache import ContentCache
+from cloudalpha.file_system_view import FileSystemView
+from cloudalpha.managers.ftp.ftp_server.read_ahead_reader import ReadAheadReader
+from cloudalpha.managers.ftp.settings import FTPSettings
+from tests.test_dropbox_file_system import DropboxTestCase
+
+
+class ContentCacheTest(DropboxTestCase):
+
+    def setUp(self):
+        super(ContentCacheTest, self).setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, True)
+        self.content_cache = ContentCache(self.cache_dir, 1 << 20)
+        self.file_system_view = FileSystemView(self.file_system)
+        self.file_system_view.content_cache = self.content_cache
+        self.data = os.urandom(10000)
+        self.store("/file", self.data)
+
+    def read_all(self, metadata=None, block_size=1000):
+        """Read the whole file block by block through the FileSystemView."""
+        blocks = []
+        offset = 0
+        while True:
+            block = self.file_system_view.read("/file", offset, block_size, metadata)
+            if not block:
+                return b"".join(blocks)
+            blocks.append(bytes(block))
+            offset += len(block)
+
+    def test_sequential_read_is_cached(self):
+        self.assertEqual(self.read_all(), self.data)
+        with mock.patch.object(self.file_system, "read", wraps=self.file_system.read) as read:
+            self.assertEqual(self.read_all(), self.data)
+            self.assertEqual(bytes(self.file_system_view.read("/file", 1234, 10)), self.data[1234:1244])
+        self.assertEqual(read.call_count, 0)
+        local_file = self.file_system_view.open_local_file("/file")
+        self.addCleanup(local_file.close)
+        self.assertEqual(local_file.read(), self.data)
+
+    def test_metadata_is_requested_once_per_open(self):
+        metadata = self.file_system_view.get_metadata("/file")
+        with mock.patch.object(self.file_system, "get_metadata", wraps=self.file_system.get_metadata) as get_metadata:
+            self.assertEqual(self.read_all(metadata), self.data)
+            self.assertEqual(self.read_all(metadata), self.data)
+        self.assertEqual(get_metadata.call_count, 0)
+
+    def test_blocks_read_out_of_order_are_cached(self):
+        metadata = self.file_system_view.get_metadata("/file")
+        for offset in reversed(range(0, len(self.data), 1000)):
+            self.assertEqual(bytes(self.file_system_view.read("/file", offset, 1000, metadata)), self.data[offset:offset + 1000])
+        self.assertEqual(os.listdir(self.cache_dir), [next(iter(self.content_cache._files))])
+        with mock.patch.object(self.file_system, "read", wraps=self.file_system.read) as read:
+            self.assertEqual(self.read_all(), self.data)
+        self.assertEqual(read.call_count, 0)
+
+    def test_parallel_download_is_cached(self):
+        saved_settings = dict((name, getattr(FTPSettings, name)) for name in
+                              ("read_ahead_block_size", "parallel_download_streams", "parallel_download_min_size"))
+        self.addCleanup(lambda: [setattr(FTPSettings, name, value) for name, value in saved_settings.items()])
+        FTPSettings.read_ahead_block_size = 1000
+        FTPSettings.parallel_download_streams = 4
+        FTPSettings.parallel_download_min_size = 1000
+        reader = ReadAheadReader(self.file_system_view, "/file")
+        reader.start()
+        self.addCleanup(reader.close)
+        blocks = []
+        while True:
+            block = reader.read(4096)
+            if not block:
+                break
+            blocks.append(block)
+        self.assertEqual(b"".join(blocks), self.data)
+        reader.join()
+        self.assertEqual(len(self.content_cache._partial_files), 0)
+        self.assertFalse([filename for filename in os.listdir(self.cache_dir) if filename.endswith(".part")])
+        with mock.patch.object(self.file_system, "read", wraps=self.file_system.read) as read:
+            self.assertEqual(self.read_all(), self.data)
+        self.assertEqual(read.call_count, 0)
+
+    def test_modified_file_is_not_served_from_cache(self):
+        self.read_all()
+        new_data = os.urandom(5000)
+        self.store("/file", new_data)
+        self.assertEqual(self.read_all(), new_data)
+
+    def test_cache_is_shared_with_a_new_instance(self):
+        self.read_all()
+        self.file_system_view.content_cache = ContentCache(self.cache_dir, 1 << 20)
+        with mock.patch.object(self.file_system, "read", wraps=self.file_system.read) as read:
+            self.assertEqual(self.read_all(), self.data)
+        self.assertEqual(read.call_count, 0)
+
+    def test_partial_files_count_against_budget(self):
+        self.content_cache = ContentCache(self.cache_dir, 15000)
+        self.file_system_view.content_cache = self.content_cache
+        metadata = self.file_system_view.get_metadata("/file")
+        for offset in range(0, 6000, 1000):
+            self.file_system_view.read("/file", offset, 1000, metadata)
+        self.assertEqual(self.content_cache._size, 6000)
+        self.store("/other", os.urandom(10000))
+        offset = 0
+        while self.file_system_view.read("/other", offset, 1000):
+            offset += 1000
+        self.assertEqual(self.content_cache._size, 10000)
+        self.assertEqual(len(self.content_cache._partial_files), 0)
+        self.assertEqual(os.listdir(self.cache_dir), list(self.content_cache._files))
+
+    def test_only_orphan_partial_files_are_deleted(self):
+        self.file_system_view.read("/file", 0, 1000)
+        partial_filename = next(filename for filename in os.listdir(self.cache_dir) if filename.endswith(".part"))
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        orphan_filename = "%s-%d-1.part" % ("0" * 40, pid)
+        open(os.path.join(self.cache_dir, orphan_filename), "wb").close()
+        ContentCache(self.cache_dir, 1 << 20)
+        self.assertIn(partial_filename, os.listdir(self.cache_dir))
+        self.assertNotIn(orphan_filename, os.listdir(self.cache_dir))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,235 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+import threading
+import time
+import unittest
+from unittest import mock
+from datetime import datetime
+
+from cloudalpha.exceptions import IDNotFoundFileSystemError, InvalidTargetFileSystemError
+from cloudalpha.services.dropbox.account import DropboxAccount
+from cloudalpha.services.dropbox.namespace_mirror import NamespaceMirror
+from cloudalpha.services.dropbox.settings import DropboxSettings
+from cloudalpha.services.dropbox.stand_in_client import StandInDropboxClient
+from tests.dropbox_stand_in import StandInDropboxServer
+
+
+class DropboxTestCase(unittest.TestCase):
+    """A test case running a DropboxFileSystem against a StandInDropboxServer."""
+
+    settings = {"metadata_cache_ttl": "10", "delta_sync_interval": "60"}
+
+    def setUp(self):
+        self.server = StandInDropboxServer()
+        self.server.start()
+        self.addCleanup(self.server.stop)
+        saved_settings = dict((name, getattr(DropboxSettings, name)) for name in list(self.settings) + ["api_url"])
+        self.addCleanup(lambda: [setattr(DropboxSettings, name, value) for name, value in saved_settings.items()])
+        DropboxSettings.set("api_url", self.server.url)
+        for name, value in self.settings.items():
+            DropboxSettings.set(name, value)
+        self.account = DropboxAccount("test")
+        self.account._validate_token("token")
+        self.file_system = self.account.file_system
+
+    def store(self, path, data):
+        """Upload a file with the given content through the file system."""
+        new_file_id = self.file_system.create_new_file()
+        self.file_system.write_to_new_file(new_file_id, data)
+        self.file_system.commit_new_file(new_file_id, path)
+
+    def start_namespace_mirror(self):
+        """Start the in-memory mirror of the account and wait until it is bootstrapped."""
+        self.file_system._start_namespace_mirror()
+        self.addCleanup(self.file_system._namespace_mirror_thread.join)
+        self.addCleanup(self.file_system._namespace_mirror_thread.stop)
+        deadline = time.time() + 5
+        while not self.file_system._namespace_mirror.ready:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+
+class DropboxFileSystemTest(DropboxTestCase):
+
+    def test_store_and_read(self):
+        self.file_system.make_dir("/dir")
+        self.store("/dir/file.txt", b"0123456789")
+        self.assertEqual(self.file_system.list_dir("/dir"), ["file.txt"])
+        self.assertEqual(self.file_system.get_size("/dir/file.txt"), 10)
+        self.assertEqual(bytes(self.file_system.read("/dir/file.txt", 2, 3)), b"234")
+
+    def test_modified_datetime_is_utc(self):
+        self.store("/file.txt", b"abc")
+        modified = self.server._entries[self.server._key("/file.txt")]["modified"]
+        self.assertEqual(self.file_system.get_modified_datetime("/file.txt"),
+                         datetime.strptime(modified, "%a, %d %b %Y %H:%M:%S +0000"))
+
+    def test_metadata_datetimes_match_file_system(self):
+        self.file_system.make_dir("/dir")
+        self.store("/dir/file.txt", b"abc")
+        # The local time zone must not matter
+        self.addCleanup(time.tzset)
+        with mock.patch.dict("os.environ", {"TZ": "EST+05EDT,M3.2.0,M11.1.0"}):
+            time.tzset()
+            for path in ("/", "/dir", "/dir/file.txt"):
+                self.assertEqual(self.file_system.get_metadata(path).modified_datetime,
+                                 self.file_system.get_modified_datetime(path))
+            for metadata in self.file_system.get_content_metadata("/dir"):
+                self.assertEqual(metadata.modified_datetime, self.file_system.get_modified_datetime(metadata.path))
+
+    def test_move_and_delete(self):
+        self.file_system.make_dir("/a")
+        self.store("/a/f", b"data")
+        self.file_system.move("/a", "/b")
+        self.assertFalse(self.file_system.exists("/a"))
+        self.assertTrue(self.file_system.exists("/b/f"))
+        self.file_system.delete("/b")
+        self.assertFalse(self.file_system.exists("/b"))
+
+    def test_upload_is_kept_until_committed(self):
+        self.file_system.make_dir("/dir")
+        new_file_id = self.file_system.create_new_file()
+        self.file_system.write_to_new_file(new_file_id, b"abc")
+        self.assertRaises(InvalidTargetFileSystemError, self.file_system.commit_new_file, new_file_id, "/dir")
+        self.file_system.commit_new_file(new_file_id, "/file")
+        self.assertEqual(self.file_system.get_size("/file"), 3)
+        self.assertRaises(IDNotFoundFileSystemError, self.file_system.commit_new_file, new_file_id, "/other")
+
+    def test_children_are_served_from_listing(self):
+        self.file_system.make_dir("/dir")
+        self.store("/dir/a", b"abc")
+        self.assertEqual(self.file_system.list_dir("/dir"), ["a"])
+        self.assertNotIn("contents", self.file_system._metadata_cache.get("/dir"))
+        self.assertIsNone(self.file_system._metadata_cache.get("/dir/a"))
+        request_count = self.server.request_count
+        metadata = self.file_system.get_metadata("/DIR/A")
+        self.assertEqual((metadata.path, metadata.is_dir, metadata.size), ("/DIR/A", False, 3))
+        self.assertFalse(self.file_system.exists("/dir/b"))
+        self.assertEqual(self.server.request_count, request_count)
+
+    def run_concurrently(self, method_name, *functions):
+        """Call the given functions in separate threads, each of them reaching the given method of the
+        Dropbox client before any of them proceeds, and return the exceptions they raised.
+        """
+        barrier = threading.Barrier(len(functions), timeout=5)
+        original = getattr(StandInDropboxClient, method_name)
+        errors = []
+
+        def wait_for_others(client, *args, **kwargs):
+            barrier.wait()
+            return original(client, *args, **kwargs)
+
+        def run(function):
+            try:
+                function()
+            except Exception as e:
+                errors.append(e)
+
+        with mock.patch.object(StandInDropboxClient, method_name, wait_for_others):
+            threads = [threading.Thread(target=run, args=(function,), daemon=True) for function in functions]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(10)
+        return errors
+
+    def test_concurrent_make_dir_in_same_directory(self):
+        self.file_system.make_dir("/dir")
+        errors = self.run_concurrently("file_create_folder", lambda: self.file_system.make_dir("/dir/a"),
+                                       lambda: self.file_system.make_dir("/dir/b"))
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(self.file_system.list_dir("/dir")), ["a", "b"])
+
+    def test_concurrent_uploads_in_same_directory(self):
+        self.file_system.make_dir("/dir")
+        errors = self.run_concurrently("commit_chunked_upload", lambda: self.store("/dir/a", b"a"),
+                                       lambda: self.store("/dir/b", b"b"))
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(self.file_system.list_dir("/dir")), ["a", "b"])
+
+
+class NamespaceMirrorTest(DropboxTestCase):
+
+    def test_mirror_lists_existing_files(self):
+        self.file_system.make_dir("/dir")
+        self.store("/dir/file.txt", b"abc")
+        self.start_namespace_mirror()
+        request_count = self.server.request_count
+        self.assertEqual(self.file_system.list_dir("/dir"), ["file.txt"])
+        self.assertEqual(self.file_system.get_size("/dir/file.txt"), 3)
+        self.assertEqual(self.server.request_count, request_count)
+
+    def test_modification_does_not_wait_for_mirror_update(self):
+        self.start_namespace_mirror()
+        namespace_mirror = self.file_system._namespace_mirror
+        # Hold the mirror back, as if an update were stalled
+        with namespace_mirror._update_lock:
+            self.file_system.make_dir("/new")
+            self.store("/new/file.txt", b"abc")
+            self.assertTrue(self.file_system.exists("/new/file.txt"))
+            self.assertEqual(self.file_system.list_dir("/"), ["new"])
+            self.assertFalse(namespace_mirror.is_current("/new/file.txt"))
+        deadline = time.time() + 5
+        while not namespace_mirror.is_current("/new/file.txt"):
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(namespace_mirror.get("/new/file.txt")["bytes"], 3)
+        self.assertEqual(self.file_system.list_dir("/new"), ["file.txt"])
+
+    def test_failed_update_is_logged(self):
+        self.start_namespace_mirror()
+        self.server.available = False
+        with self.assertLogs("cloudalpha.services.dropbox.namespace_mirror_thread") as logs:
+            self.file_system._namespace_mirror_thread.request_update()
+            deadline = time.time() + 5
+            while not logs.output:
+                self.assertLess(time.time(), deadline)
+                time.sleep(0.01)
+        self.assertIn("Failed to update", logs.output[0])
+        self.assertFalse(self.file_system._namespace_mirror.ready)
+
+
+    def test_replica_follows_mirror(self):
+        self.file_system.make_dir("/dir")
+        self.start_namespace_mirror()
+        namespace_mirror = self.file_system._namespace_mirror
+        replica = NamespaceMirror(None)
+        replica.apply_replica_update(namespace_mirror.get_replica_update(), [])
+        self.assertTrue(replica.is_current("/dir"))
+        self.assertTrue(replica.get("/dir")["is_dir"])
+        self.assertIsNone(namespace_mirror.get_replica_update())
+        with namespace_mirror._update_lock:
+            self.store("/dir/file.txt", b"abc")
+            replica.apply_replica_update(namespace_mirror.get_replica_update(), [])
+            self.assertFalse(replica.is_current("/dir/file.txt"))
+        deadline = time.time() + 5
+        while not namespace_mirror.is_current("/dir/file.txt"):
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        # The paths modified through the replica remain stale
+        replica.apply_replica_update(namespace_mirror.get_replica_update(), ["/other.txt"])
+        self.assertTrue(replica.is_current("/dir/file.txt"))
+        self.assertEqual(replica.get("/dir/file.txt")["bytes"], 3)
+        self.assertFalse(replica.is_current("/other.txt"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,303 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+import errno
+import ftplib
+import io
+import os
+import shutil
+import signal
+import socket
+import tempfile
+from threading import Lock, Thread
+import time
+import unittest
+from unittest import mock
+
+from cloudalpha.exceptions import InsufficientSpaceFileSystemError
+from cloudalpha.managers.ftp.ftp_server.async_ftp_server import AsyncFTPServer
+from cloudalpha.managers.ftp.ftp_server.async_ftp_session import AsyncFTPSession
+from cloudalpha.managers.ftp.ftp_server.ftp_server import FTPServer
+from cloudalpha.managers.ftp.ftp_server.prefork_ftp_server import PreforkFTPServer
+from cloudalpha.managers.ftp.settings import FTPSettings
+from cloudalpha.services.dummy.account import DummyAccount
+
+
+class FTPServerTestCase(unittest.TestCase):
+    """A test case running an FTP server for a DummyAccount, with an FTP client logged in to it."""
+
+    def setUp(self):
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir, True)
+        self.addCleanup(os.chdir, os.getcwd())
+        # DummyFileSystem stores its files relatively to the current directory
+        os.chdir(work_dir)
+        self.account = DummyAccount("test")
+        self.account.authenticate()
+        self.file_system = self.account.file_system
+        self.username = "user%d" % id(self)
+        FTPServer().add_user(self.username, "password", self.file_system.get_new_view())
+        self.addCleanup(FTPServer().remove_user, self.username)
+        self.port = self.start_server()
+        self.client = self.connect()
+
+    def start_server(self):
+        """Start an FTP server listening on a free port of the loopback interface, and return the port."""
+        server = FTPServer()._create_threaded_server(("127.0.0.1", 0))
+        thread = Thread(target=server.serve_forever, kwargs={"timeout": 0.05}, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(server.close_all)
+        return server.socket.getsockname()[1]
+
+    def connect(self):
+        """Return a new FTP client logged in to the server."""
+        client = ftplib.FTP(timeout=10)
+        client.connect("127.0.0.1", self.port)
+        self.addCleanup(client.close)
+        client.login(self.username, "password")
+        return client
+
+    def retrieve(self, path):
+        """Return the contents of the given file, downloaded in binary mode."""
+        data = io.BytesIO()
+        self.client.retrbinary("RETR " + path, data.write)
+        return data.getvalue()
+
+
+class UploadTest(FTPServerTestCase):
+
+    def test_upload(self):
+        self.client.storbinary("STOR /dir1/up.bin", io.BytesIO(b"z" * 300000))
+        self.assertEqual(self.retrieve("/dir1/up.bin"), b"z" * 300000)
+
+    def test_failed_upload_is_aborted_and_not_committed(self):
+        with mock.patch.object(self.file_system, "write_to_new_file", side_effect=InsufficientSpaceFileSystemError), \
+                mock.patch.object(self.file_system, "commit_new_file", wraps=self.file_system.commit_new_file) as commit_new_file:
+            with self.assertRaises(ftplib.error_temp) as context:
+                self.client.storbinary("STOR /up.bin", io.BytesIO(b"x" * 1000))
+        self.assertTrue(str(context.exception).startswith("426"))
+        self.assertEqual(commit_new_file.call_count, 0)
+        self.assertFalse(self.file_system.exists("/up.bin"))
+        # The data channel was closed, so that the session can go on
+        self.client.storbinary("STOR /up.bin", io.BytesIO(b"x" * 1000))
+        self.assertEqual(self.retrieve("/up.bin"), b"x" * 1000)
+
+
+class DownloadTest(FTPServerTestCase):
+
+    def test_download(self):
+        self.client.storbinary("STOR /down.bin", io.BytesIO(b"y" * 300000))
+        self.assertEqual(self.retrieve("/down.bin"), b"y" * 300000)
+
+    def test_failed_sendfile_falls_back_on_send(self):
+        self.client.storbinary("STOR /down.bin", io.BytesIO(b"y" * 300000))
+
+        def sendfile(*args):
+            raise OSError(errno.EINVAL, "Invalid argument")
+
+        with mock.patch("pyftpdlib.handlers.sendfile", sendfile), \
+                self.assertLogs("pyftpdlib", "WARNING") as logs:
+            self.assertEqual(self.retrieve("/down.bin"), b"y" * 300000)
+        self.assertIn("sendfile() failed", logs.output[0])
+
+
+class AsyncFTPServerTestCase(FTPServerTestCase):
+    """A test case running an AsyncFTPServer instead of a pyftpdlib ThreadedFTPServer."""
+
+    def start_server(self):
+        """Start an AsyncFTPServer listening on a free port of the loopback interface, and return the port."""
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        server = AsyncFTPServer(("127.0.0.1", port), FTPServer()._authorizer)
+        thread = Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(server.stop)
+        deadline = time.time() + 5
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port)).close()
+                break
+            except ConnectionRefusedError:
+                self.assertLess(time.time(), deadline)
+                time.sleep(0.01)
+        return port
+
+
+class AsyncTransferTest(AsyncFTPServerTestCase):
+
+    def test_passive_and_active_transfers(self):
+        self.client.storbinary("STOR /up.bin", io.BytesIO(b"z" * 300000))
+        self.assertEqual(self.retrieve("/up.bin"), b"z" * 300000)
+        self.client.set_pasv(False)
+        self.assertEqual(self.retrieve("/up.bin"), b"z" * 300000)
+
+    def test_append(self):
+        self.client.storbinary("STOR /log.txt", io.BytesIO(b"abc"))
+        self.client.storbinary("APPE /log.txt", io.BytesIO(b"def"))
+        self.client.storbinary("APPE /new.txt", io.BytesIO(b"ghi"))
+        self.assertEqual(self.retrieve("/log.txt"), b"abcdef")
+        self.assertEqual(self.retrieve("/new.txt"), b"ghi")
+
+    def test_stalled_data_connection_times_out(self):
+        with mock.patch.object(AsyncFTPSession, "data_timeout", 0.2):
+            self.client.voidcmd("TYPE I")
+            data_connection = self.client.transfercmd("STOR /up.bin")
+            self.addCleanup(data_connection.close)
+            with self.assertRaises(ftplib.error_temp) as context:
+                self.client.voidresp()
+        self.assertTrue(str(context.exception).startswith("421"))
+        self.assertFalse(self.file_system.exists("/up.bin"))
+
+
+class AsyncDataChannelSecurityTest(AsyncFTPServerTestCase):
+
+    def assertRefused(self, cmd):
+        with self.assertRaises(ftplib.error_perm) as context:
+            self.client.sendcmd(cmd)
+        self.assertTrue(str(context.exception).startswith("501"))
+
+    def test_foreign_active_address_is_refused(self):
+        self.assertRefused("PORT 10,0,0,1,200,10")
+        self.assertRefused("EPRT |1|10.0.0.1|51210|")
+
+    def test_privileged_active_port_is_refused(self):
+        self.assertRefused("PORT 127,0,0,1,0,25")
+        self.assertRefused("EPRT |1|127.0.0.1|25|")
+
+    def test_foreign_passive_peer_is_rejected(self):
+        self.client.storbinary("STOR /up.bin", io.BytesIO(b"data"))
+        self.client.voidcmd("TYPE I")
+        port = int(self.client.sendcmd("EPSV").split("|")[3])
+        foreign_connection = socket.socket()
+        self.addCleanup(foreign_connection.close)
+        foreign_connection.bind(("127.0.0.2", 0))
+        foreign_connection.connect(("127.0.0.1", port))
+        foreign_connection.settimeout(5)
+        self.assertEqual(foreign_connection.recv(1), b"")
+        data_connection = socket.create_connection(("127.0.0.1", port))
+        self.addCleanup(data_connection.close)
+        self.client.sendcmd("RETR /up.bin")
+        self.assertEqual(data_connection.recv(10), b"data")
+        data_connection.close()
+        self.client.voidresp()
+
+
+class AsyncCommandTest(AsyncFTPServerTestCase):
+
+    def test_stat(self):
+        self.assertIn("Logged in as: %s" % self.username, self.client.sendcmd("STAT"))
+        self.client.storbinary("STOR /file.txt", io.BytesIO(b"abc"))
+        response = self.client.sendcmd("STAT /")
+        self.assertTrue(response.startswith("213-"))
+        self.assertIn("file.txt", response)
+
+    def test_site(self):
+        self.client.storbinary("STOR /file.txt", io.BytesIO(b"abc"))
+        self.assertIn("CHMOD", self.client.sendcmd("SITE HELP"))
+        # The users are not given the permission to change file modes
+        with self.assertRaises(ftplib.error_perm) as context:
+            self.client.sendcmd("SITE CHMOD 644 /file.txt")
+        self.assertEqual(str(context.exception), "550 Not enough privileges.")
+        with mock.patch.object(FTPServer()._authorizer, "has_perm", return_value=True):
+            self.assertTrue(self.client.sendcmd("SITE CHMOD 644 /file.txt").startswith("200"))
+            with self.assertRaises(ftplib.error_perm):
+                self.client.sendcmd("SITE CHMOD 999 /file.txt")
+
+    def test_permissions_are_checked(self):
+        self.client.storbinary("STOR /file.txt", io.BytesIO(b"abc"))
+
+        def has_perm(username, perm, path=None):
+            return perm != "w"
+
+        with mock.patch.object(FTPServer()._authorizer, "has_perm", has_perm):
+            with self.assertRaises(ftplib.error_perm) as context:
+                self.client.storbinary("STOR /other.txt", io.BytesIO(b"abc"))
+            self.assertEqual(str(context.exception), "550 Not enough privileges.")
+            self.assertEqual(self.retrieve("/file.txt"), b"abc")
+
+
+class PreforkTest(FTPServerTestCase):
+    """Tests running a PreforkFTPServer with a single worker."""
+
+    def start_server(self):
+        """Start a PreforkFTPServer listening on a free port of the loopback interface, and return the port."""
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        with mock.patch.object(FTPSettings, "worker_processes", 1):
+            self.server = PreforkFTPServer(("127.0.0.1", port), FTPServer()._create_threaded_server,
+                                           FTPServer()._file_system_views)
+        thread = Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(self.server.stop)
+        deadline = time.time() + 5
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port)).close()
+                break
+            except ConnectionRefusedError:
+                self.assertLess(time.time(), deadline)
+                time.sleep(0.01)
+        return port
+
+    def test_space_used_is_shared_with_workers(self):
+        space_used = self.file_system.space_used
+        self.client.storbinary("STOR /file.bin", io.BytesIO(b"x" * 1000))
+        self.assertEqual(self.file_system.space_used, space_used + 1000)
+
+    def test_reload_keeps_sessions_open(self):
+        self.client.storbinary("STOR /file.bin", io.BytesIO(b"x" * 1000))
+        old_pids = set(self.server._workers)
+        self.server.reload()
+        deadline = time.time() + 5
+        while len(self.server._workers) < 2:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(self.retrieve("/file.bin"), b"x" * 1000)
+        new_client = self.connect()
+        self.assertIn("file.bin", new_client.nlst("/"))
+        # The replaced worker exits once its session is closed
+        self.client.quit()
+        while set(self.server._workers) & old_pids:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        self.assertIn("file.bin", new_client.nlst("/"))
+
+    def test_invalid_message_is_logged_and_ignored(self):
+        channel, parent_channel = socket.socketpair()
+        self.addCleanup(channel.close)
+        parent_channel.sendall(b'invalid\n[0, "/file.bin"]\n')
+        parent_channel.close()
+        file_system = mock.Mock()
+        with mock.patch("cloudalpha.managers.ftp.ftp_server.prefork_ftp_server.logger") as logger, \
+                mock.patch("os.kill") as kill:
+            PreforkFTPServer._receive_messages([file_system], channel, Lock(), [])
+        logger.exception.assert_called_once_with("Ignored an invalid message from the parent process")
+        file_system.invalidate_cache.assert_called_once_with("/file.bin")
+        kill.assert_called_once_with(os.getpid(), signal.SIGTERM)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+# =============================================================================
+# Copyright (C) 2014 Pier-Luc Brault and Alex Cline
+#
+# This file is part of CloudAlpha.
+#
+# CloudAlpha is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CloudAlpha is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with CloudAlpha.  If not, see <http://www.gnu.org/licenses/>.
+#
+# http://github.com/plbrault/cloudalpha
+# =============================================================================
+
+import threading
+import unittest
+
+from cloudalpha.path_lock_manager import PathLockManager
+
+
+class PathLockManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = PathLockManager()
+
+    def acquire_in_thread(self, shared_paths=(), exclusive_paths=()):
+        """Take a lock in a new thread and return an event set once it is taken,
+        along with an event that makes the thread release it.
+        """
+        taken = threading.Event()
+        release = threading.Event()
+
+        def run():
+            with self.manager.lock(shared_paths, exclusive_paths):
+                taken.set()
+                release.wait(5)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        return taken, release
+
+    def acquire_after_release(self, release, shared_paths=(), exclusive_paths=()):
+        """Check that a lock on the given paths waits until the lock of another thread is
+        released through the given event, and return True if it is then taken.
+        """
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        self.addCleanup(timer.cancel)
+        with self.manager.lock(shared_paths, exclusive_paths):
+            return release.is_set()
+
+    def test_covered_paths_are_reentered(self):
+        with self.manager.lock((), ("/a",)):
+            taken, release = self.acquire_in_thread((), ("/b",))
+            self.assertTrue(taken.wait(5))
+            with self.manager.lock(("/A/b",), ("/a/c",)):
+                with self.manager.lock((), ("/a",)):
+                    pass
+
+    def test_shared_lock_does_not_cover_exclusive_reentry(self):
+        with self.manager.lock(("/a",)):
+            taken, release = self.acquire_in_thread(("/a/b",))
+            self.assertTrue(taken.wait(5))
+            self.assertTrue(self.acquire_after_release(release, (), ("/a/b",)))
+
+    def test_uncovered_paths_wait_for_other_threads(self):
+        taken, release = self.acquire_in_thread((), ("/b",))
+        self.assertTrue(taken.wait(5))
+        with self.manager.lock((), ("/a",)):
+            self.assertTrue(self.acquire_after_release(release, (), ("/b",)))
+
+    def test_parent_can_be_read_while_holding_child(self):
+        with self.manager.lock((), ("/dir/file",)):
+            with self.manager.lock(("/dir",)):
+                pass
+
+
+    def test_exclusive_subpaths_do_not_block_shared_parent(self):
+        taken, release = self.acquire_in_thread(("/dir",), ("/dir/a",))
+        self.assertTrue(taken.wait(5))
+        taken, release = self.acquire_in_thread(("/dir",), ("/dir/b",))
+        self.assertTrue(taken.wait(1))
+        taken, release = self.acquire_in_thread(("/",))
+        self.assertTrue(taken.wait(1))
+
+    def test_exclusive_ancestor_waits_for_subpaths(self):
+        taken, release = self.acquire_in_thread(("/dir/a",))
+        self.assertTrue(taken.wait(5))
+        self.assertTrue(self.acquire_after_release(release, (), ("/",)))
+
+if __name__ == "__main__":
+    unittest.main()